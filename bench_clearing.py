@@ -0,0 +1,196 @@
+"""
+WAPP DAM Platform — Clearing benchmark
+Synthetic WAPP-like markets of increasing size, cleared by every engine and mode.
+
+    python bench_clearing.py                       # 10–200 zones, 100–50 000 bids, both topologies
+    python bench_clearing.py --zones 10 --bids 100 1000 --engines sparse network
+    python bench_clearing.py --quick
+
+Each run records the per-stage times of `run_clearing_engine` (build, solve, extraction…)
+and the model size, and how far its zonal prices and welfare are from the first engine
+cleared on the same market (the monolithic Pyomo MILP by default) — e.g. to check the ADMM
+decomposition against the monolithic solve:
+
+    python bench_clearing.py --zones 100 200 --bids 10000 50000 --engines sparse admm --modes lp
+
+Results go to <out>/bench_<timestamp>.json (with machine and library versions) and .csv,
+one row per (market, engine, mode).
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+from datetime import datetime
+from importlib import metadata
+
+import numpy as np
+import pandas as pd
+
+from wapp_engine import ENGINES, MODES, run_clearing_engine
+
+TOPOLOGIES = ('radial', 'meshed')
+
+# Offer technologies: (share, price range €/MWh) — hydro, gas, oil/diesel thermal
+TECHNOS = [(0.25, (20, 45)), (0.45, (28, 65)), (0.30, (80, 170))]
+DEMAND_PRICES = (110, 250)
+SUPPLY_MARGIN = 1.3
+
+
+def generate_market(n_zones, n_bids, topology='meshed', seed=0):
+    """Deterministic market: (zones, offres, demandes, network) in the engine's input format.
+
+    Zones are scattered on a 1000 km square with lognormal sizes, so a few large systems
+    dominate as NGA, GHA and CIV do. 'radial' links each zone to its nearest predecessor
+    (a spanning tree, like the coastal and OMVG corridors); 'meshed' also links every zone
+    to its three nearest neighbours. 60 % of the bids are offers; prices sit on a 0.1 €
+    grid, so identical price levels recur as in real order books.
+    """
+    rng = np.random.default_rng([seed, n_zones, n_bids, TOPOLOGIES.index(topology)])
+    zones = [f"Z{i:03d}" for i in range(n_zones)]
+    xy = rng.uniform(0, 1000, (n_zones, 2))
+    size = rng.lognormal(0, 1, n_zones)
+
+    pairs = set()
+    for i in range(1, n_zones):
+        pairs.add((int(np.argmin(np.hypot(*(xy[:i] - xy[i]).T))), i))
+    if topology == 'meshed':
+        for i in range(n_zones):
+            for j in np.argsort(np.hypot(*(xy - xy[i]).T))[1:4]:
+                pairs.add((min(i, int(j)), max(i, int(j))))
+    network = [{'zone_from': zones[i], 'zone_to': zones[j], 'ntc_mw': float(round(rng.uniform(100, 800), -1))}
+               for i, j in sorted(pairs)]
+
+    n_off = max(1, round(n_bids * 0.6))
+    n_dem = max(1, n_bids - n_off)
+    supply_w = size * rng.lognormal(0, 0.7, n_zones)
+    z_off = rng.choice(n_zones, n_off, p=supply_w / supply_w.sum())
+    z_dem = rng.choice(n_zones, n_dem, p=size / size.sum())
+
+    tech = rng.choice(len(TECHNOS), n_off, p=[s for s, _ in TECHNOS])
+    lo = np.array([r[0] for _, r in TECHNOS])[tech]
+    hi = np.array([r[1] for _, r in TECHNOS])[tech]
+    p_off = np.round(rng.uniform(lo, hi), 1)
+    q_off = np.maximum(1, np.round(rng.lognormal(np.log(80), 0.8, n_off)))
+    q_dem = np.maximum(1, np.round(rng.lognormal(np.log(80 * n_off / (n_dem * SUPPLY_MARGIN)), 0.8, n_dem)))
+    p_dem = np.round(rng.uniform(*DEMAND_PRICES, n_dem), 1)
+
+    offres = [{'membre': f"G{k}", 'zone': zones[z], 'quantite_mw': float(q), 'prix_eur': float(p)}
+              for k, (z, q, p) in enumerate(zip(z_off, q_off, p_off))]
+    demandes = [{'membre': f"D{k}", 'zone': zones[z], 'quantite_mw': float(q), 'prix_eur': float(p)}
+                for k, (z, q, p) in enumerate(zip(z_dem, q_dem, p_dem))]
+    return zones, offres, demandes, network
+
+
+def bench_case(market, engine, mode, aggregate=True, ref=None):
+    """Clear one market and flatten the engine stats into a result row.
+
+    Returns the row and the result; with a reference result `ref`, the row also gets the
+    largest zonal price difference (€/MWh) and the relative welfare difference to it.
+    """
+    zones, offres, demandes, network = market
+    t0 = time.perf_counter()
+    res = run_clearing_engine(offres, demandes, network, engine=engine, mode=mode,
+                              aggregate=aggregate, zones=zones)
+    row = {'engine': engine, 'mode': mode, 'aggregate': aggregate,
+           'statut': 'optimal' if res else 'échec', 'wall_ms': round((time.perf_counter() - t0)*1000, 2)}
+    if res:
+        s = res['stats']
+        row['welfare'] = res['welfare']
+        row.update({f"t_{k}_ms": v for k, v in s['temps_ms'].items()})
+        row.update({k: s.get(k) for k in ('total_ms', 'nb_paliers', 'nb_variables', 'nb_contraintes',
+                                           'nb_binaires', 'nb_nonzeros', 'gap_mip', 'iterations')})
+        row['statut'] = s['statut']
+        if ref:
+            row['ecart_prix_max'] = max(abs(p - ref['prix'][z]) for z, p in res['prix'].items())
+            row['ecart_welfare_rel'] = (res['welfare'] - ref['welfare']) / abs(ref['welfare']) if ref['welfare'] else 0.0
+    return row, res
+
+
+def environment():
+    """Machine, interpreter, library versions and commit, stored with the results."""
+    versions = {}
+    for pkg in ('numpy', 'scipy', 'pyomo', 'highspy', 'networkx', 'pandas'):
+        try:
+            versions[pkg] = metadata.version(pkg)
+        except metadata.PackageNotFoundError:
+            versions[pkg] = None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'date': datetime.now().isoformat(timespec='seconds'), 'commit': commit,
+            'python': platform.python_version(), 'platform': platform.platform(),
+            'processor': platform.processor(), 'cpus': os.cpu_count(), 'versions': versions}
+
+
+def run_benchmark(zone_counts, bid_counts, topologies, engines, modes, aggregate=True, budget=60.0,
+                  seed=0, verbose=True):
+    """Clear every (zones, bids, topology) market with every engine and mode.
+
+    Bid counts run in increasing order: once an engine/mode takes more than `budget`
+    seconds on a market, its larger markets with the same zones and topology are skipped.
+    Prices and welfare are compared with the market's first successful clearing.
+    """
+    rows = []
+    for topology in topologies:
+        for n_zones in sorted(zone_counts):
+            over = set()
+            for n_bids in sorted(bid_counts):
+                market = generate_market(n_zones, n_bids, topology, seed)
+                case = {'zones': n_zones, 'bids': n_bids, 'topology': topology, 'lines': len(market[3])}
+                ref = None
+                for engine in engines:
+                    # The network engine ignores the mode; ADMM clears the LP formulation only
+                    for mode in {'network': modes[:1], 'admm': ['lp']}.get(engine, modes):
+                        if (engine, mode) in over:
+                            rows.append({**case, 'engine': engine, 'mode': mode, 'aggregate': aggregate,
+                                         'statut': 'ignoré'})
+                            continue
+                        row, res = bench_case(market, engine, mode, aggregate, ref)
+                        row = {**case, **row}
+                        ref = ref or res
+                        rows.append(row)
+                        if row['wall_ms'] > budget * 1000:
+                            over.add((engine, mode))
+                        if verbose:
+                            print(f"{topology:<7} {n_zones:>4} zones {n_bids:>6} ordres  {engine:<8} {mode:<5}"
+                                  f" {row['statut']:<8} {row['wall_ms']:>10,.1f} ms"
+                                  + (f"  welfare {row['welfare']:,.0f} €" if 'welfare' in row else "")
+                                  + (f"  Δprix {row['ecart_prix_max']:.3f}" if 'ecart_prix_max' in row else ""))
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark du moteur de clearing sur des marchés synthétiques")
+    ap.add_argument('--zones', type=int, nargs='+', default=[10, 50, 200])
+    ap.add_argument('--bids', type=int, nargs='+', default=[100, 1000, 10000, 50000])
+    ap.add_argument('--topologies', nargs='+', choices=TOPOLOGIES, default=list(TOPOLOGIES))
+    ap.add_argument('--engines', nargs='+', choices=list(ENGINES), default=list(ENGINES))
+    ap.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    ap.add_argument('--no-aggregate', action='store_true', help="résoudre ordre par ordre")
+    ap.add_argument('--budget', type=float, default=60.0,
+                    help="au-delà de ce temps (s), les marchés plus gros sont ignorés pour ce moteur")
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--quick', action='store_true', help="10–50 zones, 100–1000 ordres")
+    ap.add_argument('--out', default='bench_results')
+    args = ap.parse_args()
+    if args.quick:
+        args.zones, args.bids = [10, 50], [100, 1000]
+
+    meta = {**environment(), 'parametres': {k: v for k, v in vars(args).items() if k != 'out'}}
+    rows = run_benchmark(args.zones, args.bids, args.topologies, args.engines, args.modes,
+                         aggregate=not args.no_aggregate, budget=args.budget, seed=args.seed)
+
+    os.makedirs(args.out, exist_ok=True)
+    base = os.path.join(args.out, f"bench_{datetime.now():%Y%m%d-%H%M%S}")
+    with open(base + '.json', 'w') as f:
+        json.dump({'meta': meta, 'resultats': rows}, f, indent=1, default=str)
+    pd.DataFrame(rows).to_csv(base + '.csv', index=False)
+    print(f"→ {base}.json, {base}.csv")
+
+
+if __name__ == '__main__':
+    main()
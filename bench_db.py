@@ -0,0 +1,169 @@
+"""
+WAPP DAM Platform — Submission load test
+N concurrent writers submit bids as fast as they can, as participants do near gate
+closure, while readers render order books; reports sustained submissions per second,
+latency percentiles and failed submissions. Runs on a scratch database (WAPP_DB_PATH).
+
+    python bench_db.py                         # 1, 4, 16, 64 writer threads, 5 s each
+    python bench_db.py --writers 8 32 --duration 10 --processes
+    python bench_db.py --readers 0
+    python bench_db.py --seed 1000 10000       # seeding a session: bid by bid vs bulk API
+
+A submission is what the participant form does: `add_offre`, then `log_action`. The audit
+entry is only queued for the background writer, so the latencies leave its commit out;
+each writer flushes the queue before it stops, and the submissions per second are counted
+up to that point, audit writes included. Threads share one process like Streamlit sessions;
+--processes runs each writer in its own process, like the clearing workers.
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from wapp_engine import ZONES
+
+# wapp_db opens the database named by WAPP_DB_PATH on import: it is imported inside the
+# functions, once main() (and, in spawned writers, the inherited environment) has set it
+
+
+def _writer(session_id, user_id, k, barrier, duration):
+    """Submit bids for `duration` s once every writer is ready, then flush the audit queue.
+
+    Returns latencies (s) and failures.
+    """
+    import wapp_db as db
+    barrier.wait()
+    lat, failed, i = [], 0, 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        zone, mw, prix = ZONES[(k + i) % len(ZONES)], 10 + i % 90, 20 + (7*i) % 150
+        t = time.perf_counter()
+        try:
+            db.add_offre(session_id, user_id, f"Charge W{k}", zone, mw, prix)
+            db.log_action(session_id, user_id, "Soumission offre", f"Charge W{k} — {mw} MW @ {prix} €/MWh")
+        except sqlite3.OperationalError:
+            failed += 1
+        else:
+            lat.append(time.perf_counter() - t)
+        i += 1
+    # Spawned writers do not run atexit handlers: their queued entries would be lost
+    db.flush_audit()
+    return lat, failed
+
+
+def _reader(session_id, stop):
+    import wapp_db as db
+    n = 0
+    while not stop.is_set():
+        db.get_offres(session_id)
+        db.get_audit_log(session_id)
+        n += 1
+    return n
+
+
+def run_load(n_writers, duration, readers=2, processes=False):
+    """One round: `n_writers` concurrent writers and `readers` reader threads for `duration` s."""
+    import wapp_db as db
+    session_id = db.create_session(f"Charge {n_writers} écrivains", '2026-01-01', 1)
+    stop = threading.Event()
+    if processes:
+        ctx = multiprocessing.get_context('spawn')
+        manager = ctx.Manager()
+        barrier, pool = manager.Barrier(n_writers + 1), ProcessPoolExecutor(n_writers, mp_context=ctx)
+    else:
+        manager, barrier, pool = None, threading.Barrier(n_writers + 1), ThreadPoolExecutor(n_writers)
+    with pool, ThreadPoolExecutor(max(readers, 1)) as rpool:
+        futs = [pool.submit(_writer, session_id, 1, k, barrier, duration) for k in range(n_writers)]
+        barrier.wait()
+        t0 = time.perf_counter()
+        rfuts = [rpool.submit(_reader, session_id, stop) for _ in range(readers)]
+        out = [f.result() for f in futs]
+        stop.set()
+        elapsed = time.perf_counter() - t0
+        reads = sum(f.result() for f in rfuts)
+    if manager:
+        manager.shutdown()
+    lat = np.concatenate([np.array(l) for l, _ in out]) * 1000
+    stored = len(db.get_offres(session_id))
+    logged = len(db.get_audit_log(session_id))
+    return {'ecrivains': n_writers, 'soumissions': len(lat), 'echecs': sum(f for _, f in out),
+            'par_s': len(lat) / elapsed, 'p50_ms': float(np.percentile(lat, 50)) if len(lat) else None,
+            'p99_ms': float(np.percentile(lat, 99)) if len(lat) else None,
+            'max_ms': float(lat.max()) if len(lat) else None, 'lectures_par_s': reads / elapsed,
+            'enregistrees': stored, 'journalisees': logged}
+
+
+def seed_session(n_bids, bulk=True, user_id=1):
+    """Seed a new session with `n_bids` bids (60 % offers), each with its audit entry.
+
+    Returns the seeding time (s): one `add_offres`/`add_demandes` call each with `bulk`,
+    otherwise one `add_offre`/`add_demande` and one `log_action` per bid, plus the flush of
+    the queued audit entries.
+    """
+    import wapp_db as db
+    rng = np.random.default_rng(n_bids)
+    n_off = round(n_bids * 0.6)
+    bids = [(user_id, f"Ordre {k}", ZONES[z], float(q), float(p)) for k, (z, q, p) in enumerate(zip(
+        rng.integers(len(ZONES), size=n_bids), rng.integers(10, 500, n_bids), np.round(rng.uniform(20, 250, n_bids), 1)))]
+    offres, demandes = bids[:n_off], bids[n_off:]
+    session_id = db.create_session(f"Amorçage {n_bids} ordres", '2026-01-01', user_id)
+    t = time.perf_counter()
+    if bulk:
+        db.add_offres(session_id, offres)
+        db.add_demandes(session_id, demandes)
+    else:
+        for add, action, side in ((db.add_offre, "Soumission offre", offres),
+                                  (db.add_demande, "Soumission demande", demandes)):
+            for uid, membre, zone, mw, prix in side:
+                add(session_id, uid, membre, zone, mw, prix)
+                db.log_action(session_id, uid, action, f"{membre} — {mw} MW @ {prix} €/MWh")
+        db.flush_audit()
+    return time.perf_counter() - t
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Test de charge des soumissions concurrentes")
+    ap.add_argument('--writers', type=int, nargs='+', default=[1, 4, 16, 64])
+    ap.add_argument('--duration', type=float, default=5.0, help="durée de chaque palier (s)")
+    ap.add_argument('--readers', type=int, default=2, help="threads de lecture simultanés")
+    ap.add_argument('--processes', action='store_true', help="un processus par écrivain")
+    ap.add_argument('--seed', type=int, nargs='+', metavar='N',
+                    help="mesurer l'amorçage de sessions de N ordres au lieu de la charge")
+    ap.add_argument('--db', help="base de test (par défaut : fichier temporaire)")
+    args = ap.parse_args()
+
+    tmp = None
+    if args.db is None:
+        tmp = tempfile.TemporaryDirectory()
+        args.db = os.path.join(tmp.name, 'charge.db')
+    os.environ['WAPP_DB_PATH'] = args.db
+    import wapp_db as db
+    print(f"{db.DB_PATH} — journal {db.get_db().execute('PRAGMA journal_mode').fetchone()[0]}"
+          + (f", {'processus' if args.processes else 'threads'}, {args.readers} lecteur(s)"
+             " — latences hors audit, débit avec écriture de l'audit" if not args.seed else ""))
+    for n in args.seed or []:
+        unit, bulk = seed_session(n, bulk=False), seed_session(n)
+        print(f"{n:>7} ordres  un par un {unit:8.2f} s  en bloc {bulk:8.3f} s  ({n / bulk:,.0f} ordres/s)")
+    for n in args.writers if not args.seed else []:
+        r = run_load(n, args.duration, args.readers, args.processes)
+        ms = lambda v: f"{v:8.1f}" if v is not None else f"{'—':>8}"
+        print(f"{n:>4} écrivains  {r['par_s']:8.1f} soumissions/s  p50 {ms(r['p50_ms'])} ms"
+              f"  p99 {ms(r['p99_ms'])} ms  max {ms(r['max_ms'])} ms  échecs {r['echecs']:>4}"
+              f"  lectures {r['lectures_par_s']:7.1f}/s")
+        assert r['enregistrees'] >= r['soumissions'], "offres perdues"
+        assert r['journalisees'] >= r['soumissions'], "entrées d'audit perdues"
+    # Before the temporary database goes: the atexit flush would come too late
+    db.flush_audit()
+    db.close_db()
+    if tmp:
+        tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
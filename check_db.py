@@ -0,0 +1,162 @@
+"""
+WAPP DAM Platform — Database checks
+Assertions on the database layer, run on a scratch copy of the database (WAPP_DB_PATH):
+the live file is never written.
+
+    python check_db.py                  # on a copy of wapp_platform.db (or a new database)
+    python check_db.py --db autre.db
+
+check_query_plans: the hot read queries find their rows through an index.
+check_migration: a database written by the first release opens and reads back unchanged.
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+DEFAULT_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wapp_platform.db')
+
+# Reference tables that stay small; every other table grows with the market history
+SCANNABLE_TABLES = {'sessions', 'users'}
+
+
+def query_plans(calls):
+    """Run each (function, args) and return (sql, plan lines) for every SELECT it issued."""
+    import wapp_db as db
+    conn = db.get_db()
+    issued = []
+    conn.set_trace_callback(issued.append)
+    try:
+        for func, args in calls:
+            # Past the read cache, which would skip the queries
+            getattr(func, '__wrapped__', func)(*args)
+    finally:
+        conn.set_trace_callback(None)
+    return [(sql, [r['detail'] for r in conn.execute("EXPLAIN QUERY PLAN " + sql)])
+            for sql in issued if sql.lstrip().upper().startswith(('SELECT', 'WITH'))]
+
+
+def check_query_plans(session_id=1, user_id=1):
+    """Assert the hot read queries find their rows through an index.
+
+    Fails if a plan scans a growing table (offers, demands, network, audit log, jobs,
+    results) instead of searching it, e.g. after an index was dropped or a query rewritten.
+    Scanning an index in order is accepted for a query with a LIMIT.
+    """
+    import wapp_db as db
+    calls = [(db.get_offres, (session_id,)), (db.get_offres, (session_id, user_id)),
+             (db.get_demandes, (session_id,)), (db.get_demandes, (session_id, user_id)),
+             (db.get_order_book, (session_id,)), (db.get_network, (session_id,)),
+             (db.get_sessions, ()), (db.get_sessions, ('cloturee',)), (db.get_sessions, (None, None, None, 50, 100)),
+             (db.count_sessions, ('fermee',)), (db.get_session, (session_id,)), (db.get_results, (session_id,)),
+             (db.get_zone_prices, ('NGA',)), (db.get_dashboard_data, ()),
+             (db.get_audit_log, (session_id,)), (db.get_audit_log, ()),
+             (db.get_jobs, (session_id,)), (db.get_jobs, (None, ('queued', 'running'))), (db.get_job, (1,))]
+    for sql, plan in query_plans(calls):
+        aliases = {}
+        for table, alias in re.findall(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:as\s+)?(\w+))?', sql, re.I):
+            if alias.upper() in ('', 'WHERE', 'ON', 'ORDER', 'LEFT', 'JOIN', 'GROUP', 'LIMIT'):
+                alias = table
+            aliases[alias] = table
+        # An index scan only counts as a search when a LIMIT stops it early
+        limited = re.search(r'\bLIMIT\s+\d+\s*$', sql.strip(), re.I) is not None
+        # Common table expressions are read from their materialized rows, checked on their own
+        ctes = {l.split()[1] for l in plan if l.startswith('MATERIALIZE')}
+        for line in plan:
+            words = line.split()
+            if words[0] == 'SCAN' and words[1] not in ctes and not (limited and 'USING' in words):
+                table = aliases.get(words[1], words[1])
+                assert table in SCANNABLE_TABLES, f"parcours complet de {table} :\n{sql.strip()}\n{plan}"
+    print(f"OK  {len(calls)} requêtes indexées")
+
+
+
+# Tables as the first release created them, results stored as JSON text
+FIRST_RELEASE_SCHEMA = """
+CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL,
+    password_hash TEXT NOT NULL, display_name TEXT NOT NULL, email TEXT,
+    role TEXT NOT NULL CHECK(role IN ('admin','participant','tso','regulateur')), zone TEXT,
+    organisation TEXT, active INTEGER DEFAULT 1, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE sessions (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, market_date DATE NOT NULL,
+    status TEXT NOT NULL DEFAULT 'ouverte' CHECK(status IN ('ouverte','fermee','cloturee')),
+    created_by INTEGER REFERENCES users(id), created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    closed_at TIMESTAMP, cleared_at TIMESTAMP);
+CREATE TABLE offres (id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE, user_id INTEGER NOT NULL REFERENCES users(id),
+    membre TEXT NOT NULL, zone TEXT NOT NULL, quantite_mw REAL NOT NULL CHECK(quantite_mw > 0),
+    prix_eur REAL NOT NULL CHECK(prix_eur >= 0), submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    status TEXT DEFAULT 'soumise' CHECK(status IN ('soumise','validee','rejetee')));
+CREATE TABLE demandes (id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE, user_id INTEGER NOT NULL REFERENCES users(id),
+    membre TEXT NOT NULL, zone TEXT NOT NULL, quantite_mw REAL NOT NULL CHECK(quantite_mw > 0),
+    prix_eur REAL NOT NULL CHECK(prix_eur >= 0), submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    status TEXT DEFAULT 'soumise' CHECK(status IN ('soumise','validee','rejetee')));
+CREATE TABLE results (id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id INTEGER UNIQUE NOT NULL REFERENCES sessions(id) ON DELETE CASCADE, welfare REAL,
+    prix_zonaux TEXT, offres_result TEXT, demandes_result TEXT, flux_result TEXT, positions TEXT,
+    computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+"""
+
+
+def check_migration():
+    """Assert a first-release database holding a result opens and reads it back unchanged.
+
+    The database is written with FIRST_RELEASE_SCHEMA in a temporary directory and opened
+    by a fresh interpreter (the import runs init_db on WAPP_DB_PATH).
+    """
+    prix, positions = {'GHA': 30.0, 'CIV': 30.0}, {'GHA': 80.0, 'CIV': -80.0}
+    flux = [{'de': 'GHA', 'vers': 'CIV', 'flux_mw': 80.0, 'ntc': 600.0, 'taux': 13.3, 'saturee': False}]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'premiere_version.db')
+        conn = sqlite3.connect(path)
+        conn.executescript(FIRST_RELEASE_SCHEMA)
+        conn.execute("INSERT INTO users (username, password_hash, display_name, role) VALUES ('p', '', 'P', 'participant')")
+        conn.execute("INSERT INTO sessions (name, market_date, status, created_by) VALUES ('S', '2026-01-01', 'cloturee', 1)")
+        conn.execute("INSERT INTO offres (session_id, user_id, membre, zone, quantite_mw, prix_eur) VALUES (1, 1, 'G', 'GHA', 100, 30)")
+        conn.execute("INSERT INTO demandes (session_id, user_id, membre, zone, quantite_mw, prix_eur) VALUES (1, 1, 'D', 'CIV', 80, 120)")
+        conn.execute("""INSERT INTO results (session_id, welfare, prix_zonaux, offres_result, demandes_result,
+            flux_result, positions) VALUES (1, 7200, ?, ?, ?, ?, ?)""",
+            (json.dumps(prix), json.dumps([{'id': 1, 'volume_accepte': 80.0, 'ratio': 0.8, 'statut': 'Partiel'}]),
+             json.dumps([{'id': 1, 'volume_servi': 80.0, 'ratio': 1.0, 'statut': 'Servie'}]),
+             json.dumps(flux), json.dumps(positions)))
+        conn.commit()
+        conn.close()
+        out = subprocess.run([sys.executable, '-c', "import json, wapp_db as db; print(json.dumps(db.get_results(1)))"],
+                             cwd=os.path.dirname(os.path.abspath(__file__)), env={**os.environ, 'WAPP_DB_PATH': path},
+                             capture_output=True, text=True)
+    assert out.returncode == 0, f"migration impossible :\n{out.stderr}"
+    r = json.loads(out.stdout.splitlines()[-1])
+    assert (r['welfare'], r['prix_zonaux'], r['positions'], r['flux_result']) == (7200, prix, positions, flux), r
+    assert [(o['id'], o['volume_accepte'], o['statut']) for o in r['offres_result']] == [(1, 80.0, 'Partiel')], r
+    assert [(d['id'], d['volume_servi'], d['statut']) for d in r['demandes_result']] == [(1, 80.0, 'Servie')], r
+    assert r['lignes_result'] is None, r
+    print("OK  migration d'une base de la première version")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Vérifications de la couche base de données")
+    ap.add_argument('--db', default=DEFAULT_DB, help="base copiée avant les vérifications")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['WAPP_DB_PATH'] = os.path.join(tmp, 'verification.db')
+        if os.path.exists(args.db):
+            # Through the backup API: the copy includes what is still in the WAL
+            src = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+            dst = sqlite3.connect(os.environ['WAPP_DB_PATH'])
+            src.backup(dst)
+            src.close(); dst.close()
+        import wapp_db as db
+        check_query_plans()
+        check_migration()
+        # Before the scratch directory goes: the atexit flush would come too late
+        db.flush_audit()
+        db.close_db()
+
+
+if __name__ == '__main__':
+    main()
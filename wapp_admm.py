@@ -0,0 +1,292 @@
+"""
+WAPP DAM Platform — Zonal decomposition (ADMM)
+Clears the LP market by consensus ADMM on the interconnection flows: each zone solves its
+own merit order against a penalty on the flows of its lines, and the lines average the two
+ends' flows within their NTC. Blocks of zones are solved in parallel worker processes.
+
+Only numpy is imported here, so spawned workers start quickly.
+"""
+import math
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+WORKERS = os.cpu_count() or 1
+# Below this many zones per worker, the per-iteration messages cost more than the solve
+MIN_ZONES_PER_WORKER = 25
+BISECT_TOL = 1e-7
+# Residual balancing keeps rho within this factor of its initial value: a tiny rho turns
+# the bisection tolerance into MW of error (y = c ± λ/rho)
+RHO_RANGE = 100.0
+# ...and only adapts it during the first iterations: switching rho for ever can make it
+# cycle between two values without converging
+BALANCE_ITERS = 500
+
+
+class ZoneBlock:
+    """Merit orders of a block of zones, solved together with vectorised bisection.
+
+    `ports` are the (zone, sign) ends of the lines owned by the block: sign is +1 at the
+    receiving end of a positive flow, -1 at the sending end.
+    """
+
+    def __init__(self, n_zones, off, dem, port_zone, port_sign):
+        self.n = n_zones
+        self.port_zone, self.port_sign = np.asarray(port_zone), np.asarray(port_sign, float)
+        self.k = np.bincount(self.port_zone, minlength=n_zones).astype(float)
+        prices = np.concatenate([off[1], dem[1], [0.0]])
+        self.base, top = prices.min() - 1, prices.max() + 1
+        self.span = top - self.base + 2
+        self.lo_p, self.hi_p = self.base, top
+        self.off = self._steps(*off)
+        self.dem = self._steps(*dem)
+
+    def _steps(self, zone, price, q):
+        """Steps sorted by (zone, price) with prefix sums, for per-zone cumulative volumes."""
+        zone, price, q = np.asarray(zone, int), np.asarray(price, float), np.asarray(q, float)
+        key = zone * self.span + (price - self.base)
+        order = np.argsort(key, kind='stable')
+        cs = np.concatenate([[0.0], np.cumsum(q[order])])
+        start = np.searchsorted(key[order], np.arange(self.n) * self.span)
+        end = np.searchsorted(key[order], (np.arange(self.n) + 1) * self.span)
+        return {'key': key[order], 'cs': cs, 'start': start, 'tot': cs[end] - cs[start],
+                'zone': zone, 'price': price, 'q': q}
+
+    def _volumes(self, lam):
+        """Offers strictly below and demands strictly above each zone's price (MW)."""
+        x = np.arange(self.n) * self.span + (np.clip(lam, self.lo_p, self.hi_p) - self.base)
+        o, d = self.off, self.dem
+        s = o['cs'][np.searchsorted(o['key'], x, 'left')] - o['cs'][o['start']]
+        dd = d['tot'] - (d['cs'][np.searchsorted(d['key'], x, 'right')] - d['cs'][d['start']])
+        return s, dd
+
+    def _root(self, a, slope):
+        """Price solving supply - demand + a + slope·λ = 0 in every zone (slope ≥ 0)."""
+        o, d = self.off, self.dem
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lo = np.where(slope > 0, np.minimum(self.lo_p, (d['tot'] - a) / slope), self.lo_p) - 1
+            hi = np.where(slope > 0, np.maximum(self.hi_p, -(o['tot'] + a) / slope), self.hi_p) + 1
+        for _ in range(max(1, math.ceil(math.log2(float((hi - lo).max()) / BISECT_TOL)))):
+            mid = (lo + hi) / 2
+            s, dd = self._volumes(mid)
+            neg = s - dd + a + slope * mid < 0
+            lo, hi = np.where(neg, mid, lo), np.where(neg, hi, mid)
+        return (lo + hi) / 2
+
+    def solve(self, c, rho):
+        """ADMM zone update: flows of the block's ports and zone prices.
+
+        Each zone maximises its welfare minus rho/2·Σ(y - c)² subject to its balance, whose
+        multiplier λ gives y = c + sign·λ/rho at every port.
+        """
+        a = np.bincount(self.port_zone, self.port_sign * c, minlength=self.n)
+        lam = self._root(a, self.k / rho)
+        return c + self.port_sign * lam[self.port_zone] / rho, lam
+
+    def dispatch(self, net_import):
+        """Acceptance ratios of every step for fixed net imports (MW), the zone prices of that
+        local clearing and the imbalance left if the imports cannot be absorbed."""
+        lam = self._root(net_import, np.zeros(self.n))
+        o, d = self.off, self.dem
+        lz_o, lz_d = lam[o['zone']], lam[d['zone']]
+        marg_o = np.abs(o['price'] - lz_o) <= 10 * BISECT_TOL * (1 + np.abs(lz_o))
+        marg_d = np.abs(d['price'] - lz_d) <= 10 * BISECT_TOL * (1 + np.abs(lz_d))
+        xs = ((o['price'] < lz_o) & ~marg_o).astype(float)
+        xd = ((d['price'] > lz_d) & ~marg_d).astype(float)
+        bal = (np.bincount(o['zone'], xs * o['q'], self.n) - np.bincount(d['zone'], xd * d['q'], self.n)
+               + net_import)
+        q_mo = np.bincount(o['zone'], marg_o * o['q'], self.n)
+        q_md = np.bincount(d['zone'], marg_d * d['q'], self.n)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r_o = np.where(q_mo > 0, np.clip(-bal / q_mo, 0, 1), 0.0)
+            r_d = np.where(q_md > 0, np.clip(bal / q_md, 0, 1), 0.0)
+        xs = np.where(marg_o, r_o[o['zone']], xs)
+        xd = np.where(marg_d, r_d[d['zone']], xd)
+        bal += r_o * q_mo - r_d * q_md
+        return xs, xd, lam, bal
+
+
+def _worker(conn):
+    block = None
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            return
+        kind, args = msg
+        if kind == 'load':
+            block = ZoneBlock(*args)
+            conn.send(None)
+        else:
+            conn.send(getattr(block, kind)(*args))
+
+
+class _Workers:
+    """Persistent worker processes, each holding one ZoneBlock between messages.
+
+    `lock` is held by one clearing from its 'load' to its 'dispatch': the workers keep
+    that clearing's blocks in between.
+    """
+
+    def __init__(self, n):
+        self.lock = threading.Lock()
+        ctx = multiprocessing.get_context('spawn')
+        self.conns, self.procs = [], []
+        for _ in range(n):
+            parent, child = ctx.Pipe()
+            p = ctx.Process(target=_worker, args=(child,), daemon=True)
+            p.start()
+            self.conns.append(parent); self.procs.append(p)
+
+    def alive(self):
+        return all(p.is_alive() for p in self.procs)
+
+    def kill(self):
+        for p in self.procs:
+            p.terminate()
+
+    def call(self, kind, args_list):
+        for conn, args in zip(self.conns, args_list):
+            conn.send((kind, args))
+        return [conn.recv() for conn in self.conns[:len(args_list)]]
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _workers(n):
+    with _pools_lock:
+        pool = _pools.get(n)
+        if pool is None or not pool.alive():
+            pool = _pools[n] = _Workers(n)
+        return pool
+
+
+class _Blocks:
+    """The zone blocks of one clearing, in-process or spread over worker processes.
+
+    A context manager: the worker pool is reserved for the clearing until it exits.
+    """
+
+    def __init__(self, blocks, workers):
+        self.blocks, self.workers = blocks, workers
+        self.local = self.pool = None
+
+    def __enter__(self):
+        if self.workers <= 1:
+            self.local = [ZoneBlock(*b) for b in self.blocks]
+            return self
+        self.pool = _workers(self.workers)
+        self.pool.lock.acquire()
+        try:
+            self.pool.call('load', self.blocks)
+        except BaseException:
+            self.__exit__(*sys.exc_info())
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.pool is not None:
+            if exc_type is not None:
+                # Replies may still be in the pipes: the next clearing gets fresh workers
+                self.pool.kill()
+            self.pool.lock.release()
+
+    def call(self, kind, args_list):
+        if self.local is not None:
+            return [getattr(b, kind)(*args) for b, args in zip(self.local, args_list)]
+        return self.pool.call(kind, args_list)
+
+
+def admm_clear(zones, offres, demandes, lines, rho=None, tol_mw=1e-3, tol_prix=1e-3, max_iter=10000,
+               deadline=None, workers=None):
+    """Clear the LP market (free flows within ±NTC) by consensus ADMM on the line flows.
+
+    `offres`/`demandes` are dicts with 'zone', 'quantite_mw', 'prix_eur'; `lines` are
+    (zone_from, zone_to, ntc). Iterates until every line's two ends agree within `tol_mw`
+    and the flows move by less than `tol_prix`/rho; rho is balanced on the residuals
+    during the first `BALANCE_ITERS` iterations, then held fixed.
+    Stops early at `deadline` (time.perf_counter) or after `max_iter` iterations.
+
+    Returns the acceptance ratios 'xs'/'xd', signed line flows 'flux', zone prices 'prix'
+    (the balance multipliers), and 'statut' ('optimal', 'limite_temps', 'limite_iterations')
+    with the iteration count, final residuals, rho and remaining imbalance (MW).
+    """
+    zi = {z: i for i, z in enumerate(zones)}
+    nz, nl = len(zones), len(lines)
+    n_blocks = max(1, min(workers or WORKERS, nz // MIN_ZONES_PER_WORKER))
+    block_of = np.arange(nz) * n_blocks // max(nz, 1)
+    local = np.zeros(nz, int)
+    for b in range(n_blocks):
+        idx = np.flatnonzero(block_of == b)
+        local[idx] = np.arange(len(idx))
+
+    u = np.array([zi[l[0]] for l in lines], int)
+    v = np.array([zi[l[1]] for l in lines], int)
+    ntc = np.array([l[2] for l in lines], float)
+    # Two ports per line: sending end (-1), receiving end (+1)
+    p_zone, p_line, p_sign = np.concatenate([u, v]), np.tile(np.arange(nl), 2), np.repeat([-1.0, 1.0], nl)
+    order = np.argsort(block_of[p_zone], kind='stable')
+    p_zone, p_line, p_sign = p_zone[order], p_line[order], p_sign[order]
+    p_block = block_of[p_zone]
+    p_cut = np.searchsorted(p_block, np.arange(n_blocks + 1))
+
+    def side(bids):
+        z = np.array([zi[b['zone']] for b in bids], int)
+        return z, np.array([b['prix_eur'] for b in bids], float), np.array([b['quantite_mw'] for b in bids], float)
+    so, sd = side(offres), side(demandes)
+    blocks, sel_o, sel_d = [], [], []
+    for b in range(n_blocks):
+        mo, md = block_of[so[0]] == b, block_of[sd[0]] == b
+        sel_o.append(np.flatnonzero(mo)); sel_d.append(np.flatnonzero(md))
+        ports = slice(p_cut[b], p_cut[b + 1])
+        blocks.append((int((block_of == b).sum()),
+                       (local[so[0][mo]], so[1][mo], so[2][mo]), (local[sd[0][md]], sd[1][md], sd[2][md]),
+                       local[p_zone[ports]], p_sign[ports]))
+
+    if rho is None:
+        # Price spread over a typical line capacity: one NTC of disagreement costs one spread
+        prices = np.concatenate([so[1], sd[1], [0.0]])
+        rho = max(prices.max() - prices.min(), 1.0) / max(float(np.median(ntc)) if nl else 1.0, 1.0)
+    rho_min, rho_max = rho / RHO_RANGE, rho * RHO_RANGE
+    with _Blocks(blocks, n_blocks) as runner:
+        f = np.zeros(nl)
+        w = np.zeros(len(p_zone))
+        lam = np.zeros(nz)
+        statut, it, r, s = 'limite_iterations', 0, math.inf, math.inf
+        for it in range(1, max_iter + 1):
+            c = f[p_line] - w
+            out = runner.call('solve', [(c[p_cut[b]:p_cut[b + 1]], rho) for b in range(n_blocks)])
+            y = np.concatenate([o[0] for o in out])
+            for b, o in enumerate(out):
+                lam[block_of == b] = o[1]
+            f_old = f
+            f = np.clip(np.bincount(p_line, y + w, nl) / 2, -ntc, ntc)
+            gap = y - f[p_line]
+            w += gap
+            r, s = float(np.abs(gap).max(initial=0)), rho * float(np.abs(f - f_old).max(initial=0))
+            if r <= tol_mw and s <= tol_prix:
+                statut = 'optimal'
+                break
+            if deadline is not None and time.perf_counter() >= deadline:
+                statut = 'limite_temps'
+                break
+            if it % 10 == 0 and it <= BALANCE_ITERS and (r > 10 * s or s > 10 * r):
+                # Residual balancing; the scaled duals follow rho
+                k = min(max(rho * (2.0 if r > 10 * s else 0.5), rho_min), rho_max) / rho
+                rho *= k; w /= k
+
+        # Final dispatch from the consensus flows: each zone clears its merit order around them
+        imp = np.bincount(p_zone, p_sign * f[p_line], nz)
+        out = runner.call('dispatch', [(imp[block_of == b],) for b in range(n_blocks)])
+    xs, xd = np.zeros(len(offres)), np.zeros(len(demandes))
+    imbalance = 0.0
+    for b, (bxs, bxd, _, bal) in enumerate(out):
+        xs[sel_o[b]], xd[sel_d[b]] = bxs, bxd
+        imbalance = max(imbalance, float(np.abs(bal).max(initial=0)))
+    return {'xs': xs, 'xd': xd, 'flux': f, 'prix': lam, 'statut': statut, 'iterations': it,
+            'residu_mw': r, 'residu_prix': s, 'rho': rho, 'desequilibre_mw': imbalance, 'blocs': n_blocks}
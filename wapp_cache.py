@@ -0,0 +1,140 @@
+"""
+WAPP DAM Platform — Clearing result cache
+Results keyed by a hash of the clearing inputs: an in-memory LRU over a SQLite tier.
+The key only covers what the clearing depends on, so an identical order book submitted
+to another session (other ids, members, times) is served from the cache.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import wapp_db as db
+from wapp_engine import run_clearing_engine
+
+# Bump when the engine output changes, so results persisted by older code are not served
+CACHE_VERSION = 5
+MAX_ENTRIES = 64
+# Per-bid outcome columns of a result, stored without the bid's own fields
+OUTCOMES = {'offres': ('volume_accepte', 'ratio', 'statut'), 'demandes': ('volume_servi', 'ratio', 'statut')}
+
+_lru = OrderedDict()
+_lock = threading.Lock()
+_stats = {'hits': 0, 'disk_hits': 0, 'misses': 0}
+
+
+def _plain(v):
+    # numpy scalars from DataFrame rows
+    return v.item() if hasattr(v, 'item') else str(v)
+
+
+def _market(bids):
+    """(zone, MW, price) of each bid, and the canonical order of `bids` (sorted on them).
+
+    That is all the clearing depends on (the side is the list the bid is in): ids, members,
+    submitters and times only ride along into the per-bid results.
+    """
+    rows = [(str(b['zone']), float(b['quantite_mw']), float(b['prix_eur'])) for b in bids]
+    order = sorted(range(len(rows)), key=rows.__getitem__)
+    return [rows[i] for i in order], order
+
+
+def clearing_key(offres_list, demandes_list, network_list, **options):
+    """SHA-256 of the canonical JSON of the market fields of the inputs and engine options.
+
+    Bids are sorted, so the order of submission does not matter; lines are reduced to their
+    ends and NTC but keep their order, which the flows are reported in.
+    """
+    lines = [(str(n['zone_from']), str(n['zone_to']), float(n['ntc_mw'])) for n in network_list]
+    canonical = json.dumps([CACHE_VERSION, _market(offres_list)[0], _market(demandes_list)[0], lines, options],
+                           sort_keys=True, separators=(',', ':'), default=_plain)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def _strip(result, orders):
+    """The result with its per-bid rows reduced to their outcome, in canonical order."""
+    out = dict(result)
+    for side, fields in OUTCOMES.items():
+        out[side] = [{f: result[side][i][f] for f in fields} for i in orders[side]]
+    return out
+
+
+def _attach(result, bids, orders):
+    """Inverse of `_strip`: each outcome merged back into the caller's bid, in its order."""
+    for side in OUTCOMES:
+        rows = [None] * len(bids[side])
+        for i, outcome in zip(orders[side], result[side]):
+            rows[i] = {**bids[side][i], **outcome}
+        result[side] = rows
+    return result
+
+
+def cached_clearing(offres_list, demandes_list, network_list, engine='pyomo', mode='milp',
+                    aggregate=True, time_limit=None, mip_gap=0.0):
+    """`run_clearing_engine` behind the cache. Infeasible clearings (None) are not cached,
+    nor are results cut short by `time_limit` (statut 'limite_temps'): the limit is not part
+    of the key, so a later call with more time solves again. `mip_gap` is part of the key.
+
+    Entries are stored as JSON text, so every call returns a fresh result dict; the per-bid
+    rows carry the caller's bids. The 'stats' of a cached result are those of the original
+    solve, with 'cache' set to the tier hit.
+    """
+    key = clearing_key(offres_list, demandes_list, network_list,
+                       engine=engine, mode=mode, aggregate=aggregate, mip_gap=mip_gap)
+    # The bids as they come back from JSON, like the rest of the result
+    bids = json.loads(json.dumps({'offres': offres_list, 'demandes': demandes_list}, default=_plain))
+    orders = {'offres': _market(offres_list)[1], 'demandes': _market(demandes_list)[1]}
+    with _lock:
+        text = _lru.get(key)
+        if text is not None:
+            _lru.move_to_end(key)
+            _stats['hits'] += 1
+            return _tag(_attach(json.loads(text), bids, orders), 'mémoire')
+
+    text = db.get_cached_result(key)
+    tier = 'disque'
+    if text is None:
+        tier = None
+        result = run_clearing_engine(offres_list, demandes_list, network_list,
+                                     engine=engine, mode=mode, aggregate=aggregate,
+                                     time_limit=time_limit, mip_gap=mip_gap)
+        with _lock:
+            _stats['misses'] += 1
+        if result is None:
+            return None
+        if result['statut'] != 'optimal':
+            return result
+        text = json.dumps(_strip(result, orders), default=_plain)
+        db.put_cached_result(key, text)
+    else:
+        with _lock:
+            _stats['disk_hits'] += 1
+
+    with _lock:
+        _lru[key] = text
+        _lru.move_to_end(key)
+        while len(_lru) > MAX_ENTRIES:
+            _lru.popitem(last=False)
+    return _tag(_attach(json.loads(text), bids, orders), tier)
+
+
+def _tag(result, tier):
+    if tier and 'stats' in result:
+        result['stats']['cache'] = tier
+    return result
+
+
+def cache_stats():
+    """Hit/miss counters of this process and the size of the in-memory tier."""
+    with _lock:
+        s = dict(_stats, entries=len(_lru))
+    total = s['hits'] + s['disk_hits'] + s['misses']
+    s['hit_rate'] = (s['hits'] + s['disk_hits']) / total if total else 0.0
+    return s
+
+
+def clear_cache():
+    """Empty both tiers (the counters are kept)."""
+    with _lock:
+        _lru.clear()
+    db.clear_cached_results()
@@ -2,25 +2,176 @@
 WAPP DAM Platform — Database layer
 SQLite database for users, sessions, offers, demands, network, results, and audit log.
 """
+import atexit
+import functools
+import inspect
+import pickle
 import sqlite3
 import hashlib
 import json
+import logging
 import os
-from datetime import datetime
-
-DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wapp_platform.db')
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+DB_PATH = os.environ.get('WAPP_DB_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                         'wapp_platform.db')
+# Prepared statements kept per connection (sqlite3's default is 128)
+STATEMENT_CACHE = 256
+# A writer waits this long for the write lock (SQLite's busy handler) before an attempt fails;
+# failed attempts are retried WRITE_RETRIES times with jittered exponential backoff
+BUSY_TIMEOUT_S = 5.0
+WRITE_RETRIES = 4
+RETRY_BACKOFF_S = 0.05
+# Results of the cached read functions kept in memory per process
+READ_CACHE_ENTRIES = 512
+
+_local = threading.local()
+_log = logging.getLogger(__name__)
 
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON")
+    """This thread's connection, opened on first use and kept for the thread's lifetime.
+
+    Streamlit runs each script run in its own thread and the clearing workers are separate
+    processes, so a connection is never shared; it keeps its pragmas and prepared statements
+    from one call to the next. Writes go through `transaction()`.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        # Autocommit: transactions are opened explicitly by transaction()
+        conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_S, isolation_level=None,
+                               cached_statements=STATEMENT_CACHE)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        # In WAL mode a commit stays atomic with NORMAL; only the last commits may be lost on power loss
+        conn.execute("PRAGMA synchronous = NORMAL")
+        _local.conn, _local.pid, _local.depth = conn, os.getpid(), 0
     return conn
 
-def init_db():
+def _is_busy(e):
+    return isinstance(e, sqlite3.OperationalError) and ('locked' in str(e) or 'busy' in str(e))
+
+def _begin(conn):
+    # IMMEDIATE takes the write lock up front: a transaction that has started writing is
+    # never refused it halfway, so contention only shows up here, where a retry is safe
+    for attempt in range(WRITE_RETRIES + 1):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            return
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e) or attempt == WRITE_RETRIES:
+                raise
+            time.sleep(RETRY_BACKOFF_S * 2**attempt * (0.5 + random.random()))
+
+@contextmanager
+def transaction():
+    """Run the enclosed statements in one write transaction on this thread's connection.
+
+    Commits on exit and rolls back on exception. Nested blocks join the outermost one, so
+    the write functions below can be combined into one atomic operation:
+
+        with db.transaction():
+            db.update_session_status(sid, 'cloturee')
+            db.log_action(sid, uid, "Market clearing")
+
+    Under write contention, opening the transaction waits for the lock and retries (see
+    BUSY_TIMEOUT_S); sqlite3.OperationalError is raised once the retries are exhausted.
+    """
     conn = get_db()
-    c = conn.cursor()
+    if _local.depth == 0:
+        _begin(conn)
+        _local.on_rollback = []
+    _local.depth += 1
+    try:
+        yield conn
+    except BaseException:
+        if _local.depth == 1:
+            conn.rollback()
+            for undo in _local.on_rollback:
+                undo()
+        raise
+    else:
+        if _local.depth == 1:
+            conn.commit()
+    finally:
+        _local.depth -= 1
+
+def close_db():
+    """Close this thread's connection (a later call reopens one)."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        _local.conn = None
+        conn.close()
+
+
+# ==================== READ CACHE ====================
+
+# Every write function bumps the version of the scopes it changes, in its own transaction:
+# a table ('users', 'sessions', 'results') or a session's rows of one ('offres:12'). The
+# versions live in the database, so writes from the clearing workers invalidate too.
+_read_cache = OrderedDict()
+_read_lock = threading.Lock()
+_read_stats = {'hits': 0, 'misses': 0}
+
+def _bump(conn, *scopes):
+    conn.executemany("INSERT INTO versions (scope, n) VALUES (?, 1) ON CONFLICT(scope) DO UPDATE SET n=n+1",
+                     [(s,) for s in scopes])
+
+def _cached(*scopes):
+    """Serve the decorated read from memory until the version of one of its `scopes` changes.
+
+    Scopes are formatted with the call's arguments, e.g. 'offres:{session_id}'. The cache
+    is shared by every thread of the process, i.e. every Streamlit user session; results
+    are stored pickled, so each call returns its own copy. Reads inside a transaction
+    bypass it: they may see writes that are not committed yet.
+    """
+    def decorate(func):
+        sig = inspect.signature(func)
+
+        @functools.wraps(func)
+        def read(*args, **kwargs):
+            conn = get_db()
+            if _local.depth:
+                return func(*args, **kwargs)
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            names = [s.format(**bound.arguments) for s in scopes]
+            # Versions first: the rows read next are at least as recent as the versions
+            found = dict(conn.execute(f"SELECT scope, n FROM versions WHERE scope IN ({','.join('?' * len(names))})",
+                                      names).fetchall())
+            versions = tuple(found.get(n, 0) for n in names)
+            key = (func.__name__,) + tuple(tuple(v) if isinstance(v, list) else v for v in bound.arguments.values())
+            with _read_lock:
+                hit = _read_cache.get(key)
+                if hit and hit[0] == versions:
+                    _read_cache.move_to_end(key)
+                    _read_stats['hits'] += 1
+                    return pickle.loads(hit[1])
+                _read_stats['misses'] += 1
+            value = func(*args, **kwargs)
+            with _read_lock:
+                _read_cache[key] = (versions, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+                _read_cache.move_to_end(key)
+                while len(_read_cache) > READ_CACHE_ENTRIES:
+                    _read_cache.popitem(last=False)
+            return value
+        return read
+    return decorate
+
+def read_cache_stats():
+    """Hits, misses and entries of this process's read cache."""
+    with _read_lock:
+        return dict(_read_stats, entries=len(_read_cache))
 
-    c.executescript("""
+def init_db():
+    conn = get_db()
+    # Persistent in the file: every later connection, in any process, opens in WAL mode
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.executescript("""
     CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         username TEXT UNIQUE NOT NULL,
@@ -43,7 +194,11 @@ def init_db():
         created_by INTEGER REFERENCES users(id),
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         closed_at TIMESTAMP,
-        cleared_at TIMESTAMP
+        cleared_at TIMESTAMP,
+        time_limit_s REAL DEFAULT 60,
+        mip_gap REAL DEFAULT 0,
+        nb_offres INTEGER NOT NULL DEFAULT 0,
+        nb_demandes INTEGER NOT NULL DEFAULT 0
     );
 
     CREATE TABLE IF NOT EXISTS offres (
@@ -84,14 +239,78 @@ def init_db():
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         session_id INTEGER UNIQUE NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
         welfare REAL,
-        prix_zonaux TEXT,
-        offres_result TEXT,
-        demandes_result TEXT,
-        flux_result TEXT,
-        positions TEXT,
+        rente_congestion REAL,
+        stats TEXT,
         computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     );
 
+    -- Result details, one row per zone, bid and line of a cleared session
+    CREATE TABLE IF NOT EXISTS result_zones (
+        session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+        zone TEXT NOT NULL,
+        prix_eur REAL,
+        position_mw REAL,
+        PRIMARY KEY (session_id, zone)
+    );
+
+    CREATE TABLE IF NOT EXISTS result_offres (
+        session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+        offre_id INTEGER NOT NULL REFERENCES offres(id) ON DELETE CASCADE,
+        volume_mw REAL NOT NULL,
+        ratio REAL NOT NULL,
+        statut TEXT NOT NULL,
+        PRIMARY KEY (session_id, offre_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS result_demandes (
+        session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+        demande_id INTEGER NOT NULL REFERENCES demandes(id) ON DELETE CASCADE,
+        volume_mw REAL NOT NULL,
+        ratio REAL NOT NULL,
+        statut TEXT NOT NULL,
+        PRIMARY KEY (session_id, demande_id)
+    );
+
+    -- Lines in their flow direction: shadow price and rent for each network line, load
+    -- rate and saturation for each flow (a line may carry both, or one only)
+    CREATE TABLE IF NOT EXISTS result_lines (
+        session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+        zone_from TEXT NOT NULL,
+        zone_to TEXT NOT NULL,
+        ntc_mw REAL NOT NULL,
+        flux_mw REAL NOT NULL,
+        prix_ombre REAL,
+        rente REAL,
+        taux REAL,
+        saturee INTEGER,
+        PRIMARY KEY (session_id, zone_from, zone_to)
+    );
+
+    CREATE TABLE IF NOT EXISTS clearing_cache (
+        key TEXT PRIMARY KEY,
+        result TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        used_at TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+        status TEXT NOT NULL DEFAULT 'queued'
+            CHECK(status IN ('queued','running','done','failed')),
+        created_by INTEGER REFERENCES users(id),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP,
+        worker_pid INTEGER,
+        message TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS versions (
+        scope TEXT PRIMARY KEY,
+        n INTEGER NOT NULL
+    ) WITHOUT ROWID;
+
     CREATE TABLE IF NOT EXISTS audit_log (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         session_id INTEGER REFERENCES sessions(id),
@@ -100,7 +319,63 @@ def init_db():
         details TEXT,
         timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     );
+
+    -- Hot lookups by session (and bidder); IF NOT EXISTS also adds them to older databases
+    CREATE INDEX IF NOT EXISTS idx_offres_session_user ON offres(session_id, user_id);
+    CREATE INDEX IF NOT EXISTS idx_demandes_session_user ON demandes(session_id, user_id);
+    CREATE INDEX IF NOT EXISTS idx_network_session ON network(session_id);
+    CREATE INDEX IF NOT EXISTS idx_audit_session_time ON audit_log(session_id, timestamp);
+    CREATE INDEX IF NOT EXISTS idx_audit_time ON audit_log(timestamp);
+    CREATE INDEX IF NOT EXISTS idx_jobs_session ON jobs(session_id);
+    CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status);
+    CREATE INDEX IF NOT EXISTS idx_result_zones_zone ON result_zones(zone);
+    CREATE INDEX IF NOT EXISTS idx_sessions_status ON sessions(status);
+    CREATE INDEX IF NOT EXISTS idx_sessions_date ON sessions(market_date);
     """)
+    with transaction() as conn:
+        _migrate_and_seed(conn)
+
+def _migrate_and_seed(conn):
+    c = conn.cursor()
+
+    # Columns added after the first release
+    for table, col, typ in (('results', 'rente_congestion', 'REAL'), ('results', 'stats', 'TEXT'),
+                            ('sessions', 'time_limit_s', 'REAL DEFAULT 60'), ('sessions', 'mip_gap', 'REAL DEFAULT 0'),
+                            ('clearing_cache', 'used_at', 'TIMESTAMP')):
+        if col not in {r['name'] for r in c.execute(f"PRAGMA table_info({table})")}:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {col} {typ}")
+    # The clearing cache evicts its least recently used rows, no longer its oldest
+    c.execute("DROP INDEX IF EXISTS idx_cache_created")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_cache_used ON clearing_cache(used_at)")
+
+    # Bid counters of each session, kept up to date by triggers instead of counted per read
+    # (created here, after the columns: ALTER TABLE re-checks the triggers of the schema)
+    if 'nb_offres' not in {r['name'] for r in c.execute("PRAGMA table_info(sessions)")}:
+        for table in ('offres', 'demandes'):
+            c.execute(f"ALTER TABLE sessions ADD COLUMN nb_{table} INTEGER NOT NULL DEFAULT 0")
+            c.execute(f"UPDATE sessions SET nb_{table}=(SELECT COUNT(*) FROM {table} WHERE session_id=sessions.id)")
+    for table in ('offres', 'demandes'):
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_insert AFTER INSERT ON {table} BEGIN
+            UPDATE sessions SET nb_{table}=nb_{table}+1 WHERE id=NEW.session_id; END""")
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_delete AFTER DELETE ON {table} BEGIN
+            UPDATE sessions SET nb_{table}=nb_{table}-1 WHERE id=OLD.session_id; END""")
+
+    # Results used to be stored as JSON text in the results row: move them to the result tables
+    cols = {r['name'] for r in c.execute("PRAGMA table_info(results)")}
+    if 'prix_zonaux' in cols:
+        for r in c.execute("SELECT * FROM results WHERE prix_zonaux IS NOT NULL").fetchall():
+            sid = r['session_id']
+            ids = {t: {i for (i,) in c.execute(f"SELECT id FROM {t} WHERE session_id=?", (sid,))}
+                   for t in ('offres', 'demandes')}
+            # Bids deleted since the clearing have no row left to point to
+            _save_result_parts(conn, sid, json.loads(r['prix_zonaux']), json.loads(r['positions']),
+                [o for o in json.loads(r['offres_result']) if o.get('id') in ids['offres']],
+                [d for d in json.loads(r['demandes_result']) if d.get('id') in ids['demandes']],
+                json.loads(r['flux_result']),
+                json.loads(r['lignes_result']) if 'lignes_result' in cols and r['lignes_result'] else None)
+        for col in ('prix_zonaux', 'offres_result', 'demandes_result', 'flux_result', 'positions', 'lignes_result'):
+            if col in cols:
+                c.execute(f"ALTER TABLE results DROP COLUMN {col}")
 
     # Seed users — real WAPP member companies + IPPs
     if c.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0:
@@ -159,217 +434,548 @@ def init_db():
             c.execute("INSERT INTO users (username, password_hash, display_name, email, role, zone, organisation) VALUES (?,?,?,?,?,?,?)",
                       (u[0], pw_hash, u[2], u[3], u[4], u[5], u[6]))
 
-    conn.commit()
-    conn.close()
-
 
 def hash_pw(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
 
 def authenticate(username, password):
-    conn = get_db()
-    user = conn.execute("SELECT * FROM users WHERE username=? AND password_hash=? AND active=1",
-                        (username, hash_pw(password))).fetchone()
-    conn.close()
+    user = get_db().execute("SELECT * FROM users WHERE username=? AND password_hash=? AND active=1",
+                            (username, hash_pw(password))).fetchone()
     return dict(user) if user else None
 
 
+# ==================== AUDIT WRITER ====================
+
+# Entries outside a transaction are queued and written by a background thread in batches
+# of up to AUDIT_BATCH, one commit each, after letting a burst gather for AUDIT_DELAY_S
+AUDIT_BATCH = 500
+AUDIT_DELAY_S = 0.2
+
+_audit_pending = deque()
+_audit_cond = threading.Condition()
+_audit_lock = threading.Lock()  # one writer at a time: batches reach the table in queue order
+_audit_thread = None
+
+def _audit_time():
+    # Time of the action, not of the write: the log is ordered on it. Same format as
+    # CURRENT_TIMESTAMP (UTC) to the millisecond, so older rows sort with the new ones
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+# Errors caused by the entry itself: retrying it can never succeed
+_BAD_ENTRY = (sqlite3.IntegrityError, sqlite3.InterfaceError, sqlite3.ProgrammingError)
+
+def _write_audit(entries, drop_bad=False):
+    """Insert audit entries in one transaction.
+
+    With `drop_bad`, an entry the table refuses is logged and dropped instead of failing
+    the others: queued entries come from every user of the process.
+    """
+    sql = "INSERT INTO audit_log (session_id, user_id, action, details, timestamp) VALUES (?,?,?,?,?)"
+    with transaction() as conn:
+        if not drop_bad:
+            conn.executemany(sql, entries)
+            return
+        conn.execute("SAVEPOINT audit")
+        try:
+            conn.executemany(sql, entries)
+        except _BAD_ENTRY:
+            conn.execute("ROLLBACK TO audit")
+            for entry in entries:
+                try:
+                    conn.execute(sql, entry)
+                except _BAD_ENTRY as e:
+                    _log.error("Entrée d'audit rejetée %r : %s", entry, e)
+        conn.execute("RELEASE audit")
+
+def _take_audit(n):
+    with _audit_cond:
+        return [_audit_pending.popleft() for _ in range(min(n, len(_audit_pending)))]
+
+def _requeue(batch):
+    with _audit_cond:
+        _audit_pending.extendleft(reversed(batch))
+        _audit_cond.notify()
+
+def flush_audit():
+    """Write every queued audit entry now; returns once they are committed.
+
+    Called at exit, at gate closure and before the log is read. Inside a transaction the
+    entries are written as part of it, and queued again if it rolls back.
+    """
+    if getattr(_local, 'depth', 0):
+        # Taking _audit_lock here could deadlock with the writer thread waiting for our write lock
+        batch = _take_audit(len(_audit_pending))
+        if batch:
+            _local.on_rollback.append(lambda: _requeue(batch))
+            _write_audit(batch, drop_bad=True)
+        return
+    with _audit_lock:
+        while batch := _take_audit(AUDIT_BATCH):
+            try:
+                _write_audit(batch, drop_bad=True)
+            except BaseException:
+                _requeue(batch)
+                raise
+
+def _audit_writer():
+    while True:
+        with _audit_cond:
+            while not _audit_pending:
+                _audit_cond.wait()
+        time.sleep(AUDIT_DELAY_S)
+        try:
+            flush_audit()
+        except Exception:
+            # Entries stay queued and are retried on the next round
+            _log.exception("Écriture du journal d'audit")
+            time.sleep(AUDIT_DELAY_S * 10)
+
 def log_action(session_id, user_id, action, details=""):
-    conn = get_db()
-    conn.execute("INSERT INTO audit_log (session_id, user_id, action, details) VALUES (?,?,?,?)",
-                 (session_id, user_id, action, details))
-    conn.commit()
-    conn.close()
+    """Record an audit entry.
+
+    Inside a `transaction()` it is written with the transaction; otherwise it is queued for
+    the background writer and the call returns at once (see `flush_audit`).
+    """
+    entry = (session_id, user_id, action, details, _audit_time())
+    if getattr(_local, 'depth', 0):
+        _write_audit([entry])
+        return
+    global _audit_thread
+    with _audit_cond:
+        if _audit_thread is None or not _audit_thread.is_alive():
+            # First entry in this process (threads do not survive a fork), or the writer died
+            _audit_thread = threading.Thread(target=_audit_writer, name='wapp-audit', daemon=True)
+            _audit_thread.start()
+        _audit_pending.append(entry)
+        _audit_cond.notify()
+
+def log_actions(entries):
+    """Insert many (session_id, user_id, action, details) audit entries in one transaction."""
+    ts = _audit_time()
+    _write_audit([(*e, ts) for e in entries])
+
+atexit.register(flush_audit)
 
 
 # ==================== USERS ====================
 
+@_cached('users')
 def get_all_users():
-    conn = get_db()
-    rows = conn.execute("SELECT * FROM users ORDER BY role, display_name").fetchall()
-    conn.close()
+    rows = get_db().execute("SELECT * FROM users ORDER BY role, display_name").fetchall()
     return [dict(r) for r in rows]
 
 def create_user(username, password, display_name, email, role, zone, organisation):
-    conn = get_db()
     try:
-        conn.execute("INSERT INTO users (username, password_hash, display_name, email, role, zone, organisation) VALUES (?,?,?,?,?,?,?)",
-                     (username, hash_pw(password), display_name, email, role, zone, organisation))
-        conn.commit()
+        with transaction() as conn:
+            conn.execute("INSERT INTO users (username, password_hash, display_name, email, role, zone, organisation) VALUES (?,?,?,?,?,?,?)",
+                         (username, hash_pw(password), display_name, email, role, zone, organisation))
+            _bump(conn, 'users')
         return True
     except sqlite3.IntegrityError:
         return False
-    finally:
-        conn.close()
 
 def update_user(user_id, **kwargs):
-    conn = get_db()
-    for k, v in kwargs.items():
-        if k == 'password':
-            conn.execute("UPDATE users SET password_hash=? WHERE id=?", (hash_pw(v), user_id))
-        else:
-            conn.execute(f"UPDATE users SET {k}=? WHERE id=?", (v, user_id))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        for k, v in kwargs.items():
+            if k == 'password':
+                conn.execute("UPDATE users SET password_hash=? WHERE id=?", (hash_pw(v), user_id))
+            else:
+                conn.execute(f"UPDATE users SET {k}=? WHERE id=?", (v, user_id))
+        _bump(conn, 'users')
 
 
 # ==================== SESSIONS ====================
 
-def get_sessions():
-    conn = get_db()
-    rows = conn.execute("""
-        SELECT s.*, u.display_name as creator_name,
-            (SELECT COUNT(*) FROM offres WHERE session_id=s.id) as nb_offres,
-            (SELECT COUNT(*) FROM demandes WHERE session_id=s.id) as nb_demandes
+def _session_filter(status, date_from, date_to):
+    where, args = [], []
+    if status:
+        status = (status,) if isinstance(status, str) else tuple(status)
+        where.append(f"s.status IN ({','.join('?' * len(status))})"); args.extend(status)
+    if date_from:
+        where.append("s.market_date>=?"); args.append(date_from)
+    if date_to:
+        where.append("s.market_date<=?"); args.append(date_to)
+    return where, args
+
+@_cached('sessions', 'users')
+def get_sessions(status=None, date_from=None, date_to=None, limit=None, before=None):
+    """Sessions, most recent first, with their creator and bid counts.
+
+    `status` is one status or several; market dates are filtered on [date_from, date_to]
+    (ISO dates). Pages of `limit` sessions follow each other by passing the id of the last
+    session of a page as `before`.
+    """
+    where, args = _session_filter(status, date_from, date_to)
+    if before:
+        where.append("s.id<?"); args.append(before)
+    rows = get_db().execute(f"""
+        SELECT s.*, u.display_name as creator_name
         FROM sessions s LEFT JOIN users u ON s.created_by=u.id
-        ORDER BY s.created_at DESC
-    """).fetchall()
-    conn.close()
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        ORDER BY s.id DESC{' LIMIT ?' if limit else ''}
+    """, args + ([limit] if limit else [])).fetchall()
     return [dict(r) for r in rows]
 
+@_cached('sessions')
+def count_sessions(status=None, date_from=None, date_to=None):
+    """Number of sessions matching the `get_sessions` filters."""
+    where, args = _session_filter(status, date_from, date_to)
+    return get_db().execute(f"SELECT COUNT(*) FROM sessions s {'WHERE ' + ' AND '.join(where) if where else ''}",
+                            args).fetchone()[0]
+
 def create_session(name, market_date, user_id):
-    conn = get_db()
-    c = conn.execute("INSERT INTO sessions (name, market_date, created_by) VALUES (?,?,?)",
-                     (name, market_date, user_id))
-    sid = c.lastrowid
-    # Seed default network
-    default_lines = [
-        ('NGA','BEN',800),('NGA','NER',300),('BEN','TGO',600),('TGO','GHA',500),
-        ('GHA','CIV',600),('GHA','BFA',250),('CIV','BFA',250),('CIV','MLI',250),
-        ('CIV','LBR',400),('LBR','SLE',400),('SLE','GIN',400),('GIN','GNB',300),
-        ('GNB','GMB',300),('GMB','SEN',300),('SEN','MLI',300),
-    ]
-    for zf, zt, ntc in default_lines:
-        conn.execute("INSERT INTO network (session_id, zone_from, zone_to, ntc_mw, updated_by) VALUES (?,?,?,?,?)",
-                     (sid, zf, zt, ntc, user_id))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        sid = conn.execute("INSERT INTO sessions (name, market_date, created_by) VALUES (?,?,?)",
+                           (name, market_date, user_id)).lastrowid
+        # Seed default network
+        default_lines = [
+            ('NGA','BEN',800),('NGA','NER',300),('BEN','TGO',600),('TGO','GHA',500),
+            ('GHA','CIV',600),('GHA','BFA',250),('CIV','BFA',250),('CIV','MLI',250),
+            ('CIV','LBR',400),('LBR','SLE',400),('SLE','GIN',400),('GIN','GNB',300),
+            ('GNB','GMB',300),('GMB','SEN',300),('SEN','MLI',300),
+        ]
+        conn.executemany("INSERT INTO network (session_id, zone_from, zone_to, ntc_mw, updated_by) VALUES (?,?,?,?,?)",
+                         [(sid, zf, zt, ntc, user_id) for zf, zt, ntc in default_lines])
+        _bump(conn, 'sessions', 'network', f'network:{sid}')
     return sid
 
 def update_session_status(session_id, status):
-    conn = get_db()
+    if status == 'fermee':
+        # Gate closure: every submission's audit entry is on disk before the book is cleared
+        flush_audit()
     ts_col = 'closed_at' if status == 'fermee' else ('cleared_at' if status == 'cloturee' else None)
-    conn.execute("UPDATE sessions SET status=? WHERE id=?", (status, session_id))
-    if ts_col:
-        conn.execute(f"UPDATE sessions SET {ts_col}=? WHERE id=?", (datetime.now().isoformat(), session_id))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("UPDATE sessions SET status=? WHERE id=?", (status, session_id))
+        if ts_col:
+            conn.execute(f"UPDATE sessions SET {ts_col}=? WHERE id=?", (datetime.now().isoformat(), session_id))
+        _bump(conn, 'sessions')
+
+def update_session_solver(session_id, time_limit_s, mip_gap):
+    """Solver settings used when the session is cleared (time limit in s, relative MIP gap)."""
+    with transaction() as conn:
+        conn.execute("UPDATE sessions SET time_limit_s=?, mip_gap=? WHERE id=?",
+                     (time_limit_s, mip_gap, session_id))
+        _bump(conn, 'sessions')
 
 def get_session(session_id):
-    conn = get_db()
-    row = conn.execute("SELECT * FROM sessions WHERE id=?", (session_id,)).fetchone()
-    conn.close()
+    row = get_db().execute("SELECT * FROM sessions WHERE id=?", (session_id,)).fetchone()
     return dict(row) if row else None
 
 
 # ==================== OFFERS / DEMANDS ====================
 
+@_cached('offres:{session_id}', 'users')
 def get_offres(session_id, user_id=None):
     conn = get_db()
     if user_id:
-        rows = conn.execute("SELECT o.*, u.display_name as submitter FROM offres o JOIN users u ON o.user_id=u.id WHERE o.session_id=? AND o.user_id=?",
+        rows = conn.execute("SELECT o.*, u.display_name as submitter FROM offres o JOIN users u ON o.user_id=u.id WHERE o.session_id=? AND o.user_id=? ORDER BY o.id",
                             (session_id, user_id)).fetchall()
     else:
-        rows = conn.execute("SELECT o.*, u.display_name as submitter FROM offres o JOIN users u ON o.user_id=u.id WHERE o.session_id=?",
+        rows = conn.execute("SELECT o.*, u.display_name as submitter FROM offres o JOIN users u ON o.user_id=u.id WHERE o.session_id=? ORDER BY o.id",
                             (session_id,)).fetchall()
-    conn.close()
     return [dict(r) for r in rows]
 
 def add_offre(session_id, user_id, membre, zone, quantite, prix):
-    conn = get_db()
-    conn.execute("INSERT INTO offres (session_id, user_id, membre, zone, quantite_mw, prix_eur) VALUES (?,?,?,?,?,?)",
-                 (session_id, user_id, membre, zone, quantite, prix))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("INSERT INTO offres (session_id, user_id, membre, zone, quantite_mw, prix_eur) VALUES (?,?,?,?,?,?)",
+                     (session_id, user_id, membre, zone, quantite, prix))
+        _bump(conn, f'offres:{session_id}', 'sessions')
 
 def delete_offre(offre_id, user_id):
-    conn = get_db()
-    conn.execute("DELETE FROM offres WHERE id=? AND user_id=?", (offre_id, user_id))
-    conn.commit()
-    conn.close()
+    _delete_bid('offres', offre_id, user_id)
 
+@_cached('demandes:{session_id}', 'users')
 def get_demandes(session_id, user_id=None):
     conn = get_db()
     if user_id:
-        rows = conn.execute("SELECT d.*, u.display_name as submitter FROM demandes d JOIN users u ON d.user_id=u.id WHERE d.session_id=? AND d.user_id=?",
+        rows = conn.execute("SELECT d.*, u.display_name as submitter FROM demandes d JOIN users u ON d.user_id=u.id WHERE d.session_id=? AND d.user_id=? ORDER BY d.id",
                             (session_id, user_id)).fetchall()
     else:
-        rows = conn.execute("SELECT d.*, u.display_name as submitter FROM demandes d JOIN users u ON d.user_id=u.id WHERE d.session_id=?",
+        rows = conn.execute("SELECT d.*, u.display_name as submitter FROM demandes d JOIN users u ON d.user_id=u.id WHERE d.session_id=? ORDER BY d.id",
                             (session_id,)).fetchall()
-    conn.close()
     return [dict(r) for r in rows]
 
 def add_demande(session_id, user_id, membre, zone, quantite, prix):
-    conn = get_db()
-    conn.execute("INSERT INTO demandes (session_id, user_id, membre, zone, quantite_mw, prix_eur) VALUES (?,?,?,?,?,?)",
-                 (session_id, user_id, membre, zone, quantite, prix))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("INSERT INTO demandes (session_id, user_id, membre, zone, quantite_mw, prix_eur) VALUES (?,?,?,?,?,?)",
+                     (session_id, user_id, membre, zone, quantite, prix))
+        _bump(conn, f'demandes:{session_id}', 'sessions')
 
 def delete_demande(demande_id, user_id):
+    _delete_bid('demandes', demande_id, user_id)
+
+def _delete_bid(table, bid_id, user_id):
+    with transaction() as conn:
+        row = conn.execute(f"SELECT session_id FROM {table} WHERE id=? AND user_id=?", (bid_id, user_id)).fetchone()
+        if row:
+            conn.execute(f"DELETE FROM {table} WHERE id=?", (bid_id,))
+            _bump(conn, f"{table}:{row['session_id']}", 'sessions')
+
+def _add_bids(table, session_id, bids, action):
+    bids = list(bids)
+    with transaction() as conn:
+        conn.executemany(f"INSERT INTO {table} (session_id, user_id, membre, zone, quantite_mw, prix_eur) VALUES (?,?,?,?,?,?)",
+                         [(session_id, *b) for b in bids])
+        _bump(conn, f'{table}:{session_id}', 'sessions')
+        if action:
+            ts = _audit_time()
+            _write_audit([(session_id, uid, action, f"{membre} — {mw} MW @ {prix} €/MWh", ts)
+                          for uid, membre, _, mw, prix in bids])
+    return len(bids)
+
+def add_offres(session_id, bids, action="Soumission offre"):
+    """Insert many offers in one transaction; returns their number.
+
+    `bids` are (user_id, membre, zone, quantite, prix) tuples. Each offer gets an audit
+    entry `action` with the details the submission form logs (none if `action` is None).
+    """
+    return _add_bids('offres', session_id, bids, action)
+
+def add_demandes(session_id, bids, action="Soumission demande"):
+    """Insert many demands in one transaction, as `add_offres`."""
+    return _add_bids('demandes', session_id, bids, action)
+
+@_cached('offres:{session_id}', 'demandes:{session_id}')
+def get_order_book(session_id):
+    """Anonymised order book of a session: offers and demands with only id, zone, MW and price."""
     conn = get_db()
-    conn.execute("DELETE FROM demandes WHERE id=? AND user_id=?", (demande_id, user_id))
-    conn.commit()
-    conn.close()
+    return tuple([dict(r) for r in conn.execute(
+        f"SELECT id, zone, quantite_mw, prix_eur FROM {t} WHERE session_id=? ORDER BY id", (session_id,))]
+        for t in ('offres', 'demandes'))
 
 
 # ==================== NETWORK ====================
 
+@_cached('network:{session_id}')
 def get_network(session_id):
-    conn = get_db()
-    rows = conn.execute("SELECT * FROM network WHERE session_id=?", (session_id,)).fetchall()
-    conn.close()
+    rows = get_db().execute("SELECT * FROM network WHERE session_id=?", (session_id,)).fetchall()
     return [dict(r) for r in rows]
 
 def update_ntc(network_id, ntc_mw, user_id):
-    conn = get_db()
-    conn.execute("UPDATE network SET ntc_mw=?, updated_by=?, updated_at=? WHERE id=?",
-                 (ntc_mw, user_id, datetime.now().isoformat(), network_id))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("UPDATE network SET ntc_mw=?, updated_by=?, updated_at=? WHERE id=?",
+                     (ntc_mw, user_id, datetime.now().isoformat(), network_id))
+        row = conn.execute("SELECT session_id FROM network WHERE id=?", (network_id,)).fetchone()
+        if row:
+            _bump(conn, 'network', f"network:{row['session_id']}")
 
 
 # ==================== RESULTS ====================
 
-def save_results(session_id, welfare, prix_zonaux, offres_res, demandes_res, flux_res, positions):
-    conn = get_db()
-    conn.execute("""INSERT OR REPLACE INTO results
-        (session_id, welfare, prix_zonaux, offres_result, demandes_result, flux_result, positions)
-        VALUES (?,?,?,?,?,?,?)""",
-        (session_id, welfare, json.dumps(prix_zonaux), json.dumps(offres_res),
-         json.dumps(demandes_res), json.dumps(flux_res), json.dumps(positions)))
-    conn.commit()
-    conn.close()
-
-def get_results(session_id):
+RESULT_PARTS = ('prix_zonaux', 'positions', 'offres_result', 'demandes_result', 'flux_result', 'lignes_result')
+
+def _save_result_parts(conn, session_id, prix_zonaux, positions, offres_res, demandes_res, flux_res, lignes_res):
+    for t in ('result_zones', 'result_offres', 'result_demandes', 'result_lines'):
+        conn.execute(f"DELETE FROM {t} WHERE session_id=?", (session_id,))
+    conn.executemany("INSERT INTO result_zones (session_id, zone, prix_eur, position_mw) VALUES (?,?,?,?)",
+                     [(session_id, z, prix_zonaux.get(z), positions.get(z)) for z in {**prix_zonaux, **positions}])
+    conn.executemany("INSERT INTO result_offres (session_id, offre_id, volume_mw, ratio, statut) VALUES (?,?,?,?,?)",
+                     [(session_id, o['id'], o['volume_accepte'], o['ratio'], o['statut']) for o in offres_res])
+    conn.executemany("INSERT INTO result_demandes (session_id, demande_id, volume_mw, ratio, statut) VALUES (?,?,?,?,?)",
+                     [(session_id, d['id'], d['volume_servi'], d['ratio'], d['statut']) for d in demandes_res])
+    lines = {(l['de'], l['vers']): [l['ntc'], l['flux_mw'], l['prix_ombre'], l['rente'], None, None]
+             for l in lignes_res or []}
+    for f in flux_res:
+        line = lines.setdefault((f['de'], f['vers']), [f['ntc'], f['flux_mw'], None, None, None, None])
+        line[4:] = f['taux'], f['saturee']
+    conn.executemany("""INSERT INTO result_lines (session_id, zone_from, zone_to, ntc_mw, flux_mw, prix_ombre,
+        rente, taux, saturee) VALUES (?,?,?,?,?,?,?,?,?)""", [(session_id, *k, *v) for k, v in lines.items()])
+
+def save_results(session_id, welfare, prix_zonaux, offres_res, demandes_res, flux_res, positions,
+                 lignes_res=None, rente_congestion=None, stats=None):
+    """Store the clearing result of a session, replacing any previous one.
+
+    Per-bid results only keep the volume, ratio and status: the bids themselves are in
+    the offres/demandes tables, so each result must carry its bid's 'id'.
+    """
+    with transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO results (session_id, welfare, rente_congestion, stats) VALUES (?,?,?,?)",
+                     (session_id, welfare, rente_congestion, json.dumps(stats) if stats is not None else None))
+        _save_result_parts(conn, session_id, prix_zonaux, positions, offres_res, demandes_res, flux_res, lignes_res)
+        _bump(conn, 'results', f'results:{session_id}')
+
+@_cached('results:{session_id}', 'offres:{session_id}', 'demandes:{session_id}', 'users')
+def get_results(session_id, parts=RESULT_PARTS):
+    """Clearing result of a session (None if not cleared): the results row and the `parts`.
+
+    Only the parts asked for are read, e.g. ('prix_zonaux', 'flux_result') for a map, or
+    () for the welfare and stats alone. Per-bid results are the bids as `get_offres` and
+    `get_demandes` return them, plus 'volume_accepte'/'volume_servi', 'ratio' and 'statut'.
+    'lignes_result' is None for results cleared before line shadow prices were stored.
+    """
     conn = get_db()
     row = conn.execute("SELECT * FROM results WHERE session_id=?", (session_id,)).fetchone()
-    conn.close()
     if not row:
         return None
     r = dict(row)
-    r['prix_zonaux'] = json.loads(r['prix_zonaux'])
-    r['offres_result'] = json.loads(r['offres_result'])
-    r['demandes_result'] = json.loads(r['demandes_result'])
-    r['flux_result'] = json.loads(r['flux_result'])
-    r['positions'] = json.loads(r['positions'])
+    r['stats'] = json.loads(r['stats']) if r['stats'] else None
+    if 'prix_zonaux' in parts or 'positions' in parts:
+        zones = conn.execute("SELECT zone, prix_eur, position_mw FROM result_zones WHERE session_id=? ORDER BY rowid",
+                             (session_id,)).fetchall()
+        r['prix_zonaux'] = {z['zone']: z['prix_eur'] for z in zones if z['prix_eur'] is not None}
+        r['positions'] = {z['zone']: z['position_mw'] for z in zones if z['position_mw'] is not None}
+    for part, table, bid, vol in (('offres_result', 'offres', 'offre_id', 'volume_accepte'),
+                                  ('demandes_result', 'demandes', 'demande_id', 'volume_servi')):
+        if part in parts:
+            r[part] = [dict(b) for b in conn.execute(f"""SELECT b.*, u.display_name as submitter,
+                x.volume_mw as {vol}, x.ratio, x.statut
+                FROM result_{table} x JOIN {table} b ON b.id=x.{bid} JOIN users u ON b.user_id=u.id
+                WHERE x.session_id=? ORDER BY x.rowid""", (session_id,))]
+    if 'flux_result' in parts or 'lignes_result' in parts:
+        lines = conn.execute("SELECT * FROM result_lines WHERE session_id=? ORDER BY rowid", (session_id,)).fetchall()
+        r['flux_result'] = [{'de': l['zone_from'], 'vers': l['zone_to'], 'flux_mw': l['flux_mw'], 'ntc': l['ntc_mw'],
+                             'taux': l['taux'], 'saturee': bool(l['saturee'])} for l in lines if l['taux'] is not None]
+        r['lignes_result'] = [{'de': l['zone_from'], 'vers': l['zone_to'], 'ntc': l['ntc_mw'], 'flux_mw': l['flux_mw'],
+                               'prix_ombre': l['prix_ombre'], 'rente': l['rente']}
+                              for l in lines if l['prix_ombre'] is not None] or None
     return r
 
+@_cached('results', 'sessions')
+def get_zone_prices(zone=None):
+    """Zonal prices and net positions of every cleared session, oldest market date first."""
+    rows = get_db().execute(f"""SELECT s.id as session_id, s.name, s.market_date, z.zone, z.prix_eur, z.position_mw
+        FROM result_zones z JOIN sessions s ON z.session_id=s.id
+        {'WHERE z.zone=?' if zone else ''} ORDER BY s.market_date, s.id, z.rowid""",
+        (zone,) if zone else ()).fetchall()
+    return [dict(r) for r in rows]
+
+@_cached('results', 'sessions')
+def get_clearing_stats():
+    """Solve statistics of every cleared session, most recent first."""
+    rows = get_db().execute("""SELECT r.session_id, s.name, s.market_date, r.computed_at, r.stats
+        FROM results r JOIN sessions s ON r.session_id=s.id
+        WHERE r.stats IS NOT NULL ORDER BY r.computed_at DESC""").fetchall()
+    return [{**dict(r), 'stats': json.loads(r['stats'])} for r in rows]
+
+@_cached('sessions', 'network', 'results')
+def get_dashboard_data():
+    """Everything the admin dashboard shows about the market, in one statement.
+
+    Returns the session counts by status, the latest session with bids ('session', None
+    if there is none), its offered capacity and demand by zone ('capacite', 'demande',
+    summed in SQL), its network ('reseau') and its clearing result ('resultat': welfare,
+    prix_zonaux, positions and flux_result as `get_results` returns them, or None).
+    Only the latest session's rows are read, whatever the length of the history.
+    """
+    # One row per item, tagged by `part`; columns a..f hold that part's fields
+    rows = get_db().execute("""
+        WITH latest AS (SELECT * FROM sessions WHERE nb_offres>0 OR nb_demandes>0 ORDER BY id DESC LIMIT 1)
+        SELECT 'statut' as part, status as a, NULL as b, COUNT(*) as c, NULL as d, NULL as e, NULL as f
+            FROM sessions GROUP BY status
+        UNION ALL SELECT 'session', name, market_date, id, status, nb_offres, nb_demandes FROM latest
+        UNION ALL SELECT 'capacite', o.zone, NULL, SUM(o.quantite_mw), NULL, NULL, NULL
+            FROM offres o WHERE o.session_id=(SELECT id FROM latest) GROUP BY o.zone
+        UNION ALL SELECT 'demande', d.zone, NULL, SUM(d.quantite_mw), NULL, NULL, NULL
+            FROM demandes d WHERE d.session_id=(SELECT id FROM latest) GROUP BY d.zone
+        UNION ALL SELECT 'reseau', n.zone_from, n.zone_to, n.ntc_mw, NULL, NULL, NULL
+            FROM network n WHERE n.session_id=(SELECT id FROM latest)
+        UNION ALL SELECT 'resultat', NULL, NULL, r.welfare, NULL, NULL, NULL
+            FROM results r WHERE r.session_id=(SELECT id FROM latest)
+        UNION ALL SELECT 'zone', z.zone, NULL, z.prix_eur, z.position_mw, NULL, NULL
+            FROM result_zones z WHERE z.session_id=(SELECT id FROM latest)
+        UNION ALL SELECT 'ligne', l.zone_from, l.zone_to, l.flux_mw, l.ntc_mw, l.taux, l.saturee
+            FROM result_lines l WHERE l.session_id=(SELECT id FROM latest) AND l.taux IS NOT NULL
+    """).fetchall()
+    data = {'statuts': {}, 'session': None, 'capacite': {}, 'demande': {}, 'reseau': [], 'resultat': None}
+    zones, lines = [], []
+    for part, a, b, c, d, e, f in rows:
+        if part == 'statut':
+            data['statuts'][a] = c
+        elif part == 'session':
+            data['session'] = {'id': c, 'name': a, 'market_date': b, 'status': d, 'nb_offres': e, 'nb_demandes': f}
+        elif part in ('capacite', 'demande'):
+            data[part][a] = c
+        elif part == 'reseau':
+            data['reseau'].append({'zone_from': a, 'zone_to': b, 'ntc_mw': c})
+        elif part == 'resultat':
+            data['resultat'] = {'welfare': c}
+        elif part == 'zone':
+            zones.append((a, c, d))
+        else:
+            lines.append({'de': a, 'vers': b, 'flux_mw': c, 'ntc': d, 'taux': e, 'saturee': bool(f)})
+    if data['resultat']:
+        data['resultat']['prix_zonaux'] = {z: p for z, p, _ in zones if p is not None}
+        data['resultat']['positions'] = {z: q for z, _, q in zones if q is not None}
+        data['resultat']['flux_result'] = lines
+    return data
+
+
+# ==================== CLEARING CACHE ====================
+
+MAX_CACHED_RESULTS = 500
+
+def get_cached_result(key):
+    row = get_db().execute("SELECT result FROM clearing_cache WHERE key=?", (key,)).fetchone()
+    if row is None:
+        return None
+    # Eviction goes by last use: a hit keeps the entry
+    with transaction() as conn:
+        conn.execute("UPDATE clearing_cache SET used_at=? WHERE key=?", (datetime.now().isoformat(), key))
+    return row['result']
+
+def put_cached_result(key, result_json):
+    with transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO clearing_cache (key, result, used_at) VALUES (?,?,?)",
+                     (key, result_json, datetime.now().isoformat()))
+        conn.execute("""DELETE FROM clearing_cache WHERE key NOT IN
+            (SELECT key FROM clearing_cache ORDER BY used_at DESC LIMIT ?)""", (MAX_CACHED_RESULTS,))
+
+def clear_cached_results():
+    with transaction() as conn:
+        conn.execute("DELETE FROM clearing_cache")
+
+
+# ==================== CLEARING JOBS ====================
+
+def create_job(session_id, user_id):
+    with transaction() as conn:
+        return conn.execute("INSERT INTO jobs (session_id, created_by) VALUES (?,?)",
+                            (session_id, user_id)).lastrowid
+
+def claim_job(job_id, worker_pid):
+    """Move a queued job to 'running'. False if it was already claimed by another worker."""
+    with transaction() as conn:
+        n = conn.execute("""UPDATE jobs SET status='running', started_at=?, worker_pid=?
+            WHERE id=? AND status='queued'""", (datetime.now().isoformat(), worker_pid, job_id)).rowcount
+    return n == 1
+
+def finish_job(job_id, status, message=""):
+    with transaction() as conn:
+        conn.execute("UPDATE jobs SET status=?, finished_at=?, message=? WHERE id=?",
+                     (status, datetime.now().isoformat(), message, job_id))
+
+def get_job(job_id):
+    row = get_db().execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+    return dict(row) if row else None
+
+def get_jobs(session_id=None, statuses=None, limit=50):
+    """Most recent jobs first, optionally for one session and/or in the given statuses."""
+    where, args = [], []
+    if session_id:
+        where.append("j.session_id=?"); args.append(session_id)
+    if statuses:
+        where.append(f"j.status IN ({','.join('?' * len(statuses))})"); args.extend(statuses)
+    rows = get_db().execute(f"""SELECT j.*, s.name as session_name, u.display_name as creator_name
+        FROM jobs j JOIN sessions s ON j.session_id=s.id LEFT JOIN users u ON j.created_by=u.id
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        ORDER BY j.id DESC LIMIT ?""", args + [limit]).fetchall()
+    return [dict(r) for r in rows]
+
 
 # ==================== AUDIT ====================
 
 def get_audit_log(session_id=None):
+    flush_audit()
     conn = get_db()
     if session_id:
         rows = conn.execute("""SELECT a.*, u.display_name, u.role
             FROM audit_log a LEFT JOIN users u ON a.user_id=u.id
-            WHERE a.session_id=? ORDER BY a.timestamp DESC""", (session_id,)).fetchall()
+            WHERE a.session_id=? ORDER BY a.timestamp DESC, a.id DESC""", (session_id,)).fetchall()
     else:
         rows = conn.execute("""SELECT a.*, u.display_name, u.role
             FROM audit_log a LEFT JOIN users u ON a.user_id=u.id
-            ORDER BY a.timestamp DESC LIMIT 200""").fetchall()
-    conn.close()
+            ORDER BY a.timestamp DESC, a.id DESC LIMIT 200""").fetchall()
     return [dict(r) for r in rows]
 
 
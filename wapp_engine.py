@@ -0,0 +1,748 @@
+"""
+WAPP DAM Platform — Clearing engine
+Welfare-maximising zonal market clearing over offers, demands and NTC interconnections.
+"""
+import math
+import threading
+import time
+import networkx as nx
+import numpy as np
+import scipy.sparse as sp
+from scipy.optimize import milp, linprog, LinearConstraint, Bounds
+from wapp_admm import admm_clear
+from pyomo.environ import *
+from pyomo.common.collections import ComponentMap
+from pyomo.core.expr.visitor import identify_variables
+from pyomo.contrib.appsi.base import TerminationCondition as AppsiTermination
+from pyomo.contrib.appsi.solvers import Highs
+
+ZONES = ['BEN','BFA','CIV','GMB','GHA','GIN','GNB','LBR','MLI','NER','NGA','SEN','SLE','TGO']
+
+# HiGHS through Pyomo's APPSI interface solves in-process and keeps the model loaded between
+# solves; GLPK (LP file + glpsol subprocess per solve) is the fallback without highspy.
+SOLVER = 'highs' if Highs().available() else 'glpk'
+_local = threading.local()
+
+ENGINES = {'pyomo': f"Pyomo MILP ({SOLVER.upper()})", 'sparse': 'Matrices creuses (HiGHS)',
+           'network': 'Flot à coût minimal (networkx)', 'admm': 'Décomposition zonale (ADMM)'}
+
+
+MODES = {'milp': 'MILP deux passes (binaires de direction)', 'lp': 'LP rapide (flux libre ±NTC)'}
+
+
+def run_clearing_engine(offres_list, demandes_list, network_list, engine='pyomo', mode='milp',
+                        aggregate=True, zones=ZONES, time_limit=None, mip_gap=0.0):
+    """Clear the market and return welfare, zonal prices, per-bid results, flows and positions.
+
+    mode='milp' models each line with two nonnegative flows and a direction binary, solves
+    the MILP then re-solves with the binaries fixed to read prices. mode='lp' models one free
+    flow bounded by ±NTC and reads prices from a single LP solve — the NTC constraints are
+    symmetric and lossless, so both modes clear at the same optimum.
+
+    With `aggregate`, bids sharing a zone and a price are solved as one step and the step's
+    acceptance ratio is applied to each of its bids (pro rata allocation of ties).
+
+    The result carries 'stats': per-stage wall times in ms ('temps_ms') and the size of the
+    solved model (variables, constraints, binaries, nonzeros), MIP gap and solver iterations.
+    `zones` lists the bidding zones (the WAPP zones by default).
+
+    `time_limit` (s) bounds the whole clearing, model build included, and `mip_gap` is the
+    relative gap at which the MILP stops. When the limit is reached with a feasible
+    incumbent, that incumbent is priced and returned with 'statut' = 'limite_temps' and its
+    gap in the stats; otherwise 'statut' is 'optimal'. None means infeasible, or no
+    incumbent within the limit. The network engine is exact and ignores both settings.
+    The ADMM engine clears the LP iteratively (see `wapp_admm`), whatever `mode`: its stats
+    report mode 'lp', and its 'statut' is 'limite_temps' or 'limite_iterations' when it stops
+    before converging.
+    """
+    if engine == 'admm':
+        mode = 'lp'
+    t0 = t = time.perf_counter()
+    deadline = t0 + time_limit if time_limit else None
+    stats = {'moteur': engine, 'mode': mode, 'nb_ordres': len(offres_list) + len(demandes_list),
+             'temps_ms': {}}
+    agg = None
+    if aggregate:
+        steps_s, s_groups = aggregate_bids(offres_list)
+        steps_d, d_groups = aggregate_bids(demandes_list)
+        agg = ((offres_list, s_groups), (demandes_list, d_groups))
+        offres_list, demandes_list = steps_s, steps_d
+        t = _lap(stats, 'agregation', t)
+    stats['nb_paliers'] = len(offres_list) + len(demandes_list)
+
+    if engine == 'sparse':
+        res = _run_sparse(offres_list, demandes_list, network_list, mode, agg, stats, t, zones,
+                          deadline, mip_gap)
+    elif engine == 'network':
+        res = _run_network(offres_list, demandes_list, network_list, agg, stats, t, zones)
+    elif engine == 'admm':
+        res = _run_admm(offres_list, demandes_list, network_list, agg, stats, t, zones, deadline)
+    else:
+        paires, ntc = [], {}
+        for n in network_list:
+            pair = (n['zone_from'], n['zone_to'])
+            paires.append(pair)
+            ntc[pair] = n['ntc_mw']
+
+        lp = mode == 'lp'
+        m = _build_model(offres_list, demandes_list, paires, ntc, lp, zones)
+        stats.update(_model_stats(m))
+        t = _lap(stats, 'construction', t)
+        duals = _solve_model(m, paires, lp, stats, deadline, mip_gap)
+        if duals is None:
+            return None
+        t = time.perf_counter()
+        res = _model_results(m, offres_list, demandes_list, paires, ntc, duals, lp, agg)
+        _lap(stats, 'extraction', t)
+    if res is None:
+        return None
+    stats['total_ms'] = round((time.perf_counter() - t0)*1000, 2)
+    stats.setdefault('statut', 'optimal')
+    res['statut'], res['stats'] = stats['statut'], stats
+    return res
+
+
+# Time granted to the pricing LP even when the MILP used up the whole time limit: the
+# incumbent is worthless without prices, and the LP with fixed directions is quick
+LP_MIN_TIME = 1.0
+
+
+def _remaining(deadline, floor=0.0):
+    """Seconds left before `deadline` (inf without deadline), at least `floor`."""
+    return math.inf if deadline is None else max(deadline - time.perf_counter(), floor)
+
+
+def _lap(stats, stage, t0):
+    """Record the time elapsed since `t0` as stage `stage` (ms) and return the current time."""
+    t = time.perf_counter()
+    stats['temps_ms'][stage] = round((t - t0)*1000, 2)
+    return t
+
+
+def _model_stats(m):
+    """Variables, constraints, binaries and constraint matrix nonzeros of a Pyomo model."""
+    cons = list(m.component_data_objects(Constraint, active=True))
+    return {'nb_variables': m.nvariables(), 'nb_contraintes': len(cons),
+            'nb_binaires': sum(1 for v in m.component_data_objects(Var) if v.is_binary()),
+            'nb_nonzeros': sum(sum(1 for _ in identify_variables(c.body)) for c in cons)}
+
+
+def aggregate_bids(bids):
+    """Merge bids with the same zone and price into one step of their summed quantity.
+
+    Returns the steps and, per step, the indices of the bids it merges.
+    """
+    steps, groups, idx = [], [], {}
+    for i, b in enumerate(bids):
+        k = (b['zone'], b['prix_eur'])
+        j = idx.get(k)
+        if j is None:
+            idx[k] = len(steps)
+            steps.append({'zone': b['zone'], 'prix_eur': b['prix_eur'], 'quantite_mw': b['quantite_mw']})
+            groups.append([i])
+        else:
+            steps[j]['quantite_mw'] += b['quantite_mw']
+            groups[j].append(i)
+    return steps, groups
+
+
+def _spread(x, groups, n):
+    """Per-bid acceptance ratios from per-step ratios."""
+    out = [0.0]*n
+    for v, g in zip(x, groups):
+        for i in g: out[i] = v
+    return out
+
+
+def _build_model(offres_list, demandes_list, paires, ntc, lp, zones=ZONES, probes=False):
+    """Clearing model; with `probes`, one dormant offer and demand column per zone (see preview_bid)."""
+    offres = {i: o for i, o in enumerate(offres_list)}
+    demandes = {i: d for i, d in enumerate(demandes_list)}
+
+    m = ConcreteModel()
+    m.Z = Set(initialize=zones); m.S = Set(initialize=offres.keys())
+    m.D = Set(initialize=demandes.keys()); m.P = Set(initialize=paires, dimen=2)
+    m.xs = Var(m.S, bounds=(0,1)); m.xd = Var(m.D, bounds=(0,1))
+    if lp:
+        m.f = Var(m.P, bounds=lambda m,u,v: (-ntc[(u,v)], ntc[(u,v)]))
+    else:
+        m.f = Var(m.P, domain=NonNegativeReals); m.fr = Var(m.P, domain=NonNegativeReals)
+        m.b = Var(m.P, domain=Binary)
+    if probes:
+        # MW columns fixed at 0 until a what-if bid sets their bound and (mutable) price
+        m.po = Var(m.Z, bounds=(0, 0)); m.pd = Var(m.Z, bounds=(0, 0))
+        m.po_prix = Param(m.Z, mutable=True, initialize=0); m.pd_prix = Param(m.Z, mutable=True, initialize=0)
+
+    def obj(m):
+        w = sum(demandes[d]['prix_eur']*demandes[d]['quantite_mw']*m.xd[d] for d in m.D) - \
+            sum(offres[s]['prix_eur']*offres[s]['quantite_mw']*m.xs[s] for s in m.S)
+        if probes:
+            w += sum(m.pd_prix[z]*m.pd[z] - m.po_prix[z]*m.po[z] for z in m.Z)
+        return w
+    m.obj = Objective(rule=obj, sense=maximize)
+
+    def bal(m, z):
+        prod = sum(offres[s]['quantite_mw']*m.xs[s] for s in m.S if offres[s]['zone']==z)
+        cons = sum(demandes[d]['quantite_mw']*m.xd[d] for d in m.D if demandes[d]['zone']==z)
+        imp = sum(m.f[u,v] for (u,v) in paires if v==z)
+        exp = sum(m.f[u,v] for (u,v) in paires if u==z)
+        if not lp:
+            imp += sum(m.fr[u,v] for (u,v) in paires if u==z)
+            exp += sum(m.fr[u,v] for (u,v) in paires if v==z)
+        if probes:
+            prod += m.po[z]; cons += m.pd[z]
+        # Keep every row oriented as injection - withdrawal: `... == cons` can be reflected
+        # by Python when `cons` is a subclass expression, flipping the sign of its dual
+        return prod + imp - exp - cons == 0
+    m.bal = Constraint(m.Z, rule=bal)
+    if not lp:
+        m.ntc_f = Constraint(m.P, rule=lambda m,u,v: m.f[u,v] <= ntc[(u,v)]*m.b[u,v])
+        m.ntc_r = Constraint(m.P, rule=lambda m,u,v: m.fr[u,v] <= ntc[(u,v)]*(1-m.b[u,v]))
+    return m
+
+
+def _model_results(m, offres_list, demandes_list, paires, ntc, duals, lp, agg=None):
+    if lp:
+        flows = [value(m.f[p]) for p in paires]
+        f, fr = [max(x, 0) for x in flows], [max(-x, 0) for x in flows]
+        ombres = [abs(duals.get(m.f[p], 0)) for p in paires]
+    else:
+        f, fr = [value(m.f[p]) for p in paires], [value(m.fr[p]) for p in paires]
+        # Only the NTC row of the fixed direction can bind
+        ombres = [abs(duals.get(m.ntc_f[p] if value(m.b[p]) > 0.5 else m.ntc_r[p], 0)) for p in paires]
+
+    return _build_results(offres_list, demandes_list, paires, ntc,
+        [value(m.xs[s]) for s in m.S], [value(m.xd[d]) for d in m.D], f, fr,
+        {z: -duals.get(m.bal[z], 0) for z in m.Z}, value(m.obj), ombres, agg)
+
+
+def _persistent_solver():
+    """In-memory APPSI HiGHS instance, one per thread (Streamlit serves sessions on threads)."""
+    opt = getattr(_local, 'highs', None)
+    if opt is None:
+        opt = _local.highs = Highs()
+        # Solutions are loaded explicitly, so that a time-limited incumbent can be kept
+        opt.config.load_solution = False
+        _explicit_updates(opt)
+    return opt
+
+
+def _explicit_updates(opt):
+    """Only send HiGHS what is pushed with update_variables(): no rescan of the model."""
+    for flag in ('check_for_new_or_removed_constraints', 'check_for_new_or_removed_vars',
+                 'check_for_new_or_removed_params', 'check_for_new_objective',
+                 'update_constraints', 'update_vars', 'update_params',
+                 'update_named_expressions', 'update_objective'):
+        setattr(opt.update_config, flag, False)
+
+
+def _solve_model(m, paires, lp, stats, deadline=None, mip_gap=0.0):
+    """Solve `m`, then fix the direction binaries and re-solve for prices unless `lp`.
+
+    Returns the duals of the balance and NTC constraints and, in LP mode, the reduced
+    costs of the flows (the NTC is their bound), or None if no solution can be priced.
+    Solve times, status, MIP gap and simplex iterations are recorded in `stats`.
+    """
+    t = time.perf_counter()
+    if SOLVER == 'highs':
+        opt = _persistent_solver()
+        opt.config.time_limit, opt.config.mip_gap = _remaining(deadline), mip_gap
+        res = opt.solve(m)
+        t = _lap(stats, 'resolution', t)
+        info = opt._solver_model.getInfo()
+        stats['gap_mip'] = 0.0 if lp else info.mip_gap
+        stats['iterations'] = info.simplex_iteration_count
+        if res.termination_condition == AppsiTermination.optimal:
+            stats['statut'] = 'optimal'
+        elif (not lp and res.termination_condition == AppsiTermination.maxTimeLimit
+              and res.best_feasible_objective is not None):
+            stats['statut'] = 'limite_temps'
+        else:
+            return None
+        opt.load_vars()
+        if not lp:
+            # Pin the binaries through their bounds: fixing them would make APPSI rebuild
+            # every NTC row, while new bounds and integrality are a column update in HiGHS
+            for p in paires:
+                v = round(value(m.b[p]))
+                m.b[p].setlb(v); m.b[p].setub(v); m.b[p].domain = Reals
+            opt.update_variables(list(m.b.values()))
+            # HiGHS checks its limit against a run clock that keeps going across solves
+            opt.config.time_limit = opt._solver_model.getRunTime() + _remaining(deadline, LP_MIN_TIME)
+            if opt.solve(m).termination_condition != AppsiTermination.optimal:
+                return None
+            opt.load_vars()
+            _lap(stats, 'resolution_lp', t)
+            stats['iterations'] += opt._solver_model.getInfo().simplex_iteration_count
+            return opt.get_duals(list(m.bal.values()) + list(m.ntc_f.values()) + list(m.ntc_r.values()))
+        return _lp_duals(opt, m, paires)
+
+    m.dual = Suffix(direction=Suffix.IMPORT)
+    m.rc = Suffix(direction=Suffix.IMPORT)
+    opt = SolverFactory('glpk')
+    opt.options['mipgap'] = mip_gap
+    if deadline is not None:
+        opt.options['tmlim'] = max(1, int(_remaining(deadline)))
+    res = opt.solve(m, tee=False, load_solutions=False)
+    t = _lap(stats, 'resolution', t)
+    # glpsol reports neither iterations nor the final gap through Pyomo
+    tc = res.solver.termination_condition
+    if tc == TerminationCondition.optimal:
+        stats['statut'], stats['gap_mip'] = 'optimal', 0.0 if lp else mip_gap
+    elif not lp and tc == TerminationCondition.maxTimeLimit and len(res.solution) > 0:
+        stats['statut'], stats['gap_mip'] = 'limite_temps', None
+    else:
+        return None
+    stats['iterations'] = None
+    m.solutions.load_from(res)
+    if not lp:
+        for p in paires: m.b[p].fix(round(value(m.b[p])))
+        if deadline is not None:
+            opt.options['tmlim'] = max(1, int(_remaining(deadline, LP_MIN_TIME)))
+        res = opt.solve(m, tee=False)
+        if res.solver.termination_condition != TerminationCondition.optimal:
+            return None
+        _lap(stats, 'resolution_lp', t)
+        return ComponentMap(m.dual.items())
+    duals = ComponentMap(m.dual.items())
+    duals.update((m.f[p], m.rc.get(m.f[p], 0)) for p in paires)
+    return duals
+
+
+def _lp_duals(opt, m, paires):
+    """Balance duals and flow reduced costs of the LP-mode model loaded in `opt`."""
+    duals = ComponentMap(opt.get_duals(list(m.bal.values())))
+    duals.update(opt.get_reduced_costs([m.f[p] for p in paires]))
+    return duals
+
+
+# ===================== WHAT-IF PREVIEWS (NTC, BIDS) =====================
+
+_previews = {}
+_previews_lock = threading.Lock()
+# One lock per session serialises its rebuilds; _previews_lock only guards the dicts
+_build_locks = {}
+MAX_PREVIEWS = 16
+
+
+def _book_key(b):
+    return b.get('id'), b['zone'], b['quantite_mw'], b['prix_eur']
+
+
+def _preview_model(session_id, offres_list, demandes_list, paires, ntc):
+    """LP of a session's aggregated order book kept loaded in its own HiGHS instance, with
+    probe columns.
+
+    Rebuilt only when the order book or the line set changes; the previews then change
+    bounds and costs in place and HiGHS re-optimises from the previous basis. A rebuild
+    only holds its session's lock: previews of the other sessions go on meanwhile.
+    """
+    key = (tuple(map(_book_key, offres_list)), tuple(map(_book_key, demandes_list)), tuple(paires))
+    with _previews_lock:
+        entry = _previews.get(session_id)
+        if entry is not None and entry['key'] == key:
+            return entry
+        build_lock = _build_locks.setdefault(session_id, threading.Lock())
+    with build_lock:
+        with _previews_lock:
+            entry = _previews.get(session_id)
+        if entry is not None and entry['key'] == key:
+            return entry  # built by another thread while this one waited
+        steps_s, s_groups = aggregate_bids(offres_list)
+        steps_d, d_groups = aggregate_bids(demandes_list)
+        m = _build_model(steps_s, steps_d, paires, ntc, lp=True, probes=True)
+        opt = Highs()
+        opt.config.load_solution = False
+        _explicit_updates(opt)
+        opt.set_instance(m)
+        entry = {'key': key, 'model': m, 'opt': opt, 'ntc': dict(ntc), 'probe': None,
+                 'steps': (steps_s, steps_d), 'groups': (s_groups, d_groups), 'lock': threading.Lock()}
+        with _previews_lock:
+            _previews.pop(session_id, None)
+            _previews[session_id] = entry
+            while len(_previews) > MAX_PREVIEWS:
+                old = next(iter(_previews))
+                del _previews[old]
+                _build_locks.pop(old, None)
+    return entry
+
+
+def _set_ntc(entry, paires, ntc):
+    m = entry['model']
+    changed = [p for p in paires if ntc[p] != entry['ntc'][p]]
+    for p in changed:
+        m.f[p].setlb(-ntc[p]); m.f[p].setub(ntc[p])
+    if changed:
+        entry['opt'].update_variables([m.f[p] for p in changed])
+    entry['ntc'] = dict(ntc)
+
+
+def _set_probe(entry, probe):
+    """Activate the probe column (var, price param, MW, €/MWh) and park the previous one."""
+    opt, old = entry['opt'], entry['probe']
+    moved = []
+    if old is not None and (probe is None or old[0] is not probe[0]):
+        old[0].setub(0); moved.append(old[0])
+    if probe is not None:
+        var, param, q, prix = probe
+        var.setub(q); param.set_value(prix); moved.append(var)
+        opt.update_params()
+    if moved:
+        opt.update_variables(moved)
+    entry['probe'] = probe
+
+
+def preview_ntc(session_id, offres_list, demandes_list, network_list, ntc_changes):
+    """Clear a session in LP mode with the NTC of some lines replaced.
+
+    `network_list` are the session's network rows (with 'id'); `ntc_changes` maps row ids
+    to the NTC (MW) to try. Only the bounds of the flows whose NTC changed are pushed to
+    the session's preview model (see `_preview_model`). Without HiGHS this falls back to a
+    full LP clearing.
+    """
+    paires = [(n['zone_from'], n['zone_to']) for n in network_list]
+    ntc = {p: ntc_changes.get(n['id'], n['ntc_mw']) for p, n in zip(paires, network_list)}
+    if SOLVER != 'highs':
+        net = [{**n, 'ntc_mw': ntc[p]} for p, n in zip(paires, network_list)]
+        return run_clearing_engine(offres_list, demandes_list, net, mode='lp')
+
+    entry = _preview_model(session_id, offres_list, demandes_list, paires, ntc)
+    (steps_s, steps_d), (s_groups, d_groups) = entry['steps'], entry['groups']
+    agg = ((offres_list, s_groups), (demandes_list, d_groups))
+    with entry['lock']:
+        m, opt = entry['model'], entry['opt']
+        _set_ntc(entry, paires, ntc)
+        _set_probe(entry, None)
+        if opt.solve(m).termination_condition != AppsiTermination.optimal:
+            return None
+        opt.load_vars()
+        return _model_results(m, steps_s, steps_d, paires, ntc, _lp_duals(opt, m, paires), True, agg)
+
+
+def preview_bid(session_id, offres_list, demandes_list, network_list, side, zone, quantite, prix):
+    """Expected outcome of a candidate bid added to a session's order book (LP clearing).
+
+    `side` is 'offre' or 'demande'. The bid activates the dormant probe column of its
+    zone in the session's preview model (see `_preview_model`): one column bound and one
+    cost change, then a warm-started re-solve. Only the candidate's outcome and the zonal
+    prices are read back, so the other bids are never exposed.
+
+    Returns {'ratio', 'volume_mw', 'prix_zone', 'prix', 'marginal'} or None if the LP is
+    infeasible. 'marginal' means the bid sets the zonal price: any acceptance ratio is then
+    optimal and the actual one depends on the other bids at that price.
+    """
+    paires = [(n['zone_from'], n['zone_to']) for n in network_list]
+    ntc = {p: n['ntc_mw'] for p, n in zip(paires, network_list)}
+    if SOLVER != 'highs':
+        bid = {'zone': zone, 'quantite_mw': quantite, 'prix_eur': prix}
+        offres, demandes = (offres_list + [bid], demandes_list) if side == 'offre' else (offres_list, demandes_list + [bid])
+        res = run_clearing_engine(offres, demandes, network_list, mode='lp')
+        if res is None:
+            return None
+        ratio = (res['offres'] if side == 'offre' else res['demandes'])[-1]['ratio']
+        return {'ratio': ratio, 'volume_mw': round(ratio*quantite, 1), 'prix_zone': res['prix'][zone],
+                'prix': res['prix'], 'marginal': abs(res['prix'][zone] - prix) < 0.01}
+
+    entry = _preview_model(session_id, offres_list, demandes_list, paires, ntc)
+    with entry['lock']:
+        m, opt = entry['model'], entry['opt']
+        var, param = (m.po[zone], m.po_prix[zone]) if side == 'offre' else (m.pd[zone], m.pd_prix[zone])
+        _set_ntc(entry, paires, ntc)
+        _set_probe(entry, (var, param, quantite, prix))
+        if opt.solve(m).termination_condition != AppsiTermination.optimal:
+            return None
+        volume = opt.get_primals([var])[var]
+        ratio = min(max(volume / quantite, 0.0), 1.0) if quantite else 0.0
+        duals = opt.get_duals(list(m.bal.values()))
+        bruts = {z: -duals[m.bal[z]] for z in m.Z}
+        offres, xs = [], []
+        if any(p < 0 for p in bruts.values()):
+            # Priced like the published results, from the accepted offers and the candidate
+            primals = opt.get_primals([m.xs[s] for s in m.S])
+            offres, xs = list(entry['steps'][0]), [primals[m.xs[s]] for s in m.S]
+            if side == 'offre':
+                offres.append({'zone': zone, 'prix_eur': prix}); xs.append(ratio)
+        prix_z = _zone_prices(bruts, offres, xs)
+    return {'ratio': round(ratio, 3), 'volume_mw': round(volume, 1), 'prix_zone': prix_z[zone], 'prix': prix_z,
+            'marginal': abs(prix_z[zone] - prix) < 0.01}
+
+
+def _zone_prices(prix_bruts, offres, xs):
+    """Published zonal prices from the balance duals: a negative dual (a surplus the zone
+    cannot export) is replaced by the highest accepted offer price in the zone, or 0."""
+    prix = {}
+    for z, p in prix_bruts.items():
+        if p < 0:
+            accepted = [o['prix_eur'] for o, v in zip(offres, xs) if o['zone']==z and v>0.01]
+            p = max(accepted, default=0)
+        prix[z] = round(p, 2)
+    return prix
+
+
+def _build_results(offres, demandes, paires, ntc, xs, xd, f, fr, prix_bruts, welfare, ombres, agg=None):
+    """Shape solver values into the result dict shared by all engines.
+
+    `ombres` are the line shadow prices (€/MWh per MW of extra NTC, ≥ 0): the congestion
+    rent of a line is its flow times its shadow price. The zones are the keys of `prix_bruts`.
+
+    `agg` = ((offres, groups), (demandes, groups)) when `offres`/`demandes` are aggregated
+    steps: results are then reported for the original bids.
+    """
+    if agg:
+        (offres, s_groups), (demandes, d_groups) = agg
+        xs, xd = _spread(xs, s_groups, len(offres)), _spread(xd, d_groups, len(demandes))
+    zones = list(prix_bruts)
+    prix = _zone_prices(prix_bruts, offres, xs)
+
+    off_res = []
+    for o, v in zip(offres, xs):
+        off_res.append({**o, 'volume_accepte': round(v*o['quantite_mw'],1),
+            'ratio': round(v,3), 'statut': 'Accepté' if v>0.99 else ('Partiel' if v>0.01 else 'Rejeté')})
+
+    dem_res = []
+    for d, v in zip(demandes, xd):
+        dem_res.append({**d, 'volume_servi': round(v*d['quantite_mw'],1),
+            'ratio': round(v,3), 'statut': 'Servi' if v>0.99 else ('Partiel' if v>0.01 else 'Non servi')})
+
+    flux_res = []
+    for (u,v), fwd, rev in zip(paires, f, fr):
+        if fwd>0.1:
+            flux_res.append({'de':u,'vers':v,'flux_mw':round(fwd,1),'ntc':ntc[(u,v)],
+                'taux':round(fwd/ntc[(u,v)]*100,1),'saturee':fwd>=ntc[(u,v)]-0.1})
+        if rev>0.1:
+            flux_res.append({'de':v,'vers':u,'flux_mw':round(rev,1),'ntc':ntc[(u,v)],
+                'taux':round(rev/ntc[(u,v)]*100,1),'saturee':rev>=ntc[(u,v)]-0.1})
+
+    lignes, rente = [], 0.0
+    for (u,v), fwd, rev, mu in zip(paires, f, fr, ombres):
+        de, vers, mw = (v, u, rev) if rev > fwd else (u, v, fwd)
+        rente += mw*mu
+        lignes.append({'de':de,'vers':vers,'ntc':ntc[(u,v)],'flux_mw':round(mw,1),
+            'prix_ombre':round(mu,2),'rente':round(mw*mu,2)})
+
+    prod, cons = dict.fromkeys(zones, 0), dict.fromkeys(zones, 0)
+    for o, v in zip(offres, xs):
+        if o['zone'] in prod: prod[o['zone']] += o['quantite_mw']*v
+    for d, v in zip(demandes, xd):
+        if d['zone'] in cons: cons[d['zone']] += d['quantite_mw']*v
+    positions = {z: round(prod[z]-cons[z], 1) for z in zones}
+
+    return {'welfare': round(welfare,2), 'prix': prix,
+            'offres': off_res, 'demandes': dem_res, 'flux': flux_res, 'positions': positions,
+            'lignes': lignes, 'rente_congestion': round(rente,2)}
+
+
+# ===================== SPARSE MATRIX BACKEND =====================
+
+def build_market_matrices(offres_list, demandes_list, network_list, zones=ZONES):
+    """Column arrays and sparse incidence matrices of the market.
+
+    Rows of the incidence matrices are `zones`. A_s / A_d carry the bid quantity (MW)
+    in the bid's zone row; B has +1 on the receiving zone and -1 on the sending zone
+    of each line, so that A_s·xs - A_d·xd + B·(f - fr) is the zonal net balance.
+    """
+    zidx = {z: i for i, z in enumerate(zones)}
+    nz, ns, nd, nl = len(zones), len(offres_list), len(demandes_list), len(network_list)
+
+    q_s = np.fromiter((o['quantite_mw'] for o in offres_list), float, ns)
+    p_s = np.fromiter((o['prix_eur'] for o in offres_list), float, ns)
+    z_s = np.fromiter((zidx[o['zone']] for o in offres_list), int, ns)
+    q_d = np.fromiter((d['quantite_mw'] for d in demandes_list), float, nd)
+    p_d = np.fromiter((d['prix_eur'] for d in demandes_list), float, nd)
+    z_d = np.fromiter((zidx[d['zone']] for d in demandes_list), int, nd)
+    paires = [(n['zone_from'], n['zone_to']) for n in network_list]
+    ntc = np.fromiter((n['ntc_mw'] for n in network_list), float, nl)
+    z_from = np.fromiter((zidx[u] for u, _ in paires), int, nl)
+    z_to = np.fromiter((zidx[v] for _, v in paires), int, nl)
+
+    lines = np.arange(nl)
+    return {
+        'paires': paires, 'ntc': ntc, 'q_s': q_s, 'p_s': p_s, 'q_d': q_d, 'p_d': p_d,
+        'A_s': sp.csr_matrix((q_s, (z_s, np.arange(ns))), shape=(nz, ns)),
+        'A_d': sp.csr_matrix((q_d, (z_d, np.arange(nd))), shape=(nz, nd)),
+        'B': sp.csr_matrix((np.r_[np.ones(nl), -np.ones(nl)], (np.r_[z_to, z_from], np.r_[lines, lines])),
+                           shape=(nz, nl)),
+    }
+
+
+def _run_sparse(offres_list, demandes_list, network_list, mode='milp', agg=None, stats=None, t=None,
+                zones=ZONES, deadline=None, mip_gap=0.0):
+    stats = {'temps_ms': {}} if stats is None else stats
+    t = time.perf_counter() if t is None else t
+    mk = build_market_matrices(offres_list, demandes_list, network_list, zones)
+    ns, nd, nl = len(mk['q_s']), len(mk['q_d']), len(mk['ntc'])
+    ntc, nz = mk['ntc'], len(zones)
+    ntc_map = {(n['zone_from'], n['zone_to']): n['ntc_mw'] for n in network_list}
+    c_bids = np.r_[mk['p_s']*mk['q_s'], -mk['p_d']*mk['q_d']]
+
+    if mode == 'lp':
+        # x = [xs, xd, f] with one free flow per line bounded by ±NTC
+        A_bal = sp.hstack([mk['A_s'], -mk['A_d'], mk['B']], format='csr')
+        bounds = np.c_[np.r_[np.zeros(ns+nd), -ntc], np.r_[np.ones(ns+nd), ntc]]
+        stats.update(nb_variables=ns+nd+nl, nb_contraintes=nz, nb_binaires=0, nb_nonzeros=A_bal.nnz)
+        t = _lap(stats, 'construction', t)
+        lp = linprog(np.r_[c_bids, np.zeros(nl)], A_eq=A_bal, b_eq=np.zeros(nz),
+                     bounds=bounds, method='highs', options={'time_limit': _remaining(deadline)})
+        t = _lap(stats, 'resolution', t)
+        stats.update(gap_mip=0.0, iterations=lp.nit, statut='optimal')
+        if lp.status != 0:
+            return None
+        x = lp.x
+        ombres = np.abs(lp.upper.marginals[ns+nd:]) + np.abs(lp.lower.marginals[ns+nd:])
+        res = _build_results(offres_list, demandes_list, mk['paires'], ntc_map,
+            x[:ns].tolist(), x[ns:ns+nd].tolist(),
+            np.maximum(x[ns+nd:], 0).tolist(), np.maximum(-x[ns+nd:], 0).tolist(),
+            dict(zip(zones, lp.eqlin.marginals.tolist())), -lp.fun, ombres.tolist(), agg)
+        _lap(stats, 'extraction', t)
+        return res
+
+    # x = [xs, xd, f, fr, b]; HiGHS minimises, so the objective is -welfare
+    c = np.r_[c_bids, np.zeros(3*nl)]
+    eye, zero = sp.identity(nl, format='csr'), sp.csr_matrix((nl, nl))
+    A_bal = sp.hstack([mk['A_s'], -mk['A_d'], mk['B'], -mk['B'], sp.csr_matrix((nz, nl))], format='csr')
+    A_ntc = sp.vstack([
+        sp.hstack([sp.csr_matrix((nl, ns+nd)), eye, zero, -sp.diags(ntc)]),
+        sp.hstack([sp.csr_matrix((nl, ns+nd)), zero, eye, sp.diags(ntc)]),
+    ], format='csr')
+    b_ntc = np.r_[np.zeros(nl), ntc]
+    lb = np.zeros(ns+nd+3*nl)
+    ub = np.r_[np.ones(ns+nd), np.full(2*nl, np.inf), np.ones(nl)]
+    stats.update(nb_variables=len(c), nb_contraintes=nz+2*nl, nb_binaires=nl,
+                 nb_nonzeros=A_bal.nnz + A_ntc.nnz)
+    t = _lap(stats, 'construction', t)
+
+    res = milp(c, integrality=np.r_[np.zeros(ns+nd+2*nl), np.ones(nl)], bounds=Bounds(lb, ub),
+               constraints=[LinearConstraint(A_bal, 0, 0), LinearConstraint(A_ntc, -np.inf, b_ntc)],
+               options={'mip_rel_gap': mip_gap, 'time_limit': _remaining(deadline)})
+    t = _lap(stats, 'resolution', t)
+    # scipy does not expose simplex iterations for milp: branch-and-bound nodes are reported
+    stats.update(gap_mip=res.get('mip_gap'), iterations=None, noeuds_bb=res.get('mip_node_count'))
+    if res.status == 0:
+        stats['statut'] = 'optimal'
+    elif res.status == 1 and res.x is not None:
+        stats['statut'] = 'limite_temps'
+    else:
+        return None
+
+    # Fix the flow directions and re-solve the LP to read the balance duals
+    lb[-nl:] = ub[-nl:] = np.round(res.x[-nl:])
+    lp = linprog(c, A_ub=A_ntc, b_ub=b_ntc, A_eq=A_bal, b_eq=np.zeros(nz),
+                 bounds=np.c_[lb, ub], method='highs', options={'time_limit': _remaining(deadline, LP_MIN_TIME)})
+    t = _lap(stats, 'resolution_lp', t)
+    stats['iterations'] = lp.nit
+    if lp.status != 0:
+        return None
+
+    x = lp.x
+    # A_ntc rows: forward limits then reverse limits; only the fixed direction can bind
+    mu = np.abs(lp.ineqlin.marginals)
+    ombres = np.where(lb[-nl:] > 0.5, mu[:nl], mu[nl:])
+    res = _build_results(offres_list, demandes_list, mk['paires'], ntc_map,
+        x[:ns].tolist(), x[ns:ns+nd].tolist(), x[ns+nd:ns+nd+nl].tolist(), x[ns+nd+nl:ns+nd+2*nl].tolist(),
+        dict(zip(zones, lp.eqlin.marginals.tolist())), -lp.fun, ombres.tolist(), agg)
+    _lap(stats, 'extraction', t)
+    return res
+
+
+# ===================== MIN-COST FLOW BACKEND =====================
+
+# network_simplex is exact on integers: volumes in W, prices in c€/MWh
+_MW, _EUR = 10**6, 100
+
+
+def _run_network(offres_list, demandes_list, network_list, agg=None, stats=None, t=None, zones=ZONES):
+    """Clear as a min-cost flow with networkx's network simplex — no LP solver involved.
+
+    src → offer (capacity q, cost p) → zone ⇄ zone (NTC, both ways) → demand (capacity q,
+    cost -p) → snk, plus a zero-cost src → snk bypass carrying the unmatched supply. The
+    minimum cost is -welfare; zonal prices are the shortest-path distances from src in the
+    residual graph, i.e. the cost of serving one more MW in the zone.
+    """
+    stats = {'temps_ms': {}} if stats is None else stats
+    t = time.perf_counter() if t is None else t
+    G = nx.MultiDiGraph()
+    cap_s = [round(o['quantite_mw']*_MW) for o in offres_list]
+    cap_d = [round(d['quantite_mw']*_MW) for d in demandes_list]
+    supply = sum(cap_s)
+    G.add_node('src', demand=-supply); G.add_node('snk', demand=supply)
+    G.add_edge('src', 'snk', key=0, capacity=supply, weight=0)
+    for i, (o, c) in enumerate(zip(offres_list, cap_s)):
+        G.add_edge('src', ('o', i), key=0, capacity=c, weight=round(o['prix_eur']*_EUR))
+        G.add_edge(('o', i), o['zone'], key=0, weight=0)
+    for j, (d, c) in enumerate(zip(demandes_list, cap_d)):
+        G.add_edge(d['zone'], ('d', j), key=0, capacity=c, weight=-round(d['prix_eur']*_EUR))
+        G.add_edge(('d', j), 'snk', key=0, weight=0)
+    paires = [(n['zone_from'], n['zone_to']) for n in network_list]
+    for k, ((u, v), n) in enumerate(zip(paires, network_list)):
+        c = round(n['ntc_mw']*_MW)
+        G.add_edge(u, v, key=('l', k), capacity=c, weight=0)
+        G.add_edge(v, u, key=('l', k), capacity=c, weight=0)
+
+    # Arcs are the variables, node balances the constraints (two nonzeros per arc)
+    stats.update(nb_variables=G.number_of_edges(), nb_contraintes=G.number_of_nodes(), nb_binaires=0,
+                 nb_nonzeros=2*G.number_of_edges(), gap_mip=0.0, iterations=None)
+    t = _lap(stats, 'construction', t)
+    try:
+        cost, flow = nx.network_simplex(G)
+    except (nx.NetworkXUnfeasible, nx.NetworkXUnbounded):
+        return None
+    t = _lap(stats, 'resolution', t)
+
+    # Residual graph (parallel arcs collapsed to the cheapest) for the potentials
+    R = nx.DiGraph()
+    for u, v, k, a in G.edges(keys=True, data=True):
+        x, c, w = flow[u][v][k], a.get('capacity'), a['weight']
+        if c is None or x < c:
+            if not R.has_edge(u, v) or R[u][v]['weight'] > w: R.add_edge(u, v, weight=w)
+        if x > 0:
+            if not R.has_edge(v, u) or R[v][u]['weight'] > -w: R.add_edge(v, u, weight=-w)
+    dist = nx.single_source_bellman_ford_path_length(R, 'src')
+    # Zones out of reach of src (no supply, no served demand, no import) are priced at 0
+    prix_bruts = {z: dist.get(z, 0)/_EUR for z in zones}
+    t = _lap(stats, 'prix', t)
+
+    xs = [flow['src'][('o', i)][0]/c if c else 0 for i, c in enumerate(cap_s)]
+    xd = [flow[d['zone']][('d', j)][0]/c if c else 0 for j, (d, c) in enumerate(zip(demandes_list, cap_d))]
+    net = [(flow[u][v][('l', k)] - flow[v][u][('l', k)])/_MW for k, (u, v) in enumerate(paires)]
+    # Potentials are the duals: a saturated arc u → v is worth π_v - π_u per extra MW
+    ombres = []
+    for k, (u, v) in enumerate(paires):
+        a, b = (u, v) if net[k] >= 0 else (v, u)
+        sat = flow[a][b][('l', k)] >= G[a][b][('l', k)]['capacity'] > 0
+        ombres.append(max(0, prix_bruts.get(b, 0) - prix_bruts.get(a, 0)) if sat else 0)
+    ntc_map = {(n['zone_from'], n['zone_to']): n['ntc_mw'] for n in network_list}
+    res = _build_results(offres_list, demandes_list, paires, ntc_map, xs, xd,
+        [max(x, 0) for x in net], [max(-x, 0) for x in net], prix_bruts, -cost/(_MW*_EUR), ombres, agg)
+    _lap(stats, 'extraction', t)
+    return res
+
+
+# ===================== ZONAL DECOMPOSITION (ADMM) =====================
+
+def _run_admm(offres_list, demandes_list, network_list, agg=None, stats=None, t=None, zones=ZONES,
+              deadline=None):
+    """LP clearing by ADMM on the line flows, zone blocks solved in worker processes."""
+    stats = {'temps_ms': {}} if stats is None else stats
+    t = time.perf_counter() if t is None else t
+    paires = [(n['zone_from'], n['zone_to']) for n in network_list]
+    ntc = {p: n['ntc_mw'] for p, n in zip(paires, network_list)}
+    r = admm_clear(zones, offres_list, demandes_list, [(u, v, ntc[(u, v)]) for u, v in paires],
+                   deadline=deadline)
+    t = _lap(stats, 'resolution', t)
+    stats.update(nb_variables=len(offres_list) + len(demandes_list) + 2*len(paires),
+                 nb_contraintes=len(zones), nb_binaires=0, gap_mip=0.0, iterations=r['iterations'],
+                 statut=r['statut'], admm={k: r[k] for k in ('residu_mw', 'residu_prix', 'rho',
+                                                              'desequilibre_mw', 'blocs')})
+    prix_bruts = dict(zip(zones, r['prix'].tolist()))
+    xs, xd, net = r['xs'].tolist(), r['xd'].tolist(), r['flux'].tolist()
+    welfare = (sum(d['prix_eur']*d['quantite_mw']*x for d, x in zip(demandes_list, xd))
+               - sum(o['prix_eur']*o['quantite_mw']*x for o, x in zip(offres_list, xs)))
+    # Same rule as the network engine: a saturated line is worth the price difference across it
+    ombres = []
+    for (u, v), x in zip(paires, net):
+        a, b = (u, v) if x >= 0 else (v, u)
+        ombres.append(max(0, prix_bruts[b] - prix_bruts[a]) if abs(x) >= ntc[(u, v)] - 1e-6 else 0)
+    res = _build_results(offres_list, demandes_list, paires, ntc, xs, xd,
+        [max(x, 0) for x in net], [max(-x, 0) for x in net], prix_bruts, welfare, ombres, agg)
+    _lap(stats, 'extraction', t)
+    return res
@@ -0,0 +1,269 @@
+"""
+WAPP DAM Platform — Background clearing jobs
+Clearings are queued in the jobs table and run by a process pool, outside the Streamlit
+script run: a refresh or a closed browser tab does not stop them, and several sessions
+clear concurrently. Any page can poll a job through the jobs table.
+
+    python wapp_jobs.py                 # clear every closed session in parallel, then report
+    python wapp_jobs.py --timeout 600
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import wapp_db as db
+from wapp_cache import cached_clearing
+
+MAX_WORKERS = os.cpu_count() or 1
+# A running job is orphaned (server restarted mid-clearing) once its worker process is gone;
+# failing that check, once it has run this long past its session's time limit, or past
+# NO_LIMIT_S when there is none
+JOB_GRACE_S = 120
+NO_LIMIT_S = 3600
+ACTIVE = ('queued', 'running')
+
+_executor = None
+_pids = None  # worker processes announce their pid here
+_lock = threading.Lock()
+
+
+def clear_session(session_id, user_id):
+    """Clear a closed session with its solver settings and publish the result.
+
+    Returns the result, or None if the problem is infeasible (or no solution was found
+    within the time limit). Raises ValueError if the session cannot be cleared.
+    """
+    session = db.get_session(session_id)
+    if session is None or session['status'] != 'fermee':
+        raise ValueError("La session doit être fermée aux soumissions.")
+    offres = db.get_offres(session_id)
+    demandes = db.get_demandes(session_id)
+    if not offres or not demandes:
+        raise ValueError("Il faut au moins une offre et une demande.")
+    result = cached_clearing(offres, demandes, db.get_network(session_id),
+                             time_limit=session['time_limit_s'] or None, mip_gap=session['mip_gap'] or 0.0)
+    if result:
+        # Results, status and audit entry are published together
+        with db.transaction():
+            db.save_results(session_id, result['welfare'], result['prix'],
+                            result['offres'], result['demandes'], result['flux'], result['positions'],
+                            result['lignes'], result['rente_congestion'], result['stats'])
+            db.update_session_status(session_id, 'cloturee')
+            db.log_action(session_id, user_id, "Market clearing", f"Welfare: {result['welfare']:,.0f} €")
+    return result
+
+
+def run_job(job_id):
+    """Worker entry point: claim the job, clear its session and record the outcome."""
+    if not db.claim_job(job_id, os.getpid()):
+        return  # already taken by another worker
+    job = db.get_job(job_id)
+    try:
+        result = clear_session(job['session_id'], job['created_by'])
+    except Exception as e:
+        db.finish_job(job_id, 'failed', str(e))
+        return
+    if result is None:
+        db.finish_job(job_id, 'failed', "Problème infaisable ou limite de temps atteinte sans solution.")
+    else:
+        db.finish_job(job_id, 'done', f"Welfare : {result['welfare']:,.0f} €"
+                      + (" — limite de temps atteinte" if result['statut'] != 'optimal' else ""))
+
+
+def start_workers():
+    """Create this process's worker pool (once) and recover the jobs left by a previous run."""
+    return _pool()
+
+
+def _register_worker(pids):
+    pids.put(os.getpid())
+
+
+def _pool():
+    global _executor, _pids
+    with _lock:
+        if _executor is not None and not getattr(_executor, '_broken', False):
+            return _executor
+        first = _executor is None
+        # Spawned, not forked: the server may hold HiGHS instances whose threads would not survive a fork
+        ctx = multiprocessing.get_context('spawn')
+        _pids = ctx.Queue()
+        _executor = ProcessPoolExecutor(MAX_WORKERS, mp_context=ctx,
+                                        initializer=_register_worker, initargs=(_pids,))
+    if first:
+        recover_jobs()
+    return _executor
+
+
+def stop_workers(wait_s=30):
+    """Shut the pool down without waiting for its jobs.
+
+    Queued jobs are cancelled and stay queued for the next start; the ones already handed
+    to a worker are failed when it is killed.
+    """
+    with _lock:
+        executor, pids = _executor, _pids
+    if executor is None:
+        return
+    executor.shutdown(wait=False, cancel_futures=True)
+    # One dead worker breaks the pool, which then terminates the others and fails their jobs
+    try:
+        os.kill(pids.get(timeout=wait_s), signal.SIGTERM)
+    except (queue.Empty, ProcessLookupError):
+        pass
+
+
+def _submit(job_id):
+    fut = _pool().submit(run_job, job_id)
+    fut.add_done_callback(lambda f: _on_exit(job_id, f))
+
+
+def _on_exit(job_id, fut):
+    # run_job records its own errors: an exception here means the worker itself died.
+    # Jobs cancelled at shutdown stay queued and are resubmitted on the next start.
+    if fut.cancelled():
+        return
+    err = fut.exception()
+    if err is not None and db.get_job(job_id)['status'] in ACTIVE:
+        db.finish_job(job_id, 'failed', f"Worker interrompu : {err!r}")
+
+
+def submit_clearing(session_id, user_id):
+    """Queue the clearing of a session. Returns the job id (the pending one if already queued)."""
+    # First, so that the jobs queued by a previous run are resubmitted before being reused
+    _pool()
+    pending = [j for j in db.get_jobs(session_id, ACTIVE, limit=-1) if not _fail_orphan(j)]
+    if pending:
+        return pending[0]['id']
+    job_id = db.create_job(session_id, user_id)
+    _submit(job_id)
+    return job_id
+
+
+def submit_closed_sessions(user_id):
+    """Queue the clearing of every session closed to submissions. Returns the job ids."""
+    return [submit_clearing(s['id'], user_id) for s in db.get_sessions('fermee')]
+
+
+def batch_report(job_ids):
+    """One row per job: session, status, queue wait and clearing time (s), outcome."""
+    rows = []
+    for job_id in job_ids:
+        job = get_job(job_id)
+        start = datetime.fromisoformat(job['started_at']) if job['started_at'] else None
+        end = datetime.fromisoformat(job['finished_at']) if job['finished_at'] else None
+        rows.append({'job': job_id, 'session_id': job['session_id'],
+                     'session': db.get_session(job['session_id'])['name'], 'statut': job['status'],
+                     'duree_s': round((end - start).total_seconds(), 2) if start and end else None,
+                     'message': job['message']})
+    return rows
+
+
+def session_job(session_id):
+    """Latest job of a session (None if it was never queued)."""
+    jobs = db.get_jobs(session_id, limit=1)
+    return get_job(jobs[0]['id']) if jobs else None
+
+
+def get_job(job_id):
+    """Job row, failed first if it is an orphaned running job (see `_fail_orphan`)."""
+    job = db.get_job(job_id)
+    return db.get_job(job_id) if _fail_orphan(job) else job
+
+
+def _pid_alive(pid):
+    if os.name == 'nt':
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        return code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _fail_orphan(job):
+    """Fail a running job whose worker is dead or which overran its budget. True if failed."""
+    if job['status'] != 'running':
+        return False
+    dead = job['worker_pid'] and not _pid_alive(job['worker_pid'])
+    if not dead:
+        session = db.get_session(job['session_id'])
+        budget = (session['time_limit_s'] or NO_LIMIT_S) + JOB_GRACE_S
+        if not job['started_at'] or (datetime.now() - datetime.fromisoformat(job['started_at'])).total_seconds() <= budget:
+            return False
+    db.finish_job(job['id'], 'failed', "Interrompu (worker arrêté ou redémarrage du serveur)")
+    return True
+
+
+def recover_jobs():
+    """Fail the running jobs orphaned by a server restart and resubmit the queued ones."""
+    for job in db.get_jobs(statuses=ACTIVE, limit=-1):
+        if job['status'] == 'queued':
+            # claim_job makes this safe if another process also picks it up
+            _submit(job['id'])
+        else:
+            _fail_orphan(job)
+
+
+def wait_job(job_id, timeout=None, poll=0.5):
+    """Block until the job is done or failed, or `timeout` s elapse; returns its row."""
+    end = time.monotonic() + timeout if timeout is not None else None
+    while True:
+        job = get_job(job_id)
+        if job['status'] not in ACTIVE or (end is not None and time.monotonic() >= end):
+            return job
+        time.sleep(poll)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Clearing en parallèle de toutes les sessions fermées")
+    ap.add_argument('--user', default='admin', help="utilisateur inscrit au journal d'audit")
+    ap.add_argument('--timeout', type=float, default=None, help="attente maximale par job (s)")
+    args = ap.parse_args()
+    user = next((u for u in db.get_all_users() if u['username'] == args.user), None)
+    if user is None:
+        sys.exit(f"Utilisateur inconnu : {args.user}")
+
+    t0 = time.perf_counter()
+    job_ids = submit_closed_sessions(user['id'])
+    if not job_ids:
+        print("Aucune session fermée.")
+        return
+    print(f"{len(job_ids)} session(s) en file, {MAX_WORKERS} worker(s)")
+    for job_id in job_ids:
+        wait_job(job_id, args.timeout)
+    rows = batch_report(job_ids)
+    unfinished = sum(r['statut'] in ACTIVE for r in rows)
+    if unfinished:
+        # Otherwise the exit would wait for them all
+        stop_workers()
+    for r in rows:
+        duree = f"{r['duree_s']:>8.2f} s" if r['duree_s'] is not None else f"{'—':>10}"
+        statut = 'non terminé' if r['statut'] in ACTIVE else r['statut']
+        print(f"#{r['job']:<5} {r['session']:<30} {statut:<11} {duree}  {r['message'] or ''}")
+    failed = sum(r['statut'] == 'failed' for r in rows)
+    print(f"{len(rows) - failed - unfinished}/{len(rows)} sessions clôturées en {time.perf_counter() - t0:.1f} s"
+          + (f", {failed} en échec" if failed else "")
+          + (f", {unfinished} non terminée(s)" if unfinished else ""))
+    sys.exit(1 if failed or unfinished else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,15 +6,18 @@ import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
-from pyomo.environ import *
-import json, os
+import json, os, time
 from datetime import datetime, date
 
 import wapp_db as db
+from wapp_engine import ZONES, ENGINES, MODES, preview_ntc, preview_bid
+from wapp_sim import (BASE_LIGNES, generate_offres, generate_demandes, sim_inputs,
+                      sweep_values, scenario_grid, run_sweep)
+from wapp_cache import cached_clearing, cache_stats
+import wapp_jobs as jobs
 
 st.set_page_config(page_title="WAPP DAM Platform", page_icon="⚡", layout="wide")
 
-ZONES = ['BEN','BFA','CIV','GMB','GHA','GIN','GNB','LBR','MLI','NER','NGA','SEN','SLE','TGO']
 ZONE_NAMES = {
     'BEN':'Bénin','BFA':'Burkina Faso','CIV':"Côte d'Ivoire",'GMB':'Gambie','GHA':'Ghana',
     'GIN':'Guinée','GNB':'Guinée-Bissau','LBR':'Libéria','MLI':'Mali','NER':'Niger',
@@ -34,6 +37,7 @@ ROLE_LABELS = {'admin':'Administrateur','participant':'Participant Marché',
 ROLE_COLORS = {'admin':'#E74C3C','participant':'#2B4C7E',
                'tso':'#F39C12','regulateur':'#8E44AD'}
 STATUS_MAP = {'ouverte':('Ouverte','success'),'fermee':('Fermée','warning'),'cloturee':('Clôturée','info')}
+JOB_STATUS = {'queued':'🕒 En file','running':'⏳ En cours','done':'✅ Terminé','failed':'❌ Échec'}
 
 # ===================== COLORS =====================
 P = '#2B4C7E'; PL = '#3D6098'; PD = '#1A3456'
@@ -118,88 +122,30 @@ def status_badge(status):
     label, kind = STATUS_MAP.get(status, (status, 'info'))
     return badge(label, kind)
 
-
-# ===================== SOLVER =====================
-
-def run_clearing_engine(offres_list, demandes_list, network_list):
-    offres = {i: o for i, o in enumerate(offres_list)}
-    demandes = {i: d for i, d in enumerate(demandes_list)}
-    paires, ntc = [], {}
-    for n in network_list:
-        pair = (n['zone_from'], n['zone_to'])
-        paires.append(pair)
-        ntc[pair] = n['ntc_mw']
-
-    m = ConcreteModel()
-    m.Z = Set(initialize=ZONES); m.S = Set(initialize=offres.keys())
-    m.D = Set(initialize=demandes.keys()); m.P = Set(initialize=paires, dimen=2)
-    m.xs = Var(m.S, bounds=(0,1)); m.xd = Var(m.D, bounds=(0,1))
-    m.f = Var(m.P, domain=NonNegativeReals); m.fr = Var(m.P, domain=NonNegativeReals)
-    m.b = Var(m.P, domain=Binary)
-
-    def obj(m):
-        return sum(demandes[d]['prix_eur']*demandes[d]['quantite_mw']*m.xd[d] for d in m.D) - \
-               sum(offres[s]['prix_eur']*offres[s]['quantite_mw']*m.xs[s] for s in m.S)
-    m.obj = Objective(rule=obj, sense=maximize)
-
-    def bal(m, z):
-        prod = sum(offres[s]['quantite_mw']*m.xs[s] for s in m.S if offres[s]['zone']==z)
-        cons = sum(demandes[d]['quantite_mw']*m.xd[d] for d in m.D if demandes[d]['zone']==z)
-        imp = sum(m.f[u,v] for (u,v) in paires if v==z) + sum(m.fr[u,v] for (u,v) in paires if u==z)
-        exp = sum(m.f[u,v] for (u,v) in paires if u==z) + sum(m.fr[u,v] for (u,v) in paires if v==z)
-        return prod + imp - exp == cons
-    m.bal = Constraint(m.Z, rule=bal)
-    m.ntc_f = Constraint(m.P, rule=lambda m,u,v: m.f[u,v] <= ntc[(u,v)]*m.b[u,v])
-    m.ntc_r = Constraint(m.P, rule=lambda m,u,v: m.fr[u,v] <= ntc[(u,v)]*(1-m.b[u,v]))
-
-    m.dual = Suffix(direction=Suffix.IMPORT)
-    opt = SolverFactory('glpk')
-    res = opt.solve(m, tee=False)
-    if res.solver.termination_condition != TerminationCondition.optimal:
-        return None
-
-    for (u,v) in paires: m.b[u,v].fix(round(value(m.b[u,v])))
-    opt.solve(m, tee=False)
-
-    prix = {}
-    for z in ZONES:
-        p = -m.dual.get(m.bal[z], 0)
-        if p < 0:
-            accepted = [(offres[s]['prix_eur'], value(m.xs[s])) for s in m.S
-                        if offres[s]['zone']==z and value(m.xs[s])>0.01]
-            p = max([pr for pr,_ in accepted], default=0) if accepted else 0
-        prix[z] = round(p, 2)
-
-    off_res = []
-    for s in m.S:
-        v = value(m.xs[s])
-        off_res.append({**offres[s], 'volume_accepte': round(v*offres[s]['quantite_mw'],1),
-            'ratio': round(v,3), 'statut': 'Accepté' if v>0.99 else ('Partiel' if v>0.01 else 'Rejeté')})
-
-    dem_res = []
-    for d in m.D:
-        v = value(m.xd[d])
-        dem_res.append({**demandes[d], 'volume_servi': round(v*demandes[d]['quantite_mw'],1),
-            'ratio': round(v,3), 'statut': 'Servi' if v>0.99 else ('Partiel' if v>0.01 else 'Non servi')})
-
-    flux_res = []
-    for (u,v) in paires:
-        fwd, rev = value(m.f[u,v]), value(m.fr[u,v])
-        if fwd>0.1:
-            flux_res.append({'de':u,'vers':v,'flux_mw':round(fwd,1),'ntc':ntc[(u,v)],
-                'taux':round(fwd/ntc[(u,v)]*100,1),'saturee':fwd>=ntc[(u,v)]-0.1})
-        if rev>0.1:
-            flux_res.append({'de':v,'vers':u,'flux_mw':round(rev,1),'ntc':ntc[(u,v)],
-                'taux':round(rev/ntc[(u,v)]*100,1),'saturee':rev>=ntc[(u,v)]-0.1})
-
-    positions = {}
-    for z in ZONES:
-        prod = sum(offres[s]['quantite_mw']*value(m.xs[s]) for s in m.S if offres[s]['zone']==z)
-        cons = sum(demandes[d]['quantite_mw']*value(m.xd[d]) for d in m.D if demandes[d]['zone']==z)
-        positions[z] = round(prod-cons, 1)
-
-    return {'welfare': round(value(m.obj),2), 'prix': prix,
-            'offres': off_res, 'demandes': dem_res, 'flux': flux_res, 'positions': positions}
+SESSION_PAGE = 50
+
+def session_select(label, status=None, key="sess", format_func=None, none_label=None):
+    """Session picker over pages of SESSION_PAGE sessions, most recent first.
+
+    Returns the selected session (None if there is none, or `none_label` is picked).
+    """
+    cursors = st.session_state.setdefault(f"{key}_pages", [None])
+    page = db.get_sessions(status, limit=SESSION_PAGE + 1, before=cursors[-1])
+    if not page and len(cursors) > 1:
+        # The sessions of that page no longer match (status changed): back to the first one
+        del cursors[1:]
+        page = db.get_sessions(status, limit=SESSION_PAGE + 1)
+    more, page = len(page) > SESSION_PAGE, page[:SESSION_PAGE]
+    if len(cursors) > 1 or more:
+        c1, c2 = st.columns(2)
+        if len(cursors) > 1 and c1.button("◀ Plus récentes", key=f"{key}_newer"):
+            cursors.pop(); st.rerun()
+        if more and c2.button("Plus anciennes ▶", key=f"{key}_older"):
+            cursors.append(page[-1]['id']); st.rerun()
+    fmt = format_func or (lambda s: f"{s['name']} — {s['market_date']}")
+    if none_label:
+        return st.selectbox(label, [None] + page, format_func=lambda s: none_label if s is None else fmt(s), key=key)
+    return st.selectbox(label, page, format_func=fmt, key=key) if page else None
 
 
 # ===================== RESULT CHARTS =====================
@@ -248,6 +194,14 @@ def plot_network_results(res, network_list):
     return styled(fig, 500)
 
 
+def limit_warning(stats):
+    """Warn when the clearing stopped at its time limit, with the gap to the optimum."""
+    if stats and stats.get('statut', 'optimal') != 'optimal':
+        gap = stats.get('gap_mip')
+        st.warning("⏱️ Limite de temps atteinte : meilleure solution trouvée, non prouvée optimale"
+                   + (f" (écart MIP ≤ {gap:.2%})." if gap is not None else "."))
+
+
 def show_results_panel(session_id):
     r = db.get_results(session_id)
     if not r:
@@ -256,6 +210,7 @@ def show_results_panel(session_id):
     res = {'welfare': r['welfare'], 'prix': r['prix_zonaux'], 'offres': r['offres_result'],
            'demandes': r['demandes_result'], 'flux': r['flux_result'], 'positions': r['positions']}
     net = db.get_network(session_id)
+    limit_warning(r.get('stats'))
     pv = list(res['prix'].values())
 
     c1,c2,c3,c4 = st.columns(4)
@@ -304,7 +259,7 @@ def show_results_panel(session_id):
                      for o in odf if o['volume_accepte']>0)
             sc = sum((d['prix_eur']-res['prix'].get(d['zone'],0))*d['volume_servi']
                      for d in ddf if d['volume_servi']>0)
-            rc = res['welfare'] - sp - sc
+            rc = r['rente_congestion'] if r['rente_congestion'] is not None else res['welfare'] - sp - sc
             fig = go.Figure(go.Pie(labels=['Surplus conso.','Surplus prod.','Rente congestion'],
                 values=[max(0,sc),max(0,sp),rc], marker_colors=[INF,OK,WR],
                 textinfo='label+percent', hole=0.5))
@@ -320,6 +275,11 @@ def show_results_panel(session_id):
                 fig = px.bar(pos, y='Zone', x='MW', color='Type', orientation='h',
                     color_discrete_map={'Exportateur':OK,'Importateur':INF}, title="Positions nettes")
                 st.plotly_chart(styled(fig, 400), use_container_width=True)
+        if r['lignes_result']:
+            ldf = pd.DataFrame(r['lignes_result']).sort_values('rente', ascending=False)
+            ldf.columns = ['De','Vers','NTC (MW)','Flux (MW)',"Prix d'ombre (€/MWh)",'Rente (€)']
+            st.markdown(f"**Rente de congestion par ligne** — total {r['rente_congestion']:,.0f} €")
+            st.dataframe(ldf, use_container_width=True, hide_index=True)
 
 
 # ===================== LOGIN =====================
@@ -370,126 +330,105 @@ def _run_demo_simulation():
     user_map = {u['username']: u for u in users}
     admin_id = st.session_state.user['id']
 
-    # Create session
-    n = len(db.get_sessions()) + 1
-    sid = db.create_session(f"Simulation {n}", date.today().isoformat(), admin_id)
-    db.log_action(sid, admin_id, "Création session (simulation)", f"Simulation {n}")
-
-    # ---- OFFRES from producers ----
-    demo_offres = [
-        # (username, membre, zone, MW, €/MWh)
-        ('mainstream', 'Mainstream Solar', 'NGA', 800, 22),
-        ('egbin', 'Egbin Power', 'NGA', 1000, 28),
-        ('geregu', 'Geregu Power', 'NGA', 400, 32),
-        ('delta', 'Transcorp Ughelli', 'NGA', 450, 35),
-        ('afam', 'Afam Power', 'NGA', 500, 38),
-        ('vra', 'VRA Akosombo', 'GHA', 900, 30),
-        ('sunon', 'Sunon Asogli', 'GHA', 300, 52),
-        ('cenpower', 'Cenpower Kpone', 'GHA', 200, 62),
-        ('karpower', 'Karpowership GHA', 'GHA', 400, 72),
-        ('cie', 'CI-Energies Hydro', 'CIV', 600, 28),
-        ('ciprel', 'CIPREL Gaz', 'CIV', 400, 45),
-        ('azito', 'Azito Energie', 'CIV', 300, 50),
-        ('aggreko', 'Aggreko CIV', 'CIV', 100, 92),
-        ('omvs', 'OMVS Manantali', 'SEN', 150, 38),
-        ('senelec', 'SENELEC Thermal', 'SEN', 400, 115),
-        ('omvs', 'OMVS Félou', 'MLI', 150, 38),
-    ]
-
-    # Offres from actors submitted via their own accounts
-    extra_offres = [
-        ('omvg', 'OMVG Kaleta', 'GIN', 100, 42),
-        ('omvg', 'OMVG Saltinho', 'GNB', 40, 42),
-        ('omvg', 'OMVG Sambangalou', 'GMB', 30, 42),
-        ('edg', 'EDG Garafiri', 'GIN', 100, 82),
-        ('contglobal', 'ContourGlobal Togo', 'TGO', 100, 98),
-        ('ceb', 'CEB Nangbéto', 'BEN', 50, 105),
-        ('sonabel', 'SONABEL Kompienga', 'BFA', 150, 142),
-        ('edm', 'EDM-SA Génération', 'MLI', 200, 138),
-        ('nawec', 'NAWEC Brikama', 'GMB', 50, 155),
-        ('eagb', 'EAGB Bissau', 'GNB', 30, 165),
-        ('lec', 'LEC Monrovia', 'LBR', 80, 148),
-        ('edsa', 'EDSA Freetown', 'SLE', 60, 155),
-        ('nigelec', 'NIGELEC Niamey', 'NER', 80, 132),
-    ]
-
-    for username, membre, zone, mw, prix in demo_offres:
-        uid = user_map[username]['id'] if username in user_map else admin_id
-        db.add_offre(sid, uid, membre, zone, mw, prix)
-        db.log_action(sid, uid, "Soumission offre", f"{membre} — {mw} MW @ {prix} €/MWh")
-
-    for username, membre, zone, mw, prix in extra_offres:
-        uid = user_map[username]['id'] if username in user_map else admin_id
-        db.add_offre(sid, uid, membre, zone, mw, prix)
-        db.log_action(sid, uid, "Soumission offre", f"{membre} — {mw} MW @ {prix} €/MWh")
-
-    # ---- DEMANDES from buyers (same companies, demand side) ----
-    demo_demandes = [
-        ('ecg', 'ECG Ghana', 'GHA', 1800, 130),
-        ('nedco', 'NEDCO Ghana', 'GHA', 400, 125),
-        ('sbee', 'SBEE Bénin', 'BEN', 400, 160),
-        ('sonabel', 'SONABEL (Demande)', 'BFA', 500, 200),
-        ('senelec', 'SENELEC (Demande)', 'SEN', 700, 170),
-        ('cie', 'CIE Distribution', 'CIV', 1600, 150),
-        ('ceet', 'CEET Togo', 'TGO', 300, 155),
-        ('edm', 'EDM-SA (Demande)', 'MLI', 550, 190),
-        ('nigelec', 'NIGELEC (Demande)', 'NER', 350, 210),
-        ('edg', 'EDG (Demande)', 'GIN', 400, 160),
-        ('edsa', 'EDSA (Demande)', 'SLE', 150, 180),
-        ('lec', 'LEC (Demande)', 'LBR', 120, 175),
-        ('nawec', 'NAWEC (Demande)', 'GMB', 80, 190),
-        ('eagb', 'EAGB (Demande)', 'GNB', 50, 195),
-    ]
-
-    # Nigeria: multiple DisCos submit demand
-    nigeria_demandes = [
-        ('ecg', 'Eko DisCo Lagos', 'NGA', 1200, 120),   # using ecg as proxy, will match admin
-        ('ecg', 'Ibadan DisCo', 'NGA', 800, 118),
-        ('ecg', 'Abuja DisCo', 'NGA', 1000, 122),
-        ('ecg', 'Ikeja DisCo', 'NGA', 500, 115),
-    ]
-
-    for username, membre, zone, mw, prix in demo_demandes:
-        uid = user_map[username]['id'] if username in user_map else admin_id
-        db.add_demande(sid, uid, membre, zone, mw, prix)
-        db.log_action(sid, uid, "Soumission demande", f"{membre} — {mw} MW @ {prix} €/MWh")
-
-    for username, membre, zone, mw, prix in nigeria_demandes:
-        uid = user_map.get(username, {}).get('id', admin_id) if isinstance(user_map.get(username), dict) else admin_id
-        db.add_demande(sid, admin_id, membre, zone, mw, prix)
-        db.log_action(sid, admin_id, "Soumission demande (sim.)", f"{membre} — {mw} MW @ {prix} €/MWh")
-
-    # ---- Close and run clearing ----
-    db.update_session_status(sid, 'fermee')
-    db.log_action(sid, admin_id, "Fermeture soumissions (auto)")
-
-    offres = db.get_offres(sid)
-    demandes = db.get_demandes(sid)
-    network = db.get_network(sid)
-
-    result = run_clearing_engine(offres, demandes, network)
-    if result:
-        db.save_results(sid, result['welfare'], result['prix'],
-                        result['offres'], result['demandes'], result['flux'], result['positions'])
-        db.update_session_status(sid, 'cloturee')
-        db.log_action(sid, admin_id, "Market clearing (simulation)",
-                      f"Welfare: {result['welfare']:,.0f} €")
-        st.success(f"✅ Simulation terminée — **{len(offres)} offres**, **{len(demandes)} demandes**, Welfare : **{result['welfare']:,.0f} €**")
-        st.balloons()
-    else:
-        st.error("Clearing infaisable.")
+    # One transaction: the session is only visible once its whole order book is in
+    with db.transaction():
+        # Create session
+        n = db.count_sessions() + 1
+        sid = db.create_session(f"Simulation {n}", date.today().isoformat(), admin_id)
+        db.log_action(sid, admin_id, "Création session (simulation)", f"Simulation {n}")
+
+        # ---- OFFRES from producers ----
+        demo_offres = [
+            # (username, membre, zone, MW, €/MWh)
+            ('mainstream', 'Mainstream Solar', 'NGA', 800, 22),
+            ('egbin', 'Egbin Power', 'NGA', 1000, 28),
+            ('geregu', 'Geregu Power', 'NGA', 400, 32),
+            ('delta', 'Transcorp Ughelli', 'NGA', 450, 35),
+            ('afam', 'Afam Power', 'NGA', 500, 38),
+            ('vra', 'VRA Akosombo', 'GHA', 900, 30),
+            ('sunon', 'Sunon Asogli', 'GHA', 300, 52),
+            ('cenpower', 'Cenpower Kpone', 'GHA', 200, 62),
+            ('karpower', 'Karpowership GHA', 'GHA', 400, 72),
+            ('cie', 'CI-Energies Hydro', 'CIV', 600, 28),
+            ('ciprel', 'CIPREL Gaz', 'CIV', 400, 45),
+            ('azito', 'Azito Energie', 'CIV', 300, 50),
+            ('aggreko', 'Aggreko CIV', 'CIV', 100, 92),
+            ('omvs', 'OMVS Manantali', 'SEN', 150, 38),
+            ('senelec', 'SENELEC Thermal', 'SEN', 400, 115),
+            ('omvs', 'OMVS Félou', 'MLI', 150, 38),
+        ]
+
+        # Offres from actors submitted via their own accounts
+        extra_offres = [
+            ('omvg', 'OMVG Kaleta', 'GIN', 100, 42),
+            ('omvg', 'OMVG Saltinho', 'GNB', 40, 42),
+            ('omvg', 'OMVG Sambangalou', 'GMB', 30, 42),
+            ('edg', 'EDG Garafiri', 'GIN', 100, 82),
+            ('contglobal', 'ContourGlobal Togo', 'TGO', 100, 98),
+            ('ceb', 'CEB Nangbéto', 'BEN', 50, 105),
+            ('sonabel', 'SONABEL Kompienga', 'BFA', 150, 142),
+            ('edm', 'EDM-SA Génération', 'MLI', 200, 138),
+            ('nawec', 'NAWEC Brikama', 'GMB', 50, 155),
+            ('eagb', 'EAGB Bissau', 'GNB', 30, 165),
+            ('lec', 'LEC Monrovia', 'LBR', 80, 148),
+            ('edsa', 'EDSA Freetown', 'SLE', 60, 155),
+            ('nigelec', 'NIGELEC Niamey', 'NER', 80, 132),
+        ]
+
+        db.add_offres(sid, [(user_map[username]['id'] if username in user_map else admin_id, membre, zone, mw, prix)
+                            for username, membre, zone, mw, prix in demo_offres + extra_offres])
+
+        # ---- DEMANDES from buyers (same companies, demand side) ----
+        demo_demandes = [
+            ('ecg', 'ECG Ghana', 'GHA', 1800, 130),
+            ('nedco', 'NEDCO Ghana', 'GHA', 400, 125),
+            ('sbee', 'SBEE Bénin', 'BEN', 400, 160),
+            ('sonabel', 'SONABEL (Demande)', 'BFA', 500, 200),
+            ('senelec', 'SENELEC (Demande)', 'SEN', 700, 170),
+            ('cie', 'CIE Distribution', 'CIV', 1600, 150),
+            ('ceet', 'CEET Togo', 'TGO', 300, 155),
+            ('edm', 'EDM-SA (Demande)', 'MLI', 550, 190),
+            ('nigelec', 'NIGELEC (Demande)', 'NER', 350, 210),
+            ('edg', 'EDG (Demande)', 'GIN', 400, 160),
+            ('edsa', 'EDSA (Demande)', 'SLE', 150, 180),
+            ('lec', 'LEC (Demande)', 'LBR', 120, 175),
+            ('nawec', 'NAWEC (Demande)', 'GMB', 80, 190),
+            ('eagb', 'EAGB (Demande)', 'GNB', 50, 195),
+        ]
+
+        # Nigeria: multiple DisCos submit demand
+        nigeria_demandes = [
+            ('ecg', 'Eko DisCo Lagos', 'NGA', 1200, 120),   # using ecg as proxy, will match admin
+            ('ecg', 'Ibadan DisCo', 'NGA', 800, 118),
+            ('ecg', 'Abuja DisCo', 'NGA', 1000, 122),
+            ('ecg', 'Ikeja DisCo', 'NGA', 500, 115),
+        ]
+
+        db.add_demandes(sid, [(user_map[username]['id'] if username in user_map else admin_id, membre, zone, mw, prix)
+                              for username, membre, zone, mw, prix in demo_demandes])
+        # The Nigerian DisCos have no account: submitted by the operator
+        db.add_demandes(sid, [(admin_id, membre, zone, mw, prix) for _, membre, zone, mw, prix in nigeria_demandes],
+                        "Soumission demande (sim.)")
+
+        # ---- Close and run clearing ----
+        db.update_session_status(sid, 'fermee')
+        db.log_action(sid, admin_id, "Fermeture soumissions (auto)")
+
+    jobs.submit_clearing(sid, admin_id)
+    db.log_action(sid, admin_id, "Clearing mis en file (simulation)")
 
 
 # ===================== ADMIN PAGES =====================
 
 def admin_dashboard():
     page_hdr("Tableau de bord", "Vue d'ensemble du système — Administration WAPP")
-    sessions = db.get_sessions()
+    sessions = db.get_sessions(limit=5)
     users = db.get_all_users()
+    data = db.get_dashboard_data()
 
     c1,c2,c3,c4 = st.columns(4)
-    open_s = sum(1 for s in sessions if s['status']=='ouverte')
-    with c1: st.markdown(mcard("Sessions", str(len(sessions)), f"{open_s} ouvertes", P), unsafe_allow_html=True)
+    open_s = data['statuts'].get('ouverte', 0)
+    with c1: st.markdown(mcard("Sessions", str(sum(data['statuts'].values())), f"{open_s} ouvertes", P), unsafe_allow_html=True)
     with c2: st.markdown(mcard("Utilisateurs", str(len(users)), "", INF), unsafe_allow_html=True)
     prods = sum(1 for u in users if u['role']=='participant')
     with c3: st.markdown(mcard("Participants", str(prods), "", OK), unsafe_allow_html=True)
@@ -500,7 +439,7 @@ def admin_dashboard():
     if sessions:
         st.markdown("<br>", unsafe_allow_html=True)
         st.markdown("#### Sessions récentes")
-        for s in sessions[:5]:
+        for s in sessions:
             c1,c2,c3,c4 = st.columns([3,2,2,1])
             c1.write(f"**{s['name']}** — {s['market_date']}")
             c2.markdown(status_badge(s['status']), unsafe_allow_html=True)
@@ -510,25 +449,25 @@ def admin_dashboard():
                 st.session_state.admin_page = "Gestion des Sessions"
                 st.rerun()
 
+    recent_jobs = db.get_jobs(limit=8)
+    if recent_jobs:
+        st.markdown("#### Clearings en arrière-plan")
+        df = pd.DataFrame(recent_jobs)[['id','session_name','status','creator_name','started_at','finished_at','message']]
+        df['status'] = df['status'].map(JOB_STATUS)
+        df.columns = ['Job','Session','État','Lancé par','Début','Fin','Résultat']
+        st.dataframe(df, use_container_width=True, hide_index=True)
+
     # Network map + charts for the latest session with data
     st.markdown("---")
     st.markdown("#### Réseau WAPP & Données marché")
 
-    # Find latest session with offers for charts
-    active_sid = None
-    for s in sessions:
-        off = db.get_offres(s['id'])
-        dem = db.get_demandes(s['id'])
-        if off or dem:
-            active_sid = s['id']
-            break
+    # Latest session with bids: network, capacity/demand by zone and results, or default positions
+    active_sid = data['session']['id'] if data['session'] else None
+    net_data = data['reseau'] or None
+    res_data = data['resultat']
 
     tab_net, tab_geo, tab_map = st.tabs(["⚡ Réseau schématique", "🌍 Carte géographique", "🗺️ Carte WAPP officielle"])
 
-    # Get network from latest session or use default positions
-    net_data = db.get_network(active_sid) if active_sid else None
-    res_data = db.get_results(active_sid) if active_sid else None
-
     with tab_net:
         import networkx as nx
         G = nx.Graph()
@@ -630,14 +569,11 @@ def admin_dashboard():
 
     # Capacity & Demand charts
     if active_sid:
-        offres = db.get_offres(active_sid)
-        demandes = db.get_demandes(active_sid)
         st.markdown("---")
         c1, c2 = st.columns(2)
         with c1:
-            if offres:
-                df_o = pd.DataFrame(offres)
-                cap = df_o.groupby('zone')['quantite_mw'].sum().reindex(ZONES, fill_value=0)
+            if data['capacite']:
+                cap = pd.Series(data['capacite']).reindex(ZONES, fill_value=0)
                 fig = go.Figure(go.Bar(
                     x=[f"{ZONE_FLAGS.get(z,'')} {z}" for z in cap.index], y=cap.values,
                     marker_color=P, marker_line=dict(width=0),
@@ -646,9 +582,8 @@ def admin_dashboard():
                 fig.update_yaxes(title_text="MW")
                 st.plotly_chart(styled(fig, 380), use_container_width=True)
         with c2:
-            if demandes:
-                df_d = pd.DataFrame(demandes)
-                dem = df_d.groupby('zone')['quantite_mw'].sum().reindex(ZONES, fill_value=0)
+            if data['demande']:
+                dem = pd.Series(data['demande']).reindex(ZONES, fill_value=0)
                 fig = go.Figure(go.Bar(
                     x=[f"{ZONE_FLAGS.get(z,'')} {z}" for z in dem.index], y=dem.values,
                     marker_color=INF, marker_line=dict(width=0),
@@ -706,7 +641,7 @@ def admin_sessions():
         with st.expander("➕ Nouvelle session", expanded=False):
             with st.form("new_session"):
                 c1, c2 = st.columns(2)
-                name = c1.text_input("Nom", value=f"Session {len(db.get_sessions())+1}")
+                name = c1.text_input("Nom", value=f"Session {db.count_sessions()+1}")
                 mdate = c2.date_input("Date de marché", value=date.today())
                 if st.form_submit_button("Créer la session", type="primary"):
                     sid = db.create_session(name, mdate.isoformat(), st.session_state.user['id'])
@@ -724,14 +659,26 @@ def admin_sessions():
                 _run_demo_simulation()
                 st.rerun()
 
-    sessions = db.get_sessions()
-    if not sessions:
+    if not db.count_sessions():
         st.info("Aucune session. Créez-en une ci-dessus."); return
 
+    closed = db.count_sessions('fermee')
+    if closed and st.button(f"⚡ Clearing de toutes les sessions fermées ({closed})", key="run_batch"):
+        st.session_state.batch_jobs = jobs.submit_closed_sessions(st.session_state.user['id'])
+        db.log_action(None, st.session_state.user['id'], "Clearing groupé mis en file",
+                      f"{len(st.session_state.batch_jobs)} sessions")
+    if st.session_state.get('batch_jobs'):
+        if any(jobs.get_job(j)['status'] in jobs.ACTIVE for j in st.session_state.batch_jobs):
+            batch_progress(st.session_state.batch_jobs)
+        else:
+            batch_panel(st.session_state.batch_jobs)
+            if st.button("Fermer le rapport", key="batch_done"):
+                del st.session_state.batch_jobs
+                st.rerun()
+
     # Session selector
-    sel = st.selectbox("Session", sessions,
-        format_func=lambda s: f"{s['name']} — {s['market_date']} ({STATUS_MAP[s['status']][0]})",
-        index=0, key="admin_sess_sel")
+    sel = session_select("Session", key="admin_sess_sel",
+        format_func=lambda s: f"{s['name']} — {s['market_date']} ({STATUS_MAP[s['status']][0]})")
 
     if not sel: return
     sid = sel['id']
@@ -748,31 +695,39 @@ def admin_sessions():
             db.log_action(sid, st.session_state.user['id'], "Fermeture soumissions")
             st.rerun()
 
-    if session['status'] == 'fermee':
+    job = jobs.session_job(sid)
+    if job and job['status'] in jobs.ACTIVE:
+        job_progress(job['id'])
+    elif session['status'] == 'fermee':
         if c2.button("🔓 Réouvrir", key="reopen"):
             db.update_session_status(sid, 'ouverte')
             db.log_action(sid, st.session_state.user['id'], "Réouverture session")
             st.rerun()
         if c3.button("⚡ Lancer clearing", type="primary", key="run_clear"):
-            offres = db.get_offres(sid)
-            demandes = db.get_demandes(sid)
-            network = db.get_network(sid)
-            if not offres or not demandes:
+            if not session['nb_offres'] or not session['nb_demandes']:
                 st.error("Il faut au moins une offre et une demande.")
             else:
-                with st.spinner("Résolution MILP..."):
-                    result = run_clearing_engine(offres, demandes, network)
-                if result:
-                    db.save_results(sid, result['welfare'], result['prix'],
-                                    result['offres'], result['demandes'], result['flux'], result['positions'])
-                    db.update_session_status(sid, 'cloturee')
-                    db.log_action(sid, st.session_state.user['id'], "Market clearing",
-                                  f"Welfare: {result['welfare']:,.0f} €")
-                    st.success(f"Clearing terminé — Welfare : {result['welfare']:,.0f} €")
-                    st.balloons()
+                jobs.submit_clearing(sid, st.session_state.user['id'])
+                db.log_action(sid, st.session_state.user['id'], "Clearing mis en file")
+                st.rerun()
+        if job and job['status'] == 'failed':
+            st.error(f"Dernier clearing en échec (job #{job['id']}) : {job['message']}")
+
+    if session['status'] != 'cloturee':
+        with st.expander("⚙️ Paramètres du solveur"):
+            with st.form("solver_params"):
+                s1, s2 = st.columns(2)
+                tl = s1.number_input("Limite de temps (s, 0 = aucune)", 0.0, 3600.0,
+                                     float(session['time_limit_s'] or 0), 5.0)
+                gap = s2.number_input("Écart MIP relatif accepté (%)", 0.0, 10.0,
+                                      float(session['mip_gap'] or 0) * 100, 0.1, format="%.2f")
+                if st.form_submit_button("💾 Enregistrer"):
+                    db.update_session_solver(sid, tl, gap / 100)
+                    db.log_action(sid, st.session_state.user['id'], "Paramètres solveur",
+                                  f"Limite {tl:g} s, écart MIP {gap:g} %")
                     st.rerun()
-                else:
-                    st.error("Problème infaisable.")
+            st.caption("À la limite de temps, la meilleure solution trouvée est publiée avec son écart "
+                       "à l'optimum ; sans solution, le clearing échoue.")
 
     # Tabs: Offres / Demandes / Réseau / Résultats
     tab_o, tab_d, tab_n, tab_r = st.tabs(["🏭 Producteurs","📋 Acheteurs","🔌 Réseau","📊 Résultats"])
@@ -807,10 +762,88 @@ def admin_sessions():
     with tab_r:
         if session['status'] == 'cloturee':
             show_results_panel(sid)
+            show_clearing_stats(sid)
         else:
             st.info("Le clearing n'a pas encore été exécuté.")
 
 
+STAGES = {'agregation': 'Agrégation', 'construction': 'Construction du modèle', 'resolution': 'Résolution',
+          'resolution_lp': 'Re-résolution LP (prix)', 'prix': 'Potentiels (prix)', 'extraction': 'Extraction'}
+
+
+@st.fragment(run_every=2)
+def job_progress(job_id):
+    """Status of a background clearing, polled until it finishes (then the page reloads)."""
+    job = jobs.get_job(job_id)
+    if job['status'] not in jobs.ACTIVE:
+        st.rerun()
+    if job['status'] == 'running':
+        since = (datetime.now() - datetime.fromisoformat(job['started_at'])).total_seconds()
+        st.info(f"⏳ Clearing en cours (job #{job_id}) — {since:.0f} s. Vous pouvez quitter la page, "
+                "le calcul continue en arrière-plan.")
+    else:
+        st.info(f"🕒 Clearing en file d'attente (job #{job_id}).")
+
+
+def batch_panel(job_ids):
+    """Per-session status and clearing time of a batch. Returns the number of pending jobs."""
+    rows = jobs.batch_report(job_ids)
+    pending = sum(r['statut'] in jobs.ACTIVE for r in rows)
+    failed = sum(r['statut'] == 'failed' for r in rows)
+    df = pd.DataFrame(rows)[['session','statut','duree_s','message']]
+    df['statut'] = df['statut'].map(JOB_STATUS)
+    df.columns = ['Session','État','Durée (s)','Résultat']
+    if pending:
+        st.info(f"⏳ Clearing groupé : {len(rows) - pending}/{len(rows)} sessions traitées")
+    elif failed:
+        st.error(f"Clearing groupé terminé : {failed} session(s) en échec sur {len(rows)}")
+    else:
+        st.success(f"Clearing groupé terminé : {len(rows)} sessions clôturées")
+    st.dataframe(df, use_container_width=True, hide_index=True)
+    return pending
+
+
+@st.fragment(run_every=2)
+def batch_progress(job_ids):
+    """Batch panel polled until every job has finished (then the page reloads)."""
+    if not batch_panel(job_ids):
+        st.rerun()
+
+
+def show_clearing_stats(session_id):
+    """Stage timings and model size of the session's clearing, against the other sessions."""
+    r = db.get_results(session_id, ())
+    with st.expander("⏱️ Performance du clearing", expanded=False):
+        if not r or not r['stats']:
+            st.info("Aucune statistique enregistrée pour ce clearing."); return
+        s = r['stats']
+        c1, c2, c3, c4 = st.columns(4)
+        with c1: st.markdown(mcard("Temps total", f"{s['total_ms']:,.0f} ms",
+                                   ENGINES.get(s['moteur'], s['moteur']) + (f" · cache {s['cache']}" if s.get('cache') else ""),
+                                   P), unsafe_allow_html=True)
+        with c2: st.markdown(mcard("Variables", f"{s['nb_variables']:,}", f"{s['nb_binaires']} binaires", INF),
+                             unsafe_allow_html=True)
+        with c3: st.markdown(mcard("Contraintes", f"{s['nb_contraintes']:,}", f"{s['nb_nonzeros']:,} non-zéros", INF),
+                             unsafe_allow_html=True)
+        with c4: st.markdown(mcard("Gap MIP", f"{s['gap_mip']:.2%}" if s.get('gap_mip') is not None else "—",
+                                   f"{s['iterations']} itérations" if s.get('iterations') is not None else "",
+                                   OK if not s.get('gap_mip') else WR), unsafe_allow_html=True)
+        ca, cb = st.columns(2)
+        with ca:
+            fig = go.Figure(go.Bar(x=list(s['temps_ms'].values()), y=[STAGES.get(k, k) for k in s['temps_ms']],
+                                   orientation='h', marker_color=P))
+            fig.update_layout(title="Temps par étape"); fig.update_xaxes(title_text="ms")
+            fig.update_yaxes(autorange='reversed')
+            st.plotly_chart(styled(fig, 300), use_container_width=True, key=f"stats_stages_{session_id}")
+        with cb:
+            hist = pd.DataFrame([{'Session': h['name'], 'Date': h['market_date'], 'Moteur': h['stats']['moteur'],
+                                  'Ordres': h['stats'].get('nb_ordres'), 'Total (ms)': h['stats']['total_ms'],
+                                  **{STAGES.get(k, k): v for k, v in h['stats']['temps_ms'].items()}}
+                                 for h in db.get_clearing_stats()])
+            st.markdown("**Historique des clearings**")
+            st.dataframe(hist, use_container_width=True, hide_index=True, height=260)
+
+
 def admin_users():
     page_hdr("Gestion des Utilisateurs", "Gérer les comptes des acteurs du marché")
 
@@ -841,9 +874,7 @@ def admin_users():
 def admin_audit():
     page_hdr("Audit du Marché", "Journal des actions sur la plateforme")
 
-    sessions = db.get_sessions()
-    sel_s = st.selectbox("Filtrer par session", [None]+sessions,
-        format_func=lambda s: "Toutes les sessions" if s is None else f"{s['name']} — {s['market_date']}")
+    sel_s = session_select("Filtrer par session", key="audit_sess", none_label="Toutes les sessions")
 
     logs = db.get_audit_log(sel_s['id'] if sel_s else None)
     if logs:
@@ -856,79 +887,6 @@ def admin_audit():
 
 # ===================== SIMULATOR PAGE =====================
 
-# Base data for generation
-BASE_OFFRES = [
-    ('Mainstream Solar', 'NGA', 800, 22), ('Egbin Power', 'NGA', 1000, 28),
-    ('Delta Gas', 'NGA', 600, 30), ('Geregu NIPP', 'NGA', 400, 32),
-    ('Okpai IPP', 'NGA', 450, 35), ('Afam VI', 'NGA', 500, 38),
-    ('Olorunsogo', 'NGA', 600, 40),
-    ('VRA Akosombo', 'GHA', 900, 30), ('Sunon Asogli', 'GHA', 300, 52),
-    ('Cenpower Kpone', 'GHA', 200, 62), ('Karpowership GHA', 'GHA', 400, 72),
-    ('CI-Energies Hydro', 'CIV', 600, 28), ('CIPREL Gaz', 'CIV', 400, 45),
-    ('Azito Energie', 'CIV', 300, 50), ('Aggreko CIV', 'CIV', 100, 92),
-    ('OMVS Manantali SEN', 'SEN', 150, 38), ('OMVS Félou MLI', 'MLI', 150, 38),
-    ('SENELEC Thermal', 'SEN', 400, 115),
-    ('OMVG Kaleta', 'GIN', 100, 42), ('OMVG Saltinho', 'GNB', 40, 42),
-    ('OMVG Sambangalou', 'GMB', 30, 42), ('OMVG Sénégal', 'SEN', 30, 42),
-    ('EDG Garafiri', 'GIN', 100, 82),
-    ('ContourGlobal Togo', 'TGO', 100, 98), ('CEB Nangbéto', 'BEN', 50, 105),
-    ('SONABEL Kompienga', 'BFA', 150, 142), ('EDM-SA Gen', 'MLI', 200, 138),
-    ('NAWEC Brikama', 'GMB', 50, 155), ('EAGB Bissau', 'GNB', 30, 165),
-    ('LEC Monrovia', 'LBR', 80, 148), ('EDSA Freetown', 'SLE', 60, 155),
-    ('NIGELEC Niamey', 'NER', 80, 132),
-]
-
-BASE_DEMANDES = [
-    ('TCN', 'NGA', 3500, 120), ('ECG', 'GHA', 1800, 130),
-    ('NEDCO', 'GHA', 400, 125), ('CIE Distribution', 'CIV', 1600, 150),
-    ('SBEE', 'BEN', 400, 160), ('CEET', 'TGO', 300, 155),
-    ('SENELEC', 'SEN', 700, 170), ('SONABEL', 'BFA', 500, 200),
-    ('EDM-SA', 'MLI', 550, 190), ('NIGELEC', 'NER', 350, 210),
-    ('EDG', 'GIN', 400, 160), ('EDSA', 'SLE', 150, 180),
-    ('LEC', 'LBR', 120, 175), ('NAWEC', 'GMB', 80, 190),
-    ('EAGB', 'GNB', 50, 195),
-]
-
-BASE_LIGNES = [
-    ('NGA','BEN',800),('NGA','NER',300),('BEN','TGO',600),('TGO','GHA',500),
-    ('GHA','CIV',600),('GHA','BFA',250),('CIV','BFA',250),('CIV','MLI',250),
-    ('CIV','LBR',400),('LBR','SLE',400),('SLE','GIN',400),('GIN','GNB',300),
-    ('GNB','GMB',300),('GMB','SEN',300),('SEN','MLI',300),
-]
-
-import random
-
-def generate_offres(supply_factor, price_noise):
-    rows = []
-    for m, z, mw, p in BASE_OFFRES:
-        q = max(10, round(mw * supply_factor + random.gauss(0, mw*0.05)))
-        px = max(1, round(p * (1 + random.gauss(0, price_noise/100)), 1))
-        rows.append({'Membre': m, 'Zone': z, 'Quantité (MW)': q, 'Prix (€/MWh)': px})
-    return pd.DataFrame(rows)
-
-
-def generate_demandes(demand_factor, price_noise):
-    rows = []
-    for m, z, mw, p in BASE_DEMANDES:
-        q = max(10, round(mw * demand_factor + random.gauss(0, mw*0.05)))
-        px = max(1, round(p * (1 + random.gauss(0, price_noise/100)), 1))
-        rows.append({'Membre': m, 'Zone': z, 'Quantité (MW)': q, 'Prix (€/MWh)': px})
-    return pd.DataFrame(rows)
-
-
-def run_sim_clearing(offres_df, demandes_df, lignes_df):
-    """Run clearing from DataFrames (standalone mode)."""
-    offres_list = [{'membre': r['Membre'], 'zone': r['Zone'],
-                    'quantite_mw': r['Quantité (MW)'], 'prix_eur': r['Prix (€/MWh)']}
-                   for _, r in offres_df.iterrows()]
-    demandes_list = [{'membre': r['Membre'], 'zone': r['Zone'],
-                      'quantite_mw': r['Quantité (MW)'], 'prix_eur': r['Prix (€/MWh)']}
-                     for _, r in demandes_df.iterrows()]
-    network_list = [{'zone_from': r['De'], 'zone_to': r['Vers'], 'ntc_mw': r['NTC (MW)']}
-                    for _, r in lignes_df.iterrows()]
-    return run_clearing_engine(offres_list, demandes_list, network_list)
-
-
 def plot_merit_order(offres_df, zone, prix_clearing=None):
     zo = offres_df[offres_df['Zone']==zone].sort_values('Prix (€/MWh)')
     if zo.empty: return None
@@ -1104,13 +1062,17 @@ def admin_simulator():
     st.markdown("---")
 
     rc1, rc2, rc3 = st.columns([1, 2, 1])
+    with rc1:
+        engine = st.selectbox("Moteur", list(ENGINES), format_func=ENGINES.get, key="sim_engine")
+        mode = st.selectbox("Formulation", list(MODES), format_func=MODES.get, key="sim_mode")
+        aggregate = st.checkbox("Agréger les offres de même prix", value=True, key="sim_aggregate")
     with rc2:
         if st.button("⚡  Lancer le Market Clearing", type="primary", use_container_width=True, key="sim_clear"):
             with st.spinner("Résolution du MILP..."):
-                result = run_sim_clearing(
+                result = cached_clearing(*sim_inputs(
                     st.session_state.sim_offres,
                     st.session_state.sim_demandes,
-                    st.session_state.sim_lignes)
+                    st.session_state.sim_lignes), engine=engine, mode=mode, aggregate=aggregate)
             if result:
                 st.session_state.sim_result = result
                 st.success(f"✅  Welfare social : **{result['welfare']:,.0f} €**")
@@ -1118,6 +1080,10 @@ def admin_simulator():
                 st.rerun()
             else:
                 st.error("❌  Problème infaisable. Vérifiez les données.")
+    with rc3:
+        cs = cache_stats()
+        st.caption(f"Cache clearing : {cs['hits']} mémoire · {cs['disk_hits']} disque · "
+                   f"{cs['misses']} calculs ({cs['hit_rate']:.0%} de hits)")
 
     # ========== RESULTS ==========
     if st.session_state.sim_result:
@@ -1261,7 +1227,7 @@ def admin_simulator():
                          for o in odf if o['volume_accepte']>0)
                 sc = sum((d['prix_eur']-res['prix'].get(d['zone'],0))*d['volume_servi']
                          for d in ddf if d['volume_servi']>0)
-                rc = res['welfare'] - sp - sc
+                rc = res['rente_congestion']
                 fig = go.Figure(go.Pie(
                     labels=['Surplus consommateurs','Surplus producteurs','Rente de congestion'],
                     values=[max(0,sc), max(0,sp), rc],
@@ -1281,24 +1247,110 @@ def admin_simulator():
                         title="Positions nettes par zone")
                     st.plotly_chart(styled(fig, 420), use_container_width=True)
 
+    # ========== SCENARIO SWEEP ==========
+    st.markdown("---")
+    st.markdown("### 🧮 Balayage de scénarios")
+    st.caption("Génère la grille de tous les scénarios sur les plages choisies et les résout en parallèle "
+               "(un processus par cœur, formulation LP). Les résultats s'affichent au fil de l'eau.")
+    params = {'supply_factor': 'Offre (×)', 'demand_factor': 'Demande (×)',
+              'price_noise': 'Bruit prix (%)', 'ntc_factor': 'NTC (×)'}
+    bc1, bc2, bc3, bc4 = st.columns(4)
+    sf_r = bc1.slider("Offre (×)", 0.5, 2.0, (0.8, 1.4), 0.1, key="sw_sf")
+    sf_n = bc1.number_input("Valeurs", 1, 10, 4, key="sw_sf_n")
+    df_r = bc2.slider("Demande (×)", 0.5, 2.0, (0.8, 1.4), 0.1, key="sw_df")
+    df_n = bc2.number_input("Valeurs", 1, 10, 4, key="sw_df_n")
+    pn_r = bc3.slider("Bruit prix (%)", 0, 30, (5, 5), 1, key="sw_pn")
+    pn_n = bc3.number_input("Valeurs", 1, 10, 1, key="sw_pn_n")
+    nf_r = bc4.slider("NTC (×)", 0.3, 3.0, (0.5, 1.5), 0.1, key="sw_nf")
+    nf_n = bc4.number_input("Valeurs", 1, 10, 3, key="sw_nf_n")
+    grid = scenario_grid(sweep_values(*sf_r, sf_n), sweep_values(*df_r, df_n),
+                         sweep_values(*pn_r, pn_n), sweep_values(*nf_r, nf_n))
+
+    bb1, bb2 = st.columns([1, 3])
+    sw_engine = bb1.selectbox("Moteur", list(ENGINES), index=list(ENGINES).index('sparse'),
+                              format_func=ENGINES.get, key="sw_engine")
+    if bb2.button(f"🚀 Lancer {len(grid)} scénarios", type="primary", key="sw_run"):
+        rows, last = [], 0.0
+        t0 = time.perf_counter()
+        bar, live = st.progress(0.0), st.empty()
+        for row in run_sweep(grid, engine=sw_engine):
+            rows.append(row)
+            bar.progress(len(rows)/len(grid), text=f"{len(rows)} / {len(grid)} scénarios résolus")
+            if time.perf_counter() - last > 0.5 or len(rows) == len(grid):
+                live.dataframe(pd.DataFrame(rows)[list(params) + ['statut']], use_container_width=True,
+                               hide_index=True, height=240)
+                last = time.perf_counter()
+        live.empty()
+        st.session_state.sim_sweep = pd.DataFrame(rows).sort_values(list(params)).reset_index(drop=True)
+        st.success(f"{len(rows)} scénarios résolus en {time.perf_counter()-t0:.1f} s")
+
+    sw = st.session_state.get('sim_sweep')
+    if sw is not None and not sw.empty:
+        ok = sw[sw['statut'] == 'OK']
+        cols = {**params, 'statut': 'Statut', 'welfare': 'Welfare (€)', 'prix_moyen': 'Prix moyen (€/MWh)',
+                'echanges': 'Échanges (MW)', 'congestions': 'Congestions', 'rente': 'Rente de congestion (€)',
+                'lignes_saturees': 'Lignes saturées'}
+        st.dataframe(sw[[c for c in cols if c in sw]].rename(columns=cols),
+                     use_container_width=True, hide_index=True, height=320)
+        if not ok.empty:
+            hc1, hc2, hc3 = st.columns(3)
+            metrics = {'welfare': 'Welfare (€)', 'prix_moyen': 'Prix moyen (€/MWh)',
+                       'congestions': 'Lignes saturées', 'rente': 'Rente de congestion (€)',
+                       'echanges': 'Échanges (MW)'}
+            metric = hc1.selectbox("Indicateur", list(metrics), format_func=metrics.get, key="sw_metric")
+            ax_x = hc2.selectbox("Axe X", list(params), index=0, format_func=params.get, key="sw_ax_x")
+            ax_y = hc3.selectbox("Axe Y", [p for p in params if p != ax_x], format_func=params.get, key="sw_ax_y")
+            pv = ok.pivot_table(index=ax_y, columns=ax_x, values=metric, aggfunc='mean')
+            fig = go.Figure(go.Heatmap(z=pv.values, x=[str(c) for c in pv.columns], y=[str(i) for i in pv.index],
+                colorscale='RdYlBu_r', colorbar=dict(title=metrics[metric]),
+                hovertemplate=f"{params[ax_x]} %{{x}}<br>{params[ax_y]} %{{y}}<br>{metrics[metric]} : %{{z:,.1f}}<extra></extra>"))
+            fig.update_layout(title=f"{metrics[metric]} — moyenne sur les autres paramètres")
+            fig.update_xaxes(title_text=params[ax_x], type='category')
+            fig.update_yaxes(title_text=params[ax_y], type='category')
+            st.plotly_chart(styled(fig, 420), use_container_width=True, key="sw_heat_metric")
+
+            labels = ok.apply(lambda r: f"O×{r['supply_factor']} D×{r['demand_factor']} "
+                                        f"B{r['price_noise']:g}% N×{r['ntc_factor']}", axis=1)
+            fig = go.Figure(go.Heatmap(z=ok[[f'prix_{z}' for z in ZONES]].values, x=ZONES, y=labels,
+                colorscale='RdYlBu_r', colorbar=dict(title='€/MWh')))
+            fig.update_layout(title="Prix zonaux par scénario")
+            st.plotly_chart(styled(fig, max(300, 18*len(ok) + 120)), use_container_width=True, key="sw_heat_prix")
+
 
 # ===================== PARTICIPANT PAGE (unified) =====================
 
+def bid_preview(session_id, side, zone, quantite, prix):
+    """Expected acceptance and zonal price of a bid on the current order book, without submitting it."""
+    offres, demandes = db.get_order_book(session_id)
+    t0 = time.perf_counter()
+    r = preview_bid(session_id, offres, demandes, db.get_network(session_id), side, zone, quantite, prix)
+    ms = (time.perf_counter() - t0) * 1000
+    if r is None:
+        st.error("Problème infaisable."); return
+    c1, c2 = st.columns(2)
+    with c1: st.markdown(mcard("Acceptation attendue", f"{r['ratio']:.0%}",
+                               f"{r['volume_mw']:,.0f} MW sur {quantite:,.0f}",
+                               OK if r['ratio'] > 0.99 else (WR if r['ratio'] > 0.01 else ER)), unsafe_allow_html=True)
+    with c2: st.markdown(mcard(f"Prix zonal attendu {ZONE_FLAGS.get(zone,'')} {zone}",
+                               f"{r['prix_zone']:.2f} €/MWh", "", P), unsafe_allow_html=True)
+    if r['marginal']:
+        st.info("Votre prix fixe le prix de la zone : l'acceptation peut n'être que partielle, "
+                "selon les autres ordres au même prix.")
+    st.caption(f"Estimation sur le carnet actuel ({len(offres)} offres · {len(demandes)} demandes), "
+               f"clearing LP, calculée en {ms:.0f} ms. Indicative : le carnet évolue jusqu'à la fermeture.")
+
+
 def participant_dashboard():
     user = st.session_state.user
     page_hdr(f"Portail Marché — {user['display_name']}",
              f"{user['organisation']} · Zone : {ZONE_FLAGS.get(user.get('zone',''),'')}{user.get('zone','N/A')}")
 
-    sessions = db.get_sessions()
-    open_sessions = [s for s in sessions if s['status'] == 'ouverte']
-    closed_sessions = [s for s in sessions if s['status'] == 'cloturee']
-
     # ===== OPEN SESSION — Submit offers & demands =====
-    if not open_sessions:
+    sel = session_select("📅 Session ouverte", 'ouverte', key="part_open",
+        format_func=lambda s: f"{s['name']} — {s['market_date']} ({s['nb_offres']} offres · {s['nb_demandes']} demandes)")
+    if not sel:
         st.info("Aucune session ouverte actuellement.")
     else:
-        sel = st.selectbox("📅 Session ouverte", open_sessions,
-            format_func=lambda s: f"{s['name']} — {s['market_date']} ({s['nb_offres']} offres · {s['nb_demandes']} demandes)")
         sid = sel['id']
 
         tab_sell, tab_buy, tab_my = st.tabs(["📤 Soumettre une offre de vente", "📥 Soumettre une demande d'achat", "📋 Mes soumissions"])
@@ -1318,12 +1370,16 @@ def participant_dashboard():
                 quantite_o = c3.number_input("Quantité (MW)", min_value=1, value=100, step=10, key="off_mw")
                 prix_o = c4.number_input("Prix minimum (€/MWh)", min_value=0.0, value=50.0, step=1.0, key="off_prix")
 
-                if st.form_submit_button("📤 Soumettre l'offre", type="primary"):
+                b1, b2 = st.columns(2)
+                sim_o = b2.form_submit_button("🔮 Simuler l'impact")
+                if b1.form_submit_button("📤 Soumettre l'offre", type="primary"):
                     db.add_offre(sid, user['id'], membre_o, zone_o, quantite_o, prix_o)
                     db.log_action(sid, user['id'], "Soumission offre",
                                   f"{membre_o} — {quantite_o} MW @ {prix_o} €/MWh")
                     st.success(f"Offre soumise : {quantite_o} MW @ {prix_o} €/MWh")
                     st.rerun()
+            if sim_o:
+                bid_preview(sid, 'offre', zone_o, quantite_o, prix_o)
 
         with tab_buy:
             st.markdown(f"""
@@ -1340,12 +1396,16 @@ def participant_dashboard():
                 quantite_d = c3.number_input("Quantité (MW)", min_value=1, value=500, step=10, key="dem_mw")
                 prix_d = c4.number_input("Prix maximum (€/MWh)", min_value=0.0, value=150.0, step=1.0, key="dem_prix")
 
-                if st.form_submit_button("📥 Soumettre la demande", type="primary"):
+                b1, b2 = st.columns(2)
+                sim_d = b2.form_submit_button("🔮 Simuler l'impact")
+                if b1.form_submit_button("📥 Soumettre la demande", type="primary"):
                     db.add_demande(sid, user['id'], membre_d, zone_d, quantite_d, prix_d)
                     db.log_action(sid, user['id'], "Soumission demande",
                                   f"{membre_d} — {quantite_d} MW @ {prix_d} €/MWh")
                     st.success(f"Demande soumise : {quantite_d} MW @ {prix_d} €/MWh")
                     st.rerun()
+            if sim_d:
+                bid_preview(sid, 'demande', zone_d, quantite_d, prix_d)
 
         with tab_my:
             # My offers
@@ -1382,11 +1442,10 @@ def participant_dashboard():
                 st.caption("Aucune demande soumise")
 
     # ===== RESULTS from closed sessions =====
-    if closed_sessions:
+    if db.count_sessions('cloturee'):
         st.markdown("---")
         st.markdown("#### 📊 Résultats des sessions clôturées")
-        sel_c = st.selectbox("Session", closed_sessions,
-            format_func=lambda s: f"{s['name']} — {s['market_date']}", key="part_closed")
+        sel_c = session_select("Session", 'cloturee', key="part_closed")
         show_results_panel(sel_c['id'])
 
 
@@ -1395,13 +1454,10 @@ def participant_dashboard():
 def tso_dashboard():
     page_hdr("Contraintes Réseau", "Configuration des capacités de transfert (NTC)")
 
-    sessions = db.get_sessions()
-    active = [s for s in sessions if s['status'] in ('ouverte','fermee')]
-    if not active:
-        st.info("Aucune session active."); return
-
-    sel = st.selectbox("Session", active,
+    sel = session_select("Session", ('ouverte','fermee'), key="tso_active",
         format_func=lambda s: f"{s['name']} — {s['market_date']} ({STATUS_MAP[s['status']][0]})")
+    if not sel:
+        st.info("Aucune session active."); return
     sid = sel['id']
 
     net = db.get_network(sid)
@@ -1418,12 +1474,47 @@ def tso_dashboard():
                           f"{n['zone_from']}-{n['zone_to']}: {new_ntc} MW")
             st.success("NTC mis à jour"); st.rerun()
 
-    closed = [s for s in sessions if s['status'] == 'cloturee']
-    if closed:
+    # What-if: re-clear with the NTC values being edited, without saving them
+    st.markdown("---")
+    st.markdown("#### Prévisualiser l'impact")
+    changes = {n['id']: st.session_state[f"ntc_{n['id']}"] for n in net
+               if st.session_state.get(f"ntc_{n['id']}", n['ntc_mw']) != n['ntc_mw']}
+    st.caption(f"{len(changes)} NTC modifiée(s) non enregistrée(s) — le clearing est recalculé "
+               "à partir du dernier modèle résolu de la session, sans modifier la base.")
+    if st.button("🔍 Prévisualiser l'impact", key="ntc_preview"):
+        offres = db.get_offres(sid)
+        demandes = db.get_demandes(sid)
+        if not offres or not demandes:
+            st.info("Il faut au moins une offre et une demande pour prévisualiser.")
+        else:
+            base = preview_ntc(sid, offres, demandes, net, {})
+            t0 = time.perf_counter()
+            res = preview_ntc(sid, offres, demandes, net, changes)
+            ms = (time.perf_counter() - t0) * 1000
+            if not base or not res:
+                st.error("Problème infaisable.")
+            else:
+                c1, c2, c3 = st.columns(3)
+                dw = res['welfare'] - base['welfare']
+                with c1: st.markdown(mcard("Welfare simulé", f"{res['welfare']:,.0f} €", f"{dw:+,.0f} € vs NTC actuelles",
+                                           OK if dw >= 0 else ER), unsafe_allow_html=True)
+                nz = sum(1 for z in ZONES if abs(res['prix'][z] - base['prix'][z]) > 0.01)
+                with c2: st.markdown(mcard("Zones impactées", str(nz), "prix modifié", WR if nz else OK), unsafe_allow_html=True)
+                with c3: st.markdown(mcard("Recalcul", f"{ms:.0f} ms", "re-optimisation à chaud", INF), unsafe_allow_html=True)
+                ca, cb = st.columns([1, 1.3])
+                with ca:
+                    pdf = pd.DataFrame([{'Zone': f"{ZONE_FLAGS[z]} {z}", 'Prix actuel': base['prix'][z],
+                        'Prix simulé': res['prix'][z], 'Δ (€/MWh)': round(res['prix'][z] - base['prix'][z], 2)}
+                        for z in ZONES])
+                    st.dataframe(pdf, use_container_width=True, hide_index=True, height=520)
+                with cb:
+                    sim_net = [{**n, 'ntc_mw': changes.get(n['id'], n['ntc_mw'])} for n in net]
+                    st.plotly_chart(plot_network_results(res, sim_net), use_container_width=True)
+
+    if db.count_sessions('cloturee'):
         st.markdown("---")
         st.markdown("#### Résultats")
-        sel_c = st.selectbox("Session clôturée", closed,
-            format_func=lambda s: f"{s['name']} — {s['market_date']}", key="tso_closed")
+        sel_c = session_select("Session clôturée", 'cloturee', key="tso_closed")
         show_results_panel(sel_c['id'])
 
 
@@ -1432,17 +1523,21 @@ def tso_dashboard():
 def regulator_dashboard():
     page_hdr("Supervision du Marché", "Accès en lecture — Audit et résultats")
 
-    sessions = db.get_sessions()
-    if not sessions:
+    if not db.count_sessions():
         st.info("Aucune session."); return
 
     tab_r, tab_a = st.tabs(["📊 Résultats","📋 Audit"])
     with tab_r:
-        closed = [s for s in sessions if s['status'] == 'cloturee']
+        closed = db.count_sessions('cloturee')
         if closed:
-            sel = st.selectbox("Session", closed,
-                format_func=lambda s: f"{s['name']} — {s['market_date']}", key="reg_sel")
+            sel = session_select("Session", 'cloturee', key="reg_sel")
             show_results_panel(sel['id'])
+            if closed > 1:
+                hist = pd.DataFrame(db.get_zone_prices())
+                fig = px.line(hist, x='market_date', y='prix_eur', color='zone', markers=True,
+                              title="Historique des prix zonaux")
+                fig.update_xaxes(title_text=""); fig.update_yaxes(title_text="€/MWh")
+                st.plotly_chart(styled(fig, 420), use_container_width=True)
         else:
             st.info("Aucune session clôturée.")
 
@@ -1576,7 +1671,10 @@ def main_app():
 
 # ===================== MAIN =====================
 
-if 'user' not in st.session_state:
-    login_page()
-else:
-    main_app()
\ No newline at end of file
+# Worker processes are spawned and re-import this script as __mp_main__: they must not run the app
+if __name__ == '__main__':
+    jobs.start_workers()
+    if 'user' not in st.session_state:
+        login_page()
+    else:
+        main_app()
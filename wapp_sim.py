@@ -0,0 +1,282 @@
+"""
+WAPP DAM Platform — Scenario simulator
+Reference WAPP order book, scenario generators and clearing from the simulator DataFrames.
+"""
+import itertools
+import multiprocessing
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from wapp_engine import ZONES, ENGINES, run_clearing_engine
+
+# Engines whose optimum is exact; ADMM converges to a tolerance and is checked by check_admm
+EXACT_ENGINES = tuple(e for e in ENGINES if e != 'admm')
+
+# Base data for generation
+BASE_OFFRES = [
+    ('Mainstream Solar', 'NGA', 800, 22), ('Egbin Power', 'NGA', 1000, 28),
+    ('Delta Gas', 'NGA', 600, 30), ('Geregu NIPP', 'NGA', 400, 32),
+    ('Okpai IPP', 'NGA', 450, 35), ('Afam VI', 'NGA', 500, 38),
+    ('Olorunsogo', 'NGA', 600, 40),
+    ('VRA Akosombo', 'GHA', 900, 30), ('Sunon Asogli', 'GHA', 300, 52),
+    ('Cenpower Kpone', 'GHA', 200, 62), ('Karpowership GHA', 'GHA', 400, 72),
+    ('CI-Energies Hydro', 'CIV', 600, 28), ('CIPREL Gaz', 'CIV', 400, 45),
+    ('Azito Energie', 'CIV', 300, 50), ('Aggreko CIV', 'CIV', 100, 92),
+    ('OMVS Manantali SEN', 'SEN', 150, 38), ('OMVS Félou MLI', 'MLI', 150, 38),
+    ('SENELEC Thermal', 'SEN', 400, 115),
+    ('OMVG Kaleta', 'GIN', 100, 42), ('OMVG Saltinho', 'GNB', 40, 42),
+    ('OMVG Sambangalou', 'GMB', 30, 42), ('OMVG Sénégal', 'SEN', 30, 42),
+    ('EDG Garafiri', 'GIN', 100, 82),
+    ('ContourGlobal Togo', 'TGO', 100, 98), ('CEB Nangbéto', 'BEN', 50, 105),
+    ('SONABEL Kompienga', 'BFA', 150, 142), ('EDM-SA Gen', 'MLI', 200, 138),
+    ('NAWEC Brikama', 'GMB', 50, 155), ('EAGB Bissau', 'GNB', 30, 165),
+    ('LEC Monrovia', 'LBR', 80, 148), ('EDSA Freetown', 'SLE', 60, 155),
+    ('NIGELEC Niamey', 'NER', 80, 132),
+]
+
+BASE_DEMANDES = [
+    ('TCN', 'NGA', 3500, 120), ('ECG', 'GHA', 1800, 130),
+    ('NEDCO', 'GHA', 400, 125), ('CIE Distribution', 'CIV', 1600, 150),
+    ('SBEE', 'BEN', 400, 160), ('CEET', 'TGO', 300, 155),
+    ('SENELEC', 'SEN', 700, 170), ('SONABEL', 'BFA', 500, 200),
+    ('EDM-SA', 'MLI', 550, 190), ('NIGELEC', 'NER', 350, 210),
+    ('EDG', 'GIN', 400, 160), ('EDSA', 'SLE', 150, 180),
+    ('LEC', 'LBR', 120, 175), ('NAWEC', 'GMB', 80, 190),
+    ('EAGB', 'GNB', 50, 195),
+]
+
+BASE_LIGNES = [
+    ('NGA','BEN',800),('NGA','NER',300),('BEN','TGO',600),('TGO','GHA',500),
+    ('GHA','CIV',600),('GHA','BFA',250),('CIV','BFA',250),('CIV','MLI',250),
+    ('CIV','LBR',400),('LBR','SLE',400),('SLE','GIN',400),('GIN','GNB',300),
+    ('GNB','GMB',300),('GMB','SEN',300),('SEN','MLI',300),
+]
+
+# Simulator DataFrame columns → engine input fields
+_SIM_COLS = {'Membre': 'membre', 'Zone': 'zone', 'Quantité (MW)': 'quantite_mw', 'Prix (€/MWh)': 'prix_eur'}
+
+
+def generate_offres(supply_factor, price_noise):
+    rows = []
+    for m, z, mw, p in BASE_OFFRES:
+        q = max(10, round(mw * supply_factor + random.gauss(0, mw*0.05)))
+        px = max(1, round(p * (1 + random.gauss(0, price_noise/100)), 1))
+        rows.append({'Membre': m, 'Zone': z, 'Quantité (MW)': q, 'Prix (€/MWh)': px})
+    return pd.DataFrame(rows)
+
+
+def generate_demandes(demand_factor, price_noise):
+    rows = []
+    for m, z, mw, p in BASE_DEMANDES:
+        q = max(10, round(mw * demand_factor + random.gauss(0, mw*0.05)))
+        px = max(1, round(p * (1 + random.gauss(0, price_noise/100)), 1))
+        rows.append({'Membre': m, 'Zone': z, 'Quantité (MW)': q, 'Prix (€/MWh)': px})
+    return pd.DataFrame(rows)
+
+
+def sim_inputs(offres_df, demandes_df, lignes_df):
+    """Engine input lists (offres, demandes, network) from the simulator DataFrames."""
+    offres_list = [{'membre': r['Membre'], 'zone': r['Zone'],
+                    'quantite_mw': r['Quantité (MW)'], 'prix_eur': r['Prix (€/MWh)']}
+                   for _, r in offres_df.iterrows()]
+    demandes_list = [{'membre': r['Membre'], 'zone': r['Zone'],
+                      'quantite_mw': r['Quantité (MW)'], 'prix_eur': r['Prix (€/MWh)']}
+                     for _, r in demandes_df.iterrows()]
+    network_list = [{'zone_from': r['De'], 'zone_to': r['Vers'], 'ntc_mw': r['NTC (MW)']}
+                    for _, r in lignes_df.iterrows()]
+    return offres_list, demandes_list, network_list
+
+
+def run_sim_clearing(offres_df, demandes_df, lignes_df, engine='pyomo', mode='milp', aggregate=True):
+    """Run clearing from DataFrames (standalone mode)."""
+    return run_clearing_engine(*sim_inputs(offres_df, demandes_df, lignes_df),
+                               engine=engine, mode=mode, aggregate=aggregate)
+
+
+# ===================== SCENARIO SWEEP =====================
+
+def sweep_values(lo, hi, n):
+    """`n` evenly spaced values over [lo, hi], rounded for display."""
+    return sorted({round(float(v), 2) for v in np.linspace(lo, hi, max(1, n))})
+
+
+def scenario_grid(supply_factors, demand_factors, price_noises, ntc_factors, seed=0):
+    """Cartesian product of the parameter values, one dict per scenario.
+
+    The random seed only depends on the order-book parameters, so scenarios that differ
+    by their NTC factor clear the same generated bids.
+    """
+    grid = []
+    for k, (sf, df, pn) in enumerate(itertools.product(supply_factors, demand_factors, price_noises)):
+        for nf in ntc_factors:
+            grid.append({'supply_factor': sf, 'demand_factor': df, 'price_noise': pn,
+                         'ntc_factor': nf, 'seed': seed + k})
+    return grid
+
+
+def clear_scenario(sc, engine='sparse', mode='lp'):
+    """Generate and clear one scenario of `scenario_grid`; returns a flat summary row."""
+    random.seed(sc['seed'])
+    offres = generate_offres(sc['supply_factor'], sc['price_noise']).rename(columns=_SIM_COLS).to_dict('records')
+    demandes = generate_demandes(sc['demand_factor'], sc['price_noise']).rename(columns=_SIM_COLS).to_dict('records')
+    network = [{'zone_from': u, 'zone_to': v, 'ntc_mw': round(c * sc['ntc_factor'])} for u, v, c in BASE_LIGNES]
+    res = run_clearing_engine(offres, demandes, network, engine=engine, mode=mode)
+    row = dict(sc, statut='OK' if res else 'Infaisable')
+    if res:
+        pv = list(res['prix'].values())
+        row.update(welfare=res['welfare'], prix_moyen=round(sum(pv)/len(pv), 2),
+                   echanges=round(sum(f['flux_mw'] for f in res['flux']), 1),
+                   congestions=sum(1 for f in res['flux'] if f['saturee']),
+                   rente=res['rente_congestion'],
+                   lignes_saturees=', '.join(f"{f['de']}→{f['vers']}" for f in res['flux'] if f['saturee']),
+                   **{f'prix_{z}': res['prix'][z] for z in ZONES})
+    return row
+
+
+def run_sweep(scenarios, engine='sparse', mode='lp', workers=None):
+    """Clear `scenarios` in a process pool (one worker per core by default, in-process on one).
+
+    Yields the summary rows in completion order. Workers are spawned rather than forked:
+    the caller may hold HiGHS instances whose threads would not survive a fork.
+    """
+    workers = min(workers or os.cpu_count() or 1, len(scenarios))
+    if workers <= 1:
+        # A pool only adds the workers' start-up cost on a single core
+        for sc in scenarios:
+            try:
+                yield clear_scenario(sc, engine, mode)
+            except Exception as e:
+                yield dict(sc, statut=f"Erreur : {e}")
+        return
+
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as ex:
+        futures = {ex.submit(clear_scenario, sc, engine, mode): sc for sc in scenarios}
+        for fut in as_completed(futures):
+            try:
+                yield fut.result()
+            except Exception as e:
+                yield dict(futures[fut], statut=f"Erreur : {e}")
+
+
+# ===================== REGRESSION CHECK =====================
+
+def base_market():
+    """Reference order book and default 15-line network as engine input lists."""
+    offres = [{'membre': m, 'zone': z, 'quantite_mw': q, 'prix_eur': p} for m, z, q, p in BASE_OFFRES]
+    demandes = [{'membre': m, 'zone': z, 'quantite_mw': q, 'prix_eur': p} for m, z, q, p in BASE_DEMANDES]
+    network = [{'zone_from': u, 'zone_to': v, 'ntc_mw': c} for u, v, c in BASE_LIGNES]
+    return offres, demandes, network
+
+
+def supports_prices(res, network_list, tol=0.01):
+    """True when the zonal prices in `res` are market-clearing for its dispatch.
+
+    In-the-money bids must be fully accepted, out-of-the-money bids rejected, partial
+    bids priced at the zonal price, and prices may only differ across saturated lines
+    (higher on the importing side).
+    """
+    prix = res['prix']
+    for o in res['offres']:
+        p, lam = o['prix_eur'], prix[o['zone']]
+        if (o['ratio'] > 0.001 and p > lam + tol) or (o['ratio'] < 0.999 and p < lam - tol):
+            return False
+    for d in res['demandes']:
+        p, lam = d['prix_eur'], prix[d['zone']]
+        if (d['ratio'] > 0.001 and p < lam - tol) or (d['ratio'] < 0.999 and p > lam + tol):
+            return False
+    flux = {(f['de'], f['vers']): f for f in res['flux']}
+    for n in network_list:
+        u, v = n['zone_from'], n['zone_to']
+        f = flux.get((u, v)) or flux.get((v, u))
+        if f and f['saturee']:
+            if prix[f['vers']] < prix[f['de']] - tol:
+                return False
+        elif abs(prix[u] - prix[v]) > tol:
+            return False
+    return True
+
+
+def _check_cases(n_scenarios, seed):
+    """Default network and (name, offres, demandes) cases: reference book + seeded scenarios."""
+    offres, demandes, network = base_market()
+    cases = [('base', offres, demandes)]
+    random.seed(seed)
+    for k in range(n_scenarios):
+        sf, df, pn = random.uniform(0.5, 2), random.uniform(0.5, 2), random.randint(0, 30)
+        o = generate_offres(sf, pn).rename(columns=_SIM_COLS).to_dict('records')
+        d = generate_demandes(df, pn).rename(columns=_SIM_COLS).to_dict('records')
+        cases.append((f"scénario {k+1} (O×{sf:.2f}, D×{df:.2f}, bruit {pn}%)", o, d))
+    return network, cases
+
+
+def check_lp_mode(engines=EXACT_ENGINES, n_scenarios=5, seed=0):
+    """Assert mode='lp' reproduces the two-pass MILP results on the default network.
+
+    Runs the reference order book plus `n_scenarios` seeded random scenarios through
+    each engine in both modes. Welfare must match to the cent. Prices, per-bid results
+    and positions must be identical, unless the optimum is degenerate (a bid priced at
+    its zonal price, or a zone boxed in by saturated lines): both results must then be
+    market-clearing for their own dispatch. Line flows are only unique up to a loop
+    flow around the CIV–MLI–SEN–GMB–GNB–GIN–SLE–LBR ring, so they are checked for NTC
+    feasibility and against the positions instead.
+    """
+    network, cases = _check_cases(n_scenarios, seed)
+    ntc = {(n['zone_from'], n['zone_to']): n['ntc_mw'] for n in network}
+    for engine in engines:
+        for name, o, d in cases:
+            ref = run_clearing_engine(o, d, network, engine=engine, mode='milp')
+            fast = run_clearing_engine(o, d, network, engine=engine, mode='lp')
+            assert ref is not None and fast is not None, f"{engine} / {name}: clearing infaisable"
+            assert abs(ref['welfare'] - fast['welfare']) <= 0.01, \
+                f"{engine} / {name}: welfare {ref['welfare']} ≠ {fast['welfare']}"
+            same = all(ref[k] == fast[k] for k in ('prix', 'offres', 'demandes', 'positions'))
+            if not same:
+                assert supports_prices(ref, network) and supports_prices(fast, network), \
+                    f"{engine} / {name}: résultats divergents\n{ref['prix']}\n{fast['prix']}"
+            net = dict.fromkeys(fast['positions'], 0)
+            for f in fast['flux']:
+                assert f['flux_mw'] <= ntc.get((f['de'], f['vers']), ntc.get((f['vers'], f['de']))) + 0.1
+                net[f['de']] += f['flux_mw']; net[f['vers']] -= f['flux_mw']
+            for z, p in fast['positions'].items():
+                assert abs(net[z] - p) <= 0.1 * len(network), f"{engine} / {name}: flux incohérents en {z}"
+            print(f"OK  {engine:<7} {name} — welfare {ref['welfare']:,.0f} €"
+                  + ("" if same else " (optimum dégénéré, équilibres équivalents)"))
+
+
+def check_engines(engines=EXACT_ENGINES, n_scenarios=5, seed=0):
+    """Assert every engine reaches the welfare of the Pyomo MILP with market-clearing prices."""
+    network, cases = _check_cases(n_scenarios, seed)
+    for name, o, d in cases:
+        ref = run_clearing_engine(o, d, network)
+        for engine in engines:
+            res = run_clearing_engine(o, d, network, engine=engine, mode='lp')
+            assert res is not None, f"{engine} / {name}: clearing infaisable"
+            assert abs(ref['welfare'] - res['welfare']) <= 0.01, \
+                f"{engine} / {name}: welfare {res['welfare']} ≠ {ref['welfare']}"
+            assert supports_prices(res, network), f"{engine} / {name}: prix non compatibles\n{res['prix']}"
+        print(f"OK  {name} — {', '.join(engines)} — welfare {ref['welfare']:,.0f} €")
+
+
+def check_admm(n_scenarios=5, seed=0, tol_welfare=1e-5, tol_prix=0.05):
+    """Assert the ADMM engine converges to the Pyomo welfare (relative `tol_welfare`) with
+    prices market-clearing to within `tol_prix` €/MWh."""
+    network, cases = _check_cases(n_scenarios, seed)
+    for name, o, d in cases:
+        ref = run_clearing_engine(o, d, network)
+        res = run_clearing_engine(o, d, network, engine='admm', mode='lp')
+        assert res is not None and res['statut'] == 'optimal', f"admm / {name}: non convergé"
+        assert abs(ref['welfare'] - res['welfare']) <= tol_welfare * abs(ref['welfare']), \
+            f"admm / {name}: welfare {res['welfare']} ≠ {ref['welfare']}"
+        assert supports_prices(res, network, tol_prix), f"admm / {name}: prix non compatibles\n{res['prix']}"
+        print(f"OK  admm    {name} — {res['stats']['iterations']} itérations, welfare {res['welfare']:,.0f} €")
+
+
+if __name__ == '__main__':
+    check_lp_mode()
+    check_engines()
+    check_admm()